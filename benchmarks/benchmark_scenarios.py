@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""Performance benchmarks for the canonical Parcels test scenarios
+
+Sweeps particle count, grid size, integrator and execution mode over
+the grids generated in ``tests/`` and records throughput, code
+generation, compilation and library load times and peak memory for
+each run. Results are written as JSON and can be compared against the
+results of an earlier run, in which case slower runs are flagged as
+regressions. Throughput depends on the machine, so no baseline is kept
+in the repository; record one on the same machine, e.g. from the
+commit to compare against. Configurations that fail are recorded with
+their error and reported, while the remaining ones still run.
+
+Example usage:
+    python benchmarks/benchmark_scenarios.py -s peninsula -p 100 1000 \\
+        -o baseline.json
+    (apply the changes to benchmark)
+    python benchmarks/benchmark_scenarios.py -s peninsula -p 100 1000 \\
+        -o bench.json --baseline baseline.json
+"""
+from parcels import JITParticle, Particle
+from parcels import AdvectionRK4, AdvectionEE, AdvectionRK45
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from itertools import product
+from datetime import timedelta as delta
+from timeit import default_timer as timer
+from os import path
+import numpy as np
+import platform
+import resource
+import json
+import sys
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), path.pardir, 'tests'))
+from test_moving_eddies import moving_eddies_grid  # NOQA
+from test_peninsula import peninsula_grid, UpdateP  # NOQA
+from test_stommel import stommel_grid  # NOQA
+
+
+method = {'RK4': AdvectionRK4, 'EE': AdvectionEE, 'RK45': AdvectionRK45}
+ptype = {'scipy': Particle, 'jit': JITParticle}
+
+
+class SampleParticle(JITParticle):
+    user_vars = {'p': np.float32}
+
+
+class SampleScipyParticle(Particle):
+    user_vars = {'p': np.float32}
+
+
+def moving_eddies_setup(grid):
+    return {'start': (3.3, 46.), 'finish': (3.3, 47.8),
+            'runtime': delta(days=2), 'dt': delta(minutes=5)}
+
+
+def peninsula_setup(grid):
+    x = 3. * (1. / 1.852 / 60)  # 3 km offset from boundary
+    return {'start': (x, grid.U.lat[0] + x), 'finish': (x, grid.U.lat[-1] - x),
+            'runtime': delta(hours=24), 'dt': delta(minutes=5)}
+
+
+def stommel_setup(grid):
+    return {'start': (10., 50.), 'finish': (7., 30.),
+            'runtime': delta(days=5), 'dt': delta(minutes=5)}
+
+
+# Scenario name -> (grid generator, particle setup, sampling kernel)
+scenarios = {'moving_eddies': (moving_eddies_grid, moving_eddies_setup, None),
+             'peninsula': (peninsula_grid, peninsula_setup, None),
+             'stommel': (stommel_grid, stommel_setup, None),
+             'sampling': (peninsula_grid, peninsula_setup, UpdateP)}
+
+
+def peak_memory():
+    """Peak resident set size of the current process in bytes"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if platform.system() == 'Darwin' else maxrss * 1024
+
+
+def run_case(scenario, mode, integrator, npart, xdim, ydim):
+    """Execute a single benchmark configuration and return its record"""
+    gridgen, setup, sampler = scenarios[scenario]
+    tic = timer()
+    grid = gridgen(xdim, ydim)
+    t_grid = timer() - tic
+    config = setup(grid)
+
+    if sampler is None:
+        pclass = ptype[mode]
+    else:
+        pclass = SampleParticle if mode == 'jit' else SampleScipyParticle
+    pset = grid.ParticleSet(npart, pclass=pclass, start=config['start'],
+                            finish=config['finish'])
+    kernel = pset.Kernel(method[integrator])
+    if sampler is not None:
+        kernel += pset.Kernel(sampler)
+    pset.execute(kernel, starttime=0., runtime=config['runtime'],
+                 dt=config['dt'], profile=True)
+
+    report = pset.profile
+    timings = report['timings']
+    return {'scenario': scenario, 'mode': mode, 'method': integrator,
+            'particles': npart, 'grid': [xdim, ydim],
+            'grid_time': t_grid,
+            'codegen_time': timings['codegen'],
+            'compile_time': timings['compile'],
+            'load_time': timings['load'],
+            'execute_time': sum(timings['execute']),
+            'particle_steps': report['particle_steps'],
+            'field_evals_estimate': report['field_evals_estimate'],
+            'steps_per_second': report['steps_per_second'],
+            'peak_memory': peak_memory()}
+
+
+def failed_case(scenario, mode, integrator, npart, xdim, ydim, error):
+    """Record of a benchmark configuration that raised an error"""
+    return {'scenario': scenario, 'mode': mode, 'method': integrator,
+            'particles': npart, 'grid': [xdim, ydim],
+            'error': "%s: %s" % (type(error).__name__, error)}
+
+
+def case_key(record):
+    return (record['scenario'], record['mode'], record['method'],
+            record['particles'], tuple(record['grid']))
+
+
+def compare(results, baseline, tolerance):
+    """Return all records whose throughput fell by more than
+    `tolerance` (fraction) with respect to a matching baseline record"""
+    reference = dict((case_key(r), r) for r in baseline)
+    regressions = []
+    for record in results:
+        ref = reference.get(case_key(record))
+        if 'error' in record or ref is None or ref.get('steps_per_second', 0) <= 0:
+            continue
+        ratio = record['steps_per_second'] / ref['steps_per_second']
+        if ratio < 1. - tolerance:
+            regressions.append((record, ref, ratio))
+    return regressions
+
+
+def run_benchmarks(scenario_names, modes, integrators, particles, grids):
+    results = []
+    for case in product(scenario_names, modes, integrators, particles, grids):
+        scenario, mode, integrator, npart, (xdim, ydim) = case
+        # Run every configuration in a fresh process to isolate peak memory
+        # and report failing configurations without ending the sweep
+        pool = Pool(processes=1, maxtasksperchild=1)
+        try:
+            record = pool.apply(run_case, (scenario, mode, integrator, npart, xdim, ydim))
+        except Exception as e:
+            record = failed_case(scenario, mode, integrator, npart, xdim, ydim, e)
+        finally:
+            pool.close()
+            pool.join()
+        if 'error' in record:
+            print("%s[%s, %s] %d particles on %dx%d grid: FAILED (%s)"
+                  % (scenario, mode, integrator, npart, xdim, ydim, record['error']))
+        else:
+            print("%s[%s, %s] %d particles on %dx%d grid: %.1f steps/s"
+                  % (scenario, mode, integrator, npart, xdim, ydim,
+                     record['steps_per_second']))
+        results.append(record)
+    return results
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="""
+Benchmark suite for the canonical Parcels test scenarios""")
+    p.add_argument('-s', '--scenarios', nargs='+', choices=sorted(scenarios.keys()),
+                   default=sorted(scenarios.keys()), help='Scenarios to run')
+    p.add_argument('--modes', nargs='+', choices=('scipy', 'jit'), default=['jit'],
+                   help='Execution modes to benchmark')
+    p.add_argument('-m', '--methods', nargs='+', choices=('RK4', 'EE', 'RK45'),
+                   default=['EE', 'RK4', 'RK45'], help='Numerical methods used for advection')
+    p.add_argument('-p', '--particles', type=int, nargs='+', default=[10, 100],
+                   help='Particle counts to sweep')
+    p.add_argument('-g', '--grids', type=int, nargs='+', default=[100, 100],
+                   help='Grid dimensions to sweep, given as pairs of xdim ydim')
+    p.add_argument('-o', '--output', default='benchmark_results.json',
+                   help='JSON file to write the benchmark results to')
+    p.add_argument('--baseline', default=None,
+                   help='JSON results file of an earlier run on the same machine '
+                   'to compare throughput against')
+    p.add_argument('--tolerance', type=float, default=0.1,
+                   help='Relative throughput loss flagged as a regression')
+    args = p.parse_args()
+
+    if len(args.grids) % 2 != 0:
+        p.error('Grid dimensions need to be given as pairs of xdim ydim')
+    grids = list(zip(args.grids[::2], args.grids[1::2]))
+
+    results = run_benchmarks(args.scenarios, args.modes, args.methods,
+                             args.particles, grids)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Benchmark results written to %s" % args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for record, ref, ratio in regressions:
+            print("REGRESSION %s[%s, %s] %d particles on %dx%d grid: %.1f steps/s (baseline %.1f, %.0f%%)"
+                  % (record['scenario'], record['mode'], record['method'],
+                     record['particles'], record['grid'][0], record['grid'][1],
+                     record['steps_per_second'], ref['steps_per_second'], ratio * 100))
+        if len(regressions) > 0:
+            sys.exit(1)
+    if any('error' in record for record in results):
+        sys.exit(1)
@@ -1,73 +1,342 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <math.h>
 
 typedef enum
   {
     SUCCESS, FAILURE
   } KernelOp;
 
+/* Storage types of field data; packed types are decoded on access */
+typedef enum
+  {
+    DATA_FLOAT32, DATA_INT16, DATA_FLOAT16
+  } DataType;
+
 typedef struct
 {
-  int xdim, ydim, tdim, tidx;
+  int xdim, ydim, tdim;
+  /* Element strides of data along lon, lat and time, so that
+     transposed (lon-major) arrays can be sampled without a copy */
+  long xstride, ystride, tstride;
   float *lon, *lat;
   double *time;
-  float ***data;
+  void *data;
+  /* Storage type of data and the linear decoding value * scale + offset */
+  int dtype;
+  float scale, offset;
+  /* Optional sparse tiling: tile_index maps (lat, lon) tiles of size
+     tile_y x tile_x to their position in data, or -1 for absent tiles
+     that hold the decoded value fill; NULL for dense data */
+  int *tile_index;
+  int tile_nx, tile_y, tile_x;
+  long tile_stride;
+  float fill;
+  /* Curvilinear grids only: lon and lat are 2D [ydim][xdim] arrays and
+     lookup holds the flat index of the grid point nearest to each bin of
+     a coarse regular lookup_ny x lookup_nx table starting at lookup_x0/y0 */
+  int *lookup;
+  int lookup_nx, lookup_ny;
+  float lookup_x0, lookup_y0, lookup_dx, lookup_dy;
+  /* Origin and spacing of uniformly spaced axes; spacing is 0 otherwise */
+  float lon0, dlon, lat0, dlat;
+  /* Period of a periodic lon axis, 0 otherwise */
+  float period;
 } CField;
 
+/* Optional hot-path counters, compiled in by defining PARCELS_STATS
+   before including this header. Without it the counting macro expands
+   to nothing, so the default build carries no overhead. */
+typedef struct
+{
+  long index_search_steps, time_index_moves, bilinear_evals, kernel_rejections;
+} CStats;
+
+#ifdef PARCELS_STATS
+CStats parcels_stats;
+#define PARCELS_COUNT(counter) (++parcels_stats.counter)
+#else
+#define PARCELS_COUNT(counter)
+#endif
+
 
 /* Local linear search to update grid index */
 static inline int search_linear_float(float x, int i, int size, float *xvals)
 {
-    while (i < size-1 && x > xvals[i+1]) ++i;
-    while (i > 0 && x < xvals[i]) --i;
+    while (i < size-1 && x > xvals[i+1]) {++i; PARCELS_COUNT(index_search_steps);}
+    while (i > 0 && x < xvals[i]) {--i; PARCELS_COUNT(index_search_steps);}
     return i;
 }
 
+/* Binary search for the grid index on non-uniform axes */
+static inline int search_binary_float(float x, int size, float *xvals)
+{
+    int lo = 0, hi = size-1, mid;
+    while (hi - lo > 1) {
+      mid = (lo + hi) / 2;
+      if (x < xvals[mid]) hi = mid; else lo = mid;
+      PARCELS_COUNT(index_search_steps);
+    }
+    return lo;
+}
+
+/* Grid index search: direct computation on uniformly spaced axes
+   (dx > 0), otherwise a local walk from the hint if x lies within
+   one cell of it, or a binary search for far jumps. The final linear
+   pass corrects rounding and yields the same result as a full walk.
+   A direct lookup counts as a single search step. */
+static inline int search_index_float(float x, int i, int size, float *xvals,
+                                     float x0, float dx)
+{
+    if (dx > 0) {
+      /* Clamp to the last cell; the linear pass moves past it only if
+         x lies beyond the last point, as a full walk would */
+      i = (int)floorf((x - x0) / dx);
+      i = i < 0 ? 0 : (i > size-2 ? size-2 : i);
+      PARCELS_COUNT(index_search_steps);
+    } else if (x < xvals[i > 0 ? i-1 : 0] || x > xvals[i+2 < size ? i+2 : size-1]) {
+      i = search_binary_float(x, size, xvals);
+    }
+    return search_linear_float(x, i, size, xvals);
+}
+
+/* Wrap x into [x0, x0 + period) on periodic axes */
+static inline float wrap_periodic(float x, float x0, float period)
+{
+  return x - period * floorf((x - x0) / period);
+}
+
 /* Local linear search to update time index */
 static inline int search_linear_double(double t, int i, int size, double *tvals)
 {
-    while (i < size-1 && t > tvals[i+1]) ++i;
-    while (i > 0 && t < tvals[i]) --i;
+    while (i < size-1 && t > tvals[i+1]) {++i; PARCELS_COUNT(time_index_moves);}
+    while (i > 0 && t < tvals[i]) {--i; PARCELS_COUNT(time_index_moves);}
     return i;
 }
 
-/* Bilinear interpolation routine for 2D grid */
-static inline float spatial_interpolation_bilinear(float x, float y, int i, int j, int xdim,
-                                                   float *lon, float *lat, float **f_data)
+/* Convert an IEEE 754 half-precision value to float */
+static inline float half_to_float(unsigned short h)
 {
-  /* Cast data array into data[lat][lon] as per NEMO convention */
-  float (*data)[xdim] = (float (*)[xdim]) f_data;
-  return (data[j][i] * (lon[i+1] - x) * (lat[j+1] - y)
-        + data[j][i+1] * (x - lon[i]) * (lat[j+1] - y)
-        + data[j+1][i] * (lon[i+1] - x) * (y - lat[j])
-        + data[j+1][i+1] * (x - lon[i]) * (y - lat[j]))
-        / ((lon[i+1] - lon[i]) * (lat[j+1] - lat[j]));
+  int exponent = (h >> 10) & 0x1f, mantissa = h & 0x3ff;
+  float value;
+  if (exponent == 0)
+    value = ldexpf((float)mantissa, -24);
+  else if (exponent == 31)
+    value = mantissa ? NAN : INFINITY;
+  else
+    value = ldexpf((float)(mantissa | 0x400), exponent - 25);
+  return (h & 0x8000) ? -value : value;
 }
 
-/* Linear interpolation along the time axis */
-static inline float temporal_interpolation_linear(float x, float y, int xi, int yi,
-                                                  double time, CField *f)
+/* Decoded field value at element offset idx of the data array */
+static inline float field_value(CField *f, long idx)
+{
+  switch (f->dtype) {
+  case DATA_INT16:
+    return (float)((short *)f->data)[idx] * f->scale + f->offset;
+  case DATA_FLOAT16:
+    return half_to_float(((unsigned short *)f->data)[idx]) * f->scale + f->offset;
+  default:
+    return ((float *)f->data)[idx] * f->scale + f->offset;
+  }
+}
+
+/* Decoded field value at grid point (i, j) and time index k */
+static inline float field_point(CField *f, int i, int j, int k)
+{
+  int tile;
+  if (f->tile_index == NULL)
+    return field_value(f, k * f->tstride + j * f->ystride + i * f->xstride);
+  if (i >= f->xdim || j >= f->ydim)
+    return f->fill;
+  tile = f->tile_index[(j / f->tile_y) * f->tile_nx + i / f->tile_x];
+  if (tile < 0)
+    return f->fill;
+  return field_value(f, tile * f->tile_stride + k * f->tstride
+                     + (j % f->tile_y) * f->ystride + (i % f->tile_x) * f->xstride);
+}
+
+/* Bilinear interpolation routine for 2D grid at time index k */
+static inline float spatial_interpolation_bilinear(float x, float y, int i, int j, int k,
+                                                   CField *f)
+{
+  float *lat = f->lat, x0 = f->lon[i], x1;
+  int i1 = i + 1;
+  /* The last cell of a periodic axis wraps around to the first column */
+  if (i1 == f->xdim && f->period > 0) {
+    i1 = 0; x1 = f->lon[0] + f->period;
+  } else {
+    x1 = f->lon[i1];
+  }
+  PARCELS_COUNT(bilinear_evals);
+  return (field_point(f, i, j, k) * (x1 - x) * (lat[j+1] - y)
+        + field_point(f, i1, j, k) * (x - x0) * (lat[j+1] - y)
+        + field_point(f, i, j+1, k) * (x1 - x) * (y - lat[j])
+        + field_point(f, i1, j+1, k) * (x - x0) * (y - lat[j]))
+        / ((x1 - x0) * (lat[j+1] - lat[j]));
+}
+
+/* Linear interpolation along the time axis. The grid and time index
+   hints xi/yi/ti are per-particle and per-axes; they are updated with the
+   located cell so that subsequent samples of fields on the same axes
+   reuse the search */
+static inline float temporal_interpolation_linear(float x, float y, int *xi, int *yi,
+                                                  int *ti, double time, CField *f)
 {
-  /* Cast data array intp data[time][lat][lon] as per NEMO convention */
-  float (*data)[f->ydim][f->xdim] = (float (*)[f->ydim][f->xdim]) f->data;
   float f0, f1;
   double t0, t1;
-  int i = xi, j = yi;
+  int i, j, k;
+  if (f->period > 0) x = wrap_periodic(x, f->lon[0], f->period);
   /* Identify grid cell to sample through local linear search */
-  i = search_linear_float(x, i, f->xdim, f->lon);
-  j = search_linear_float(y, j, f->ydim, f->lat);
+  i = *xi = search_index_float(x, *xi, f->xdim, f->lon, f->lon0, f->dlon);
+  j = *yi = search_index_float(y, *yi, f->ydim, f->lat, f->lat0, f->dlat);
   /* Find time index for temporal interpolation */
-  f->tidx = search_linear_double(time, f->tidx, f->tdim, f->time);
-  if (f->tidx < f->tdim-1 && time > f->time[f->tidx]) {
-    t0 = f->time[f->tidx]; t1 = f->time[f->tidx+1];
-    f0 = spatial_interpolation_bilinear(x, y, i, j, f->xdim, f->lon, f->lat, (float**)(data[f->tidx]));
-    f1 = spatial_interpolation_bilinear(x, y, i, j, f->xdim, f->lon, f->lat, (float**)(data[f->tidx+1]));
+  k = *ti = search_linear_double(time, *ti, f->tdim, f->time);
+  if (k < f->tdim-1 && time > f->time[k]) {
+    t0 = f->time[k]; t1 = f->time[k+1];
+    f0 = spatial_interpolation_bilinear(x, y, i, j, k, f);
+    f1 = spatial_interpolation_bilinear(x, y, i, j, k+1, f);
     return f0 + (f1 - f0) * (float)((time - t0) / (t1 - t0));
   } else {
-    return spatial_interpolation_bilinear(x, y, i, j, f->xdim, f->lon, f->lat, (float**)(data[f->tidx]));
+    return spatial_interpolation_bilinear(x, y, i, j, k, f);
   }
 }
 
+/* Local coordinates (xsi, eta) of point (x, y) in cell (i, j) of a
+   curvilinear grid, obtained by inverting the bilinear map of the cell */
+static inline void curvilinear_coords(float x, float y, int i, int j, CField *f,
+                                      double *xsi, double *eta)
+{
+  float *lon = f->lon, *lat = f->lat;
+  int n = f->xdim;
+  double px[4] = {lon[j*n+i], lon[j*n+i+1], lon[(j+1)*n+i+1], lon[(j+1)*n+i]};
+  double py[4] = {lat[j*n+i], lat[j*n+i+1], lat[(j+1)*n+i+1], lat[(j+1)*n+i]};
+  double a[4] = {px[0], px[1]-px[0], px[3]-px[0], px[0]-px[1]+px[2]-px[3]};
+  double b[4] = {py[0], py[1]-py[0], py[3]-py[0], py[0]-py[1]+py[2]-py[3]};
+  double aa = a[3]*b[2] - a[2]*b[3];
+  double bb = a[3]*b[0] - a[0]*b[3] + a[1]*b[2] - a[2]*b[1] + x*b[3] - y*a[3];
+  double cc = a[1]*b[0] - a[0]*b[1] + x*b[1] - y*a[1];
+  /* Numerically stable roots of aa*eta^2 + bb*eta + cc = 0 */
+  double q = -.5 * (bb + copysign(sqrt(fmax(bb*bb - 4*aa*cc, 0.)), bb));
+  double e1, e2;
+  if (fabs(aa) < 1.e-12 || q == 0) {
+    *eta = -cc / bb;
+  } else {
+    /* Pick the root closest to the cell */
+    e1 = q / aa; e2 = cc / q;
+    *eta = fabs(e1 - .5) <= fabs(e2 - .5) ? e1 : e2;
+  }
+  if (fabs(a[1] + a[3] * *eta) > 1.e-12)
+    *xsi = (x - a[0] - a[2] * *eta) / (a[1] + a[3] * *eta);
+  else
+    *xsi = (y - b[0] - b[2] * *eta) / (b[1] + b[3] * *eta);
+}
+
+/* Cell search on curvilinear grids: walk from the index hint towards
+   the cell containing (x, y), restarting from the nearest grid point in
+   the coarse lookup table if the hint lies more than a cell away */
+static inline void search_index_curvilinear(float x, float y, int *xi, int *yi, CField *f,
+                                            double *xsi, double *eta)
+{
+  int i = *xi, j = *yi, inew, jnew, bx, by, it;
+  i = i < 0 ? 0 : (i > f->xdim-2 ? f->xdim-2 : i);
+  j = j < 0 ? 0 : (j > f->ydim-2 ? f->ydim-2 : j);
+  curvilinear_coords(x, y, i, j, f, xsi, eta);
+  if (*xsi < -1 || *xsi > 2 || *eta < -1 || *eta > 2) {
+    bx = (int)floorf((x - f->lookup_x0) / f->lookup_dx);
+    by = (int)floorf((y - f->lookup_y0) / f->lookup_dy);
+    bx = bx < 0 ? 0 : (bx > f->lookup_nx-1 ? f->lookup_nx-1 : bx);
+    by = by < 0 ? 0 : (by > f->lookup_ny-1 ? f->lookup_ny-1 : by);
+    i = f->lookup[by * f->lookup_nx + bx] % f->xdim;
+    j = f->lookup[by * f->lookup_nx + bx] / f->xdim;
+    i = i > f->xdim-2 ? f->xdim-2 : i;
+    j = j > f->ydim-2 ? f->ydim-2 : j;
+    curvilinear_coords(x, y, i, j, f, xsi, eta);
+  }
+  for (it = 0; it < f->xdim + f->ydim; ++it) {
+    inew = i + (*xsi > 1) - (*xsi < 0);
+    jnew = j + (*eta > 1) - (*eta < 0);
+    inew = inew < 0 ? 0 : (inew > f->xdim-2 ? f->xdim-2 : inew);
+    jnew = jnew < 0 ? 0 : (jnew > f->ydim-2 ? f->ydim-2 : jnew);
+    if (inew == i && jnew == j) break;
+    i = inew; j = jnew;
+    PARCELS_COUNT(index_search_steps);
+    curvilinear_coords(x, y, i, j, f, xsi, eta);
+  }
+  *xi = i; *yi = j;
+}
+
+/* Bilinear interpolation in index space of a curvilinear cell */
+static inline float spatial_interpolation_curvilinear(double xsi, double eta, int i, int j,
+                                                      int k, CField *f)
+{
+  PARCELS_COUNT(bilinear_evals);
+  return (float)((1-xsi) * (1-eta) * field_point(f, i, j, k)
+               + xsi * (1-eta) * field_point(f, i+1, j, k)
+               + xsi * eta * field_point(f, i+1, j+1, k)
+               + (1-xsi) * eta * field_point(f, i, j+1, k));
+}
+
+/* Linear interpolation along the time axis for curvilinear grids */
+static inline float temporal_interpolation_curvilinear(float x, float y, int *xi, int *yi,
+                                                       int *ti, double time, CField *f)
+{
+  float f0, f1;
+  double t0, t1, xsi, eta;
+  int k;
+  search_index_curvilinear(x, y, xi, yi, f, &xsi, &eta);
+  k = *ti = search_linear_double(time, *ti, f->tdim, f->time);
+  if (k < f->tdim-1 && time > f->time[k]) {
+    t0 = f->time[k]; t1 = f->time[k+1];
+    f0 = spatial_interpolation_curvilinear(xsi, eta, *xi, *yi, k, f);
+    f1 = spatial_interpolation_curvilinear(xsi, eta, *xi, *yi, k+1, f);
+    return f0 + (f1 - f0) * (float)((time - t0) / (t1 - t0));
+  } else {
+    return spatial_interpolation_curvilinear(xsi, eta, *xi, *yi, k, f);
+  }
+}
+
+/* Nested fields: per-level bounding boxes (lon_min, lon_max, lat_min,
+   lat_max), ordered from the finest to the coarsest level, and a coverage
+   map holding the finest level intersecting each bin of a regular
+   map_ny x map_nx raster */
+typedef struct
+{
+  int nlevels;
+  float *bounds;
+  int *map;
+  int map_nx, map_ny;
+  float map_x0, map_y0, map_dx, map_dy;
+} CNested;
+
+/* Index of the finest level covering (x, y); only levels from the
+   coverage map entry onwards are checked, the coarsest is the default */
+static inline int nested_level(float x, float y, CNested *n)
+{
+  int bx = (int)floorf((x - n->map_x0) / n->map_dx);
+  int by = (int)floorf((y - n->map_y0) / n->map_dy);
+  int l;
+  float *b;
+  bx = bx < 0 ? 0 : (bx > n->map_nx-1 ? n->map_nx-1 : bx);
+  by = by < 0 ? 0 : (by > n->map_ny-1 ? n->map_ny-1 : by);
+  for (l = n->map[by * n->map_nx + bx]; l < n->nlevels-1; ++l) {
+    b = n->bounds + 4*l;
+    if (x >= b[0] && x <= b[1] && y >= b[2] && y <= b[3]) break;
+  }
+  return l;
+}
+
+/* Sample a nested field from the finest level covering (x, y), using
+   that level's grid and time index hints */
+static inline float nested_interpolation(float x, float y, int **xi, int **yi, int **ti,
+                                         double time, CNested *n, CField **levels)
+{
+  int l = nested_level(x, y, n);
+  if (levels[l]->lookup != NULL)
+    return temporal_interpolation_curvilinear(x, y, xi[l], yi[l], ti[l], time, levels[l]);
+  return temporal_interpolation_linear(x, y, xi[l], yi[l], ti[l], time, levels[l]);
+}
+
 /**************************************************/
 /*   Random number generation (RNG) functions     */
 /**************************************************/
@@ -91,3 +360,12 @@ static inline int parcels_randint(int low, int high)
 {
   return (rand() % (high-low)) + low;
 }
+
+/* Normal variate via the Box-Muller transform; draws two uniform
+   numbers from the same stream as the other RNG functions */
+static inline float parcels_normalvariate(float loc, float scale)
+{
+  float x1 = ((float)rand() + 1.0f) / ((float)(RAND_MAX) + 1.0f);
+  float x2 = (float)rand() / (float)(RAND_MAX);
+  return loc + scale * sqrt(-2.0 * log(x1)) * cos(2.0 * M_PI * x2);
+}
@@ -1,3 +1,4 @@
+from parcels.field import Field
 import ast
 import cgen as c
 from collections import OrderedDict
@@ -12,14 +13,33 @@ class IntrinsicNode(ast.AST):
 
 
 class GridNode(IntrinsicNode):
+    def __init__(self, obj, ccode, ptype):
+        IntrinsicNode.__init__(self, obj, ccode)
+        self.ptype = ptype
+        # Index hints of axes added to the grid after the particle type
+        # was created are kept in local variables of the kernel
+        self.local_hints = []
+
     def __getattr__(self, attr):
         return FieldNode(getattr(self.obj, attr),
-                         ccode="%s->%s" % (self.ccode, attr))
+                         ccode="%s->%s" % (self.ccode, attr), hints=self.ccode_hints)
+
+    def ccode_hints(self, field):
+        """C pointers to the grid and time index hints for the axes of a field"""
+        names = self.obj.index_vars(field.axes)
+        if all(v in self.ptype.var_types for v in names):
+            return ["&particle->%s" % v for v in names]
+        self.local_hints += [v for v in names if v not in self.local_hints]
+        return ["&%s" % v for v in names]
 
 
 class FieldNode(IntrinsicNode):
+    def __init__(self, obj, ccode, hints):
+        IntrinsicNode.__init__(self, obj, ccode)
+        self.hints = hints
+
     def __getitem__(self, attr):
-        return IntrinsicNode(None, ccode=self.obj.ccode_subscript(*attr))
+        return IntrinsicNode(None, ccode=self.obj.ccode_subscript(*attr, hints=self.hints))
 
 
 class MathNode(IntrinsicNode):
@@ -38,7 +58,8 @@ class MathNode(IntrinsicNode):
 class RandomNode(IntrinsicNode):
     symbol_map = {'random': 'parcels_random',
                   'uniform': 'parcels_uniform',
-                  'randint': 'parcels_randint'}
+                  'randint': 'parcels_randint',
+                  'normalvariate': 'parcels_normalvariate'}
 
     def __getattr__(self, attr):
         if hasattr(random, attr):
@@ -85,10 +106,10 @@ class ParticleAttributeNode(IntrinsicNode):
     def ccode_index_update(self):
         """C-code for the index update requires after updating p.lon/p.lat"""
         if self.attr == 'lon':
-            return "search_linear_float(%s, %s, U->xdim, U->lon)" \
+            return "search_index_float(%s, %s, U->xdim, U->lon, U->lon0, U->dlon)" \
                 % (self.ccode, self.ccode_index_var)
         if self.attr == 'lat':
-            return "search_linear_float(%s, %s, U->ydim, U->lat)" \
+            return "search_index_float(%s, %s, U->ydim, U->lat, U->lat0, U->dlat)" \
                 % (self.ccode, self.ccode_index_var)
         return ""
 
@@ -113,10 +134,14 @@ class IntrinsicTransformer(ast.NodeTransformer):
     def __init__(self, grid, ptype):
         self.grid = grid
         self.ptype = ptype
+        # Index updates after p.lon/p.lat assignments search the axes of a
+        # rectilinear U field; other cell searches update the hints themselves
+        self.update_indices = isinstance(grid.U, Field) and not grid.U.axes.curvilinear
+        self.grid_node = GridNode(self.grid, ccode='grid', ptype=self.ptype)
 
     def visit_Name(self, node):
         if node.id == 'grid':
-            return GridNode(self.grid, ccode='grid')
+            return self.grid_node
         elif node.id == 'particle':
             return ParticleNode(self.ptype, ccode='particle')
         if node.id == 'KernelOp':
@@ -142,7 +167,7 @@ class IntrinsicTransformer(ast.NodeTransformer):
 
         # Capture p.lat/p.lon updates and insert p.xi/p.yi updates
         if isinstance(node.target, ParticleAttributeNode) \
-           and node.target.ccode_index_var is not None:
+           and node.target.ccode_index_var is not None and self.update_indices:
             node = [node, node.target.pyast_index_update]
         return node
 
@@ -152,7 +177,7 @@ class IntrinsicTransformer(ast.NodeTransformer):
 
         # Capture p.lat/p.lon updates and insert p.xi/p.yi updates
         if isinstance(node.targets[0], ParticleAttributeNode) \
-           and node.targets[0].ccode_index_var is not None:
+           and node.targets[0].ccode_index_var is not None and self.update_indices:
             node = [node, node.targets[0].pyast_index_update]
         return node
 
@@ -217,6 +242,10 @@ class KernelGenerator(ast.NodeVisitor):
                 funcvars.remove(kvar)
         if len(funcvars) > 0:
             self.ccode.body.insert(0, c.Value("float", ", ".join(funcvars)))
+        # Local index hints start every kernel call with a search from the first cell
+        local_hints = transformer.grid_node.local_hints
+        if len(local_hints) > 0:
+            self.ccode.body.insert(0, c.Value("int", ", ".join(["%s = 0" % v for v in local_hints])))
 
         return self.ccode
 
@@ -229,8 +258,8 @@ class KernelGenerator(ast.NodeVisitor):
         decl = c.Static(c.DeclSpecifier(c.Value("KernelOp", node.name), spec='inline'))
         args = [c.Pointer(c.Value(self.ptype.name, "particle")),
                 c.Value("double", "time"), c.Value("float", "dt")]
-        for field, _ in self.field_args.items():
-            args += [c.Pointer(c.Value("CField", "%s" % field))]
+        for name, field in self.field_args.items():
+            args += [c.Pointer(c.Value(field.ccode_struct, name))]
 
         # Create function body as C-code object
         body = [stmt.ccode for stmt in node.body]
@@ -414,7 +443,10 @@ class KernelGenerator(ast.NodeVisitor):
         node.ccode = c.Statement("break")
 
     def visit_FieldNode(self, node):
-        """Record intrinsic fields used in kernel"""
+        """Record intrinsic fields used in kernel, including the
+        individual levels of nested fields"""
+        for field in getattr(node.obj, 'fields', [node.obj]):
+            self.field_args[field.name] = field
         self.field_args[node.obj.name] = node.obj
 
     def visit_Return(self, node):
@@ -438,9 +470,14 @@ class LoopGenerator(object):
         self.grid = grid
         self.ptype = ptype
 
-    def generate(self, funcname, field_args, kernel_ast, adaptive=False):
+    def generate(self, funcname, field_args, kernel_ast, adaptive=False,
+                 instrument=False):
         ccode = []
 
+        # Enable the hot-path counters in parcels.h for instrumented builds
+        if instrument:
+            ccode += [str(c.Define("PARCELS_STATS", ""))]
+
         # Add include for Parcels and math header
         ccode += [str(c.Include("parcels.h", system=False))]
         ccode += [str(c.Include("math.h", system=False))]
@@ -455,28 +492,52 @@ class LoopGenerator(object):
         # Generate outer loop for repeated kernel invocation
         args = [c.Value("int", "num_particles"),
                 c.Pointer(c.Value(self.ptype.name, "particles")),
-                c.Value("double", "endtime"), c.Value("float", "dt")]
-        for field, _ in field_args.items():
-            args += [c.Pointer(c.Value("CField", "%s" % field))]
+                c.Value("double", "endtime"), c.Value("float", "dt"),
+                c.Value("int", "num_outputs"), c.Pointer(c.Value("double", "output_times")),
+                c.Pointer(c.Value(self.ptype.name, "output"))]
+        for name, field in field_args.items():
+            args += [c.Pointer(c.Value(field.ccode_struct, name))]
         fargs_str = ", ".join(['particles[p].time', 'particles[p].dt'] + list(field_args.keys()))
+        # Counters for kernel invocations and successful particle steps
+        ccode += [str(c.Value("long", "pcls_kernel_calls = 0, pcls_kernel_steps = 0"))]
+        step_ok = c.Block([c.Statement("particles[p].time += __dt"),
+                           c.Statement("++__nsteps")])
+        step_fail = c.Statement("PARCELS_COUNT(kernel_rejections)") if instrument else None
+        # Wrap particle longitudes after each kernel call on periodic grids
+        if isinstance(self.grid.U, Field) and self.grid.U.axes.period > 0:
+            wrap = [c.Statement("particles[p].lon = wrap_periodic(particles[p].lon, U->lon[0], U->period)")]
+        else:
+            wrap = []
+        # Advance each particle through the output schedule, recording a
+        # copy of the particle in the output buffer at every output time
+        out_time = c.Statement("__endtime = o < num_outputs ? output_times[o] : endtime")
+        out_record = c.If("o < num_outputs",
+                          c.Statement("output[(long)o * num_particles + p] = particles[p]"))
         # Inner loop nest for forward runs
-        body_fwd = [c.Statement("__dt = fmin(particles[p].dt, endtime - particles[p].time)"),
+        body_fwd = [c.Statement("__dt = fmin(particles[p].dt, __endtime - particles[p].time)"),
                     c.Statement("res = %s(&(particles[p]), %s)" % (funcname, fargs_str)),
-                    c.If("res == SUCCESS", c.Statement("particles[p].time += __dt"))]
-        time_fwd = c.While("fmin(particles[p].dt, endtime - particles[p].time) > 0.0",
+                    c.Statement("++__ncalls")]
+        body_fwd += wrap + [c.If("res == SUCCESS", step_ok, step_fail)]
+        time_fwd = c.While("fmin(particles[p].dt, __endtime - particles[p].time) > 0.0",
                            c.Block(body_fwd))
-        part_fwd = c.For("p = 0", "p < num_particles", "++p", c.Block([time_fwd]))
+        out_fwd = c.For("o = 0", "o <= num_outputs", "++o", c.Block([out_time, time_fwd, out_record]))
+        part_fwd = c.For("p = 0", "p < num_particles", "++p", c.Block([out_fwd]))
         # Inner loop nest for backward runs
-        body_bwd = [c.Statement("__dt = fmax(particles[p].dt, endtime - particles[p].time)"),
+        body_bwd = [c.Statement("__dt = fmax(particles[p].dt, __endtime - particles[p].time)"),
                     c.Statement("res = %s(&(particles[p]), %s)" % (funcname, fargs_str)),
-                    c.If("res == SUCCESS", c.Statement("particles[p].time += __dt"))]
-        time_bwd = c.While("fmax(particles[p].dt, endtime - particles[p].time) < 0.0",
+                    c.Statement("++__ncalls")]
+        body_bwd += wrap + [c.If("res == SUCCESS", step_ok, step_fail)]
+        time_bwd = c.While("fmax(particles[p].dt, __endtime - particles[p].time) < 0.0",
                            c.Block(body_bwd))
-        part_bwd = c.For("p = 0", "p < num_particles", "++p", c.Block([time_bwd]))
+        out_bwd = c.For("o = 0", "o <= num_outputs", "++o", c.Block([out_time, time_bwd, out_record]))
+        part_bwd = c.For("p = 0", "p < num_particles", "++p", c.Block([out_bwd]))
 
         time_if = c.If("dt > 0.0", c.Block([part_fwd]), c.Block([part_bwd]))
-        fbody = c.Block([c.Value("int", "p"), c.Value("KernelOp", "res"),
-                         c.Value("double", "__dt"), time_if])
+        fbody = c.Block([c.Value("int", "p, o"), c.Value("KernelOp", "res"),
+                         c.Value("double", "__dt, __endtime"),
+                         c.Value("long", "__ncalls = 0, __nsteps = 0"), time_if,
+                         c.Statement("pcls_kernel_calls = __ncalls"),
+                         c.Statement("pcls_kernel_steps = __nsteps")])
         fdecl = c.FunctionDeclaration(c.Value("void", "particle_loop"), args)
         ccode += [str(c.FunctionBody(fdecl, fbody))]
         return "\n\n".join(ccode)
@@ -1,13 +1,15 @@
 from scipy.interpolate import RegularGridInterpolator
+from scipy.spatial import cKDTree
 from cachetools import cachedmethod, LRUCache
 from collections import Iterable
 from py import path
 import numpy as np
 import xray
 import operator
-from ctypes import Structure, c_int, c_float, c_double, POINTER
+from ctypes import Structure, c_int, c_long, c_float, c_double, c_void_p, POINTER
 from netCDF4 import Dataset, num2date
-from math import cos, pi
+from math import cos, pi, floor
+from copy import copy
 from datetime import timedelta
 try:
     import matplotlib.pyplot as plt
@@ -15,7 +17,7 @@ except:
     plt = None
 
 
-__all__ = ['CentralDifferences', 'Field', 'Geographic', 'GeographicPolar']
+__all__ = ['CentralDifferences', 'Axes', 'Field', 'NestedField', 'Geographic', 'GeographicPolar']
 
 
 def CentralDifferences(field_data, lat, lon):
@@ -47,6 +49,217 @@ def CentralDifferences(field_data, lat, lon):
     return [dVdx, dVdy]
 
 
+def uniform_spacing(x, rtol=1.e-3):
+    """Returns the spacing of a uniformly spaced, increasing coordinate
+    array, or 0 if the spacing is non-uniform. The tolerance only needs
+    to absorb rounding, since the C index search corrects the computed
+    index with a local search."""
+    if x.size < 2:
+        return 0.
+    dx = np.diff(x.astype(np.float64))
+    spacing = (x[-1] - x[0]) / float(x.size - 1)
+    if spacing <= 0 or np.abs(dx - spacing).max() > rtol * spacing:
+        return 0.
+    return spacing
+
+
+def cell_coords(px, py, x, y):
+    """Local coordinates (xsi, eta) of point (x, y) in the quadrilateral
+    with corners (px, py), ordered counter-clockwise from the cell
+    origin, obtained by inverting the bilinear map. Both lie in [0, 1]
+    for points inside the cell."""
+    px, py, x, y = np.float64(px), np.float64(py), float(x), float(y)
+    a = [px[0], px[1]-px[0], px[3]-px[0], px[0]-px[1]+px[2]-px[3]]
+    b = [py[0], py[1]-py[0], py[3]-py[0], py[0]-py[1]+py[2]-py[3]]
+    aa = a[3]*b[2] - a[2]*b[3]
+    bb = a[3]*b[0] - a[0]*b[3] + a[1]*b[2] - a[2]*b[1] + x*b[3] - y*a[3]
+    cc = a[1]*b[0] - a[0]*b[1] + x*b[1] - y*a[1]
+    # Numerically stable roots of aa*eta^2 + bb*eta + cc = 0
+    q = -.5 * (bb + np.copysign(np.sqrt(max(bb*bb - 4*aa*cc, 0.)), bb))
+    if abs(aa) < 1.e-12 or q == 0:
+        eta = -cc / bb
+    else:
+        # Pick the root closest to the cell
+        e1, e2 = q / aa, cc / q
+        eta = e1 if abs(e1 - .5) <= abs(e2 - .5) else e2
+    if abs(a[1] + a[3]*eta) > 1.e-12:
+        xsi = (x - a[0] - a[2]*eta) / (a[1] + a[3]*eta)
+    else:
+        xsi = (y - b[0] - b[2]*eta) / (b[1] + b[3]*eta)
+    return xsi, eta
+
+
+def unique_nbytes(arrays):
+    """Total number of bytes held by a list of arrays, counting
+    arrays that share the same underlying buffer only once"""
+    buffers = {}
+    for a in arrays:
+        buffers[(a.__array_interface__['data'][0], a.nbytes)] = a.nbytes
+    return sum(buffers.values())
+
+
+# Storage types of field data and their DataType codes in parcels.h;
+# int16 and float16 data is kept packed and decoded on access
+data_types = {np.dtype(np.float32): 0, np.dtype(np.int16): 1, np.dtype(np.float16): 2}
+
+
+def packed_zero(dtype, scale_factor=1., add_offset=0.):
+    """Raw value of dtype that decodes (closest) to zero, or None if
+    zero lies outside the range of values dtype can hold"""
+    zero = -add_offset / scale_factor
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        zero = int(round(zero))
+        return zero if info.min <= zero <= info.max else None
+    if abs(zero) > np.finfo(dtype).max:
+        return None
+    return zero
+
+
+def fill_values(fill_value):
+    """List of raw values marking missing data, given None, a single
+    value or a list of values such as (_FillValue, missing_value)"""
+    return [] if fill_value is None else np.atleast_1d(fill_value).tolist()
+
+
+def memory_order(data):
+    """View of data with its axes reordered by decreasing stride, so
+    that iterating over it follows the order of the underlying memory,
+    e.g. the lon-major buffer behind a transposed (time, lat, lon) view"""
+    order = np.argsort([abs(st) for st in data.strides], kind='mergesort')[::-1]
+    return np.transpose(data, order)
+
+
+def sanitise(data, vmin=None, vmax=None, chunksize=2**22,
+             scale_factor=1., add_offset=0., fill_value=None, copy=False):
+    """Set NaN values and values outside [vmin, vmax] to zero in place.
+
+    The data is processed in a single pass over blocks of at most
+    `chunksize` elements taken in the order of the underlying memory,
+    so that the boolean scratch memory stays bounded independent of the
+    size of the field and transposed views are not walked across their
+    strides. For packed data the bounds and zero refer to the decoded
+    values ``data * scale_factor + add_offset``.
+
+    :param data: Field data array of shape (time, lat, lon)
+    :param chunksize: Maximum number of elements per block
+    :param fill_value: Raw value or list of values marking missing data,
+                       also set to zero
+    :param copy: Leave `data` unchanged and return a copy in the same
+                 memory layout once any value needs to be replaced
+    """
+    # Translate bounds and zero into the packed representation
+    lower = None if vmin is None else (vmin - add_offset) / scale_factor
+    upper = None if vmax is None else (vmax - add_offset) / scale_factor
+    if scale_factor < 0:
+        lower, upper = upper, lower
+    zero = packed_zero(data.dtype, scale_factor, add_offset)
+    if zero is None:
+        raise ValueError("Zero can not be represented in packed %s data" % data.dtype)
+    missing = fill_values(fill_value)
+    view = memory_order(data)
+    if view.flags['C_CONTIGUOUS']:
+        # Contiguous buffer: fixed size blocks of the flat memory
+        flat = view.reshape(-1)
+        blocks = (flat[i:i+chunksize] for i in range(0, flat.size, chunksize))
+    else:
+        # Blocks of whole rows along the two fastest varying axes
+        nt, ny, nx = view.shape
+        rows = max(1, min(ny, chunksize // max(nx, 1)))
+        blocks = (view[t, j:j+rows, :] for t in range(nt) for j in range(0, ny, rows))
+    with np.errstate(invalid='ignore'):
+        for chunk in blocks:
+            if np.issubdtype(data.dtype, np.floating):
+                mask = np.isnan(chunk)
+            else:
+                mask = np.zeros(chunk.shape, dtype=np.bool_)
+            if lower is not None:
+                mask |= chunk < lower
+            if upper is not None:
+                mask |= chunk > upper
+            for value in missing:
+                mask |= chunk == value
+            if copy and mask.any():
+                # Blocks checked so far hold no values to replace
+                return sanitise(data.copy(order='K'), vmin=vmin, vmax=vmax, chunksize=chunksize,
+                                scale_factor=scale_factor, add_offset=add_offset,
+                                fill_value=fill_value)
+            chunk[mask] = zero
+    return data
+
+
+def sanitise_scratch(shape, vmin=None, vmax=None, chunksize=2**22):
+    """Bytes of boolean scratch memory used by :func:`sanitise` on
+    data of the given (time, lat, lon) shape"""
+    ny, nx = shape[-2:]
+    rows = max(1, min(ny, chunksize // max(nx, 1)))
+    block = max(min(int(np.prod(shape)), chunksize), rows * nx)
+    return block * (1 + int(vmin is not None or vmax is not None))
+
+
+class TiledArray(object):
+    """Sparse storage of (time, lat, lon) field data that only keeps
+    the (lat, lon) tiles holding values other than `fill` at any time,
+    typically the ocean tiles of a land-masked field. Present tiles are
+    stored contiguously in :attr:`tiles` and located via the 2D
+    :attr:`index` map, which holds -1 for absent tiles.
+
+    Indexing returns dense arrays that are assembled on demand.
+
+    :param data: Dense field data of shape (time, lat, lon)
+    :param tile_size: Number of points per tile along lat and lon,
+                      given as an int or a (lat, lon) tuple
+    :param fill: Raw value of all points in absent tiles
+    """
+
+    def __init__(self, data, tile_size, fill=0.):
+        ty, tx = (tile_size, tile_size) if isinstance(tile_size, int) else tile_size
+        nt, ny, nx = data.shape
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.fill = fill
+        self.tile_size = (ty, tx)
+        self.index = np.full((-(-ny // ty), -(-nx // tx)), -1, dtype=np.int32)
+        present = []
+        for (tj, ti), _ in np.ndenumerate(self.index):
+            if (data[:, tj*ty:(tj+1)*ty, ti*tx:(ti+1)*tx] != fill).any():
+                self.index[tj, ti] = len(present)
+                present.append((tj, ti))
+        self.tiles = np.full((len(present), nt, ty, tx), fill, dtype=data.dtype)
+        for n, (tj, ti) in enumerate(present):
+            block = data[:, tj*ty:(tj+1)*ty, ti*tx:(ti+1)*tx]
+            self.tiles[n, :, :block.shape[1], :block.shape[2]] = block
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return self.tiles.nbytes + self.index.nbytes
+
+    def dense(self, tidx):
+        """Dense (lat, lon) array of the data at time index tidx"""
+        ty, tx = self.tile_size
+        out = np.full(self.shape[1:], self.fill, dtype=self.dtype)
+        for (tj, ti), n in np.ndenumerate(self.index):
+            if n >= 0:
+                block = out[tj*ty:(tj+1)*ty, ti*tx:(ti+1)*tx]
+                block[:] = self.tiles[n, tidx, :block.shape[0], :block.shape[1]]
+        return out
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key, )
+        tidx = np.arange(self.shape[0])[key[0]]
+        if np.ndim(tidx) == 0:
+            return self.dense(tidx)[key[1:]]
+        return np.array([self.dense(t) for t in tidx])[(slice(None), ) + key[1:]]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+
 class UnitConverter(object):
     """ Interface class for spatial unit conversion during field sampling
         that performs no conversion.
@@ -93,6 +306,155 @@ class GeographicPolar(UnitConverter):
         return "(1.0 / (1000. * 1.852 * 60. * cos(%s * M_PI / 180)))" % y
 
 
+class Axes(object):
+    """Class that encapsulates the coordinate axes of a field. Fields
+    defined on the same grid points reference a single Axes object,
+    so that coordinates are stored and searched only once.
+
+    Curvilinear grids, such as the tripolar NEMO ORCA grids, are given
+    by 2D (lat, lon) coordinate arrays. Cells are then located with a
+    k-d tree of the grid points in Python, and from the particle's index
+    hint or a coarse lookup table of nearest grid points in JIT code.
+    Vector components on curvilinear grids, such as NEMO's U and V, are
+    sampled as given along the grid directions; rotating them to
+    eastward and northward components is not supported.
+
+    All coordinates are stored as C-contiguous arrays, float32 for
+    lon, lat and depth and float64 for time.
+
+    :param lon: Longitude coordinates, 1D or 2D for curvilinear grids
+    :param lat: Latitude coordinates, 1D or 2D for curvilinear grids
+    :param depth: Depth coordinates
+    :param time: Time coordinates
+    :param lookup_size: Maximum number of lookup table bins along lon
+                        and lat for curvilinear grids
+    :param periodic: Declare the lon axis of a rectilinear grid periodic,
+                     either with True, for data that does not repeat the
+                     first column, or with the period in coordinate units
+    """
+
+    def __init__(self, lon, lat, depth=None, time=None, lookup_size=256,
+                 periodic=False):
+        self.lon = lon
+        self.lat = lat
+        self.depth = np.zeros(1, dtype=np.float32) if depth is None else depth
+        self.time = np.zeros(1, dtype=np.float64) if time is None else time
+
+        # Ensure that coordinates are the right data type
+        if not self.lon.dtype == np.float32:
+            print("WARNING: Casting lon data to np.float32")
+        if not self.lat.dtype == np.float32:
+            print("WARNING: Casting lat data to np.float32")
+        # Coordinates are handed to JIT code as plain pointers, so they
+        # must be C-contiguous; slices of 2D coordinates are strided
+        self.lon = np.ascontiguousarray(self.lon, dtype=np.float32)
+        self.lat = np.ascontiguousarray(self.lat, dtype=np.float32)
+        self.depth = np.ascontiguousarray(self.depth, dtype=np.float32)
+        self.time = np.ascontiguousarray(self.time, dtype=np.float64)
+
+        self.curvilinear = self.lon.ndim == 2
+        if self.curvilinear:
+            self.dlon = self.dlat = 0.
+            self.build_lookup(lookup_size)
+        else:
+            # Detect uniform spacing for constant-time index lookup in JIT code
+            self.dlon = uniform_spacing(self.lon)
+            self.dlat = uniform_spacing(self.lat)
+            self.lookup = None
+
+        # Period of the lon axis, or 0 if it is not periodic
+        if periodic is True:
+            if self.curvilinear:
+                raise NotImplementedError("Periodic curvilinear grids are not supported")
+            self.period = float(self.lon[-1] - self.lon[0] + self.lon[1] - self.lon[0])
+        else:
+            self.period = float(periodic or 0.)
+
+    @property
+    def xdim(self):
+        return self.lon.shape[-1]
+
+    @property
+    def ydim(self):
+        return self.lat.shape[0]
+
+    def build_lookup(self, lookup_size):
+        """Build the k-d tree of grid points and a coarse regular lookup
+        table that holds the flat index of the grid point nearest to the
+        centre of each bin, used to start cell searches on curvilinear
+        grids"""
+        self.tree = cKDTree(np.column_stack([self.lon.ravel(), self.lat.ravel()]))
+        nx, ny = min(self.xdim, lookup_size), min(self.ydim, lookup_size)
+        self.lookup_x0, self.lookup_y0 = float(self.lon.min()), float(self.lat.min())
+        self.lookup_dx = max(float(self.lon.max()) - self.lookup_x0, 1.e-6) / nx
+        self.lookup_dy = max(float(self.lat.max()) - self.lookup_y0, 1.e-6) / ny
+        bx, by = np.meshgrid(self.lookup_x0 + (np.arange(nx) + .5) * self.lookup_dx,
+                             self.lookup_y0 + (np.arange(ny) + .5) * self.lookup_dy)
+        _, nearest = self.tree.query(np.column_stack([bx.ravel(), by.ravel()]))
+        self.lookup = nearest.astype(np.int32).reshape((ny, nx))
+
+    def search(self, x, y, i=None, j=None):
+        """Locate the cell (i, j) of a curvilinear grid that contains
+        point (x, y), walking from the given cell or the nearest grid
+        point, and return it with the local coordinates (xsi, eta)"""
+        if i is None or j is None:
+            j, i = divmod(int(self.tree.query([x, y])[1]), self.xdim)
+        i, j = min(i, self.xdim - 2), min(j, self.ydim - 2)
+        for _ in range(self.xdim + self.ydim):
+            px = [self.lon[j, i], self.lon[j, i+1], self.lon[j+1, i+1], self.lon[j+1, i]]
+            py = [self.lat[j, i], self.lat[j, i+1], self.lat[j+1, i+1], self.lat[j+1, i]]
+            xsi, eta = cell_coords(px, py, x, y)
+            inew = min(max(i + int(xsi > 1) - int(xsi < 0), 0), self.xdim - 2)
+            jnew = min(max(j + int(eta > 1) - int(eta < 0), 0), self.ydim - 2)
+            if inew == i and jnew == j:
+                break
+            i, j = inew, jnew
+        return i, j, xsi, eta
+
+    def equals(self, other):
+        """Check whether two Axes objects hold identical coordinates"""
+        return self is other or (self.period == other.period and
+                                 all(np.array_equal(getattr(self, d), getattr(other, d))
+                                     for d in ['lon', 'lat', 'depth', 'time']))
+
+    def wrap_lon(self, x):
+        """Wrap longitude x into [lon[0], lon[0] + period) on periodic axes"""
+        if self.period > 0:
+            return x - self.period * floor((x - self.lon[0]) / self.period)
+        return x
+
+
+class CField(Structure):
+    """Ctypes struct corresponding to the CField type definition in parcels.h"""
+    _fields_ = [('xdim', c_int), ('ydim', c_int), ('tdim', c_int),
+                ('xstride', c_long), ('ystride', c_long), ('tstride', c_long),
+                ('lon', POINTER(c_float)), ('lat', POINTER(c_float)),
+                ('time', POINTER(c_double)), ('data', c_void_p),
+                ('dtype', c_int), ('scale', c_float), ('offset', c_float),
+                ('tile_index', POINTER(c_int)), ('tile_nx', c_int),
+                ('tile_y', c_int), ('tile_x', c_int),
+                ('tile_stride', c_long), ('fill', c_float),
+                ('lookup', POINTER(c_int)), ('lookup_nx', c_int), ('lookup_ny', c_int),
+                ('lookup_x0', c_float), ('lookup_y0', c_float),
+                ('lookup_dx', c_float), ('lookup_dy', c_float),
+                ('lon0', c_float), ('dlon', c_float),
+                ('lat0', c_float), ('dlat', c_float), ('period', c_float)]
+
+
+class CNested(Structure):
+    """Ctypes struct corresponding to the CNested type definition in parcels.h"""
+    _fields_ = [('nlevels', c_int), ('bounds', POINTER(c_float)),
+                ('map', POINTER(c_int)), ('map_nx', c_int), ('map_ny', c_int),
+                ('map_x0', c_float), ('map_y0', c_float),
+                ('map_dx', c_float), ('map_dy', c_float)]
+
+
+def sources_changed(sources, cached):
+    """Check whether any of the objects a cached ctypes struct was
+    built from has been replaced since"""
+    return cached is None or any(a is not b for a, b in zip(sources, cached))
+
+
 class Field(object):
     """Class that encapsulates access to field data.
 
@@ -100,51 +462,96 @@ class Field(object):
     :param data: 2D array of field data
     :param lon: Longitude coordinates of the field
     :param lat: Latitude coordinates of the field
-    :param transpose: Transpose data to required (lon, lat) layout
+    :param transpose: Data is given in (lon, lat) layout and is used
+                      in place through a transposed view. The field then
+                      shares memory with `data`, unless values have to be
+                      replaced by sanitisation, in which case it holds a
+                      copy and `data` is left unchanged
+    :param scale_factor: Scale to decode packed data with
+    :param add_offset: Offset to decode packed data with; int16 and
+                       float16 data is stored packed and decoded as
+                       ``data * scale_factor + add_offset`` on access
+    :param fill_value: Raw data value or list of values marking missing
+                       data, e.g. the _FillValue and missing_value of
+                       a netCDF variable
+    :param periodic: Periodic lon axis, see :class:`Axes`
+    :param tile_size: Store the data as a :class:`TiledArray` of tiles
+                      with this many points per side, dropping tiles
+                      that are zero throughout (e.g. land)
+    :param axes: :class:`Axes` object to share with other fields;
+                 replaces lon, lat, depth and time if given
     """
 
-    def __init__(self, name, data, lon, lat, depth=None, time=None,
-                 transpose=False, vmin=None, vmax=None, time_origin=0, units=None):
+    def __init__(self, name, data, lon=None, lat=None, depth=None, time=None,
+                 transpose=False, vmin=None, vmax=None, time_origin=0, units=None,
+                 axes=None, scale_factor=1., add_offset=0., fill_value=None,
+                 tile_size=None, periodic=False):
         self.name = name
         self.data = data
-        self.lon = lon
-        self.lat = lat
-        self.depth = np.zeros(1, dtype=np.float32) if depth is None else depth
-        self.time = np.zeros(1, dtype=np.float64) if time is None else time
+        self.axes = Axes(lon, lat, depth=depth, time=time, periodic=periodic) if axes is None else axes
         self.time_origin = time_origin
         self.units = units if units is not None else UnitConverter()
 
+        self.scale_factor = scale_factor
+        self.add_offset = add_offset
+
         # Ensure that field data is the right data type
-        if not self.data.dtype == np.float32:
+        if self.data.dtype not in data_types:
             print("WARNING: Casting field data to np.float32")
             self.data = self.data.astype(np.float32)
-        if not self.lon.dtype == np.float32:
-            print("WARNING: Casting lon data to np.float32")
-            self.lon = self.lon.astype(np.float32)
-        if not self.lat.dtype == np.float32:
-            print("WARNING: Casting lat data to np.float32")
-            self.lat = self.lat.astype(np.float32)
+        elif packed_zero(self.data.dtype, scale_factor, add_offset) is None:
+            # Sanitisation sets missing values to zero, so packed data
+            # that can not hold zero is decoded, marking them with NaN
+            print("WARNING: Unpacking field data to np.float32, as zero can not be represented")
+            missing = np.isin(self.data, fill_values(fill_value))
+            self.data = self.decode(self.data)
+            self.data[missing] = np.nan
+            self.scale_factor, self.add_offset, fill_value = 1., 0., None
         if transpose:
-            # Make a copy of the transposed array to enforce
-            # C-contiguous memory layout for JIT mode.
-            self.data = np.transpose(self.data).copy()
-        self.data = self.data.reshape((self.time.size, self.lat.size, self.lon.size))
+            # Use a transposed view rather than a copy; both the SciPy
+            # interpolators and the strided JIT access handle the
+            # resulting non-contiguous layout.
+            self.data = np.transpose(self.data)
+        self.data = self.data.reshape((self.time.size, self.axes.ydim, self.axes.xdim))
+        # Transposed views of the caller's data are copied before values
+        # are replaced, which leaves the given array unchanged
+        aliased = transpose and np.may_share_memory(self.data, data)
 
         # Hack around the fact that NaN and ridiculously large values
         # propagate in SciPy's interpolators
-        if vmin is not None:
-            self.data[self.data < vmin] = 0.
-        if vmax is not None:
-            self.data[self.data > vmax] = 0.
-        self.data[np.isnan(self.data)] = 0.
+        self.data = sanitise(self.data, vmin=vmin, vmax=vmax, scale_factor=self.scale_factor,
+                             add_offset=self.add_offset, fill_value=fill_value, copy=aliased)
 
-        # Variable names in JIT code
+        # Drop all-zero tiles, which sanitisation yields for masked land
+        if tile_size is not None:
+            zero = packed_zero(self.data.dtype, self.scale_factor, self.add_offset)
+            self.data = TiledArray(self.data, tile_size, fill=zero)
+
+        # Variable names and struct type in JIT code
+        self.ccode_struct = 'CField'
         self.ccode_data = self.name
         self.ccode_lon = self.name + "_lon"
         self.ccode_lat = self.name + "_lat"
 
         self.interpolator_cache = LRUCache(maxsize=2)
         self.time_index_cache = LRUCache(maxsize=2)
+        self._cstruct, self._cstruct_sources = None, None
+
+    @property
+    def lon(self):
+        return self.axes.lon
+
+    @property
+    def lat(self):
+        return self.axes.lat
+
+    @property
+    def depth(self):
+        return self.axes.depth
+
+    @property
+    def time(self):
+        return self.axes.time
 
     @classmethod
     def from_netcdf(cls, name, dimensions, filenames, **kwargs):
@@ -169,9 +576,11 @@ class Field(object):
         # Concatenate time variable to determine overall dimension
         # across multiple files
         timeslices = []
+        packings = []
         for fname in filenames:
             with FileBuffer(fname, dimensions) as filebuffer:
                 timeslices.append(filebuffer.time)
+                packings.append(filebuffer.packing)
         timeslices = np.array(timeslices)
         time = np.concatenate(timeslices)
         if time_units is None:
@@ -179,11 +588,18 @@ class Field(object):
         else:
             time_origin = num2date(0, time_units, calendar)
 
+        # Keep packed int16 data if all files share the same packing
+        packed = packings[0] is not None and packings.count(packings[0]) == len(packings)
+        if packed:
+            dtype, kwargs['scale_factor'], kwargs['add_offset'], kwargs['fill_value'] = packings[0]
+        else:
+            dtype = np.float32
+
         # Pre-allocate grid data before reading files into buffer
-        data = np.empty((time.size, 1, lat.size, lon.size), dtype=np.float32)
+        data = np.empty((time.size, 1, lat.shape[0], lon.shape[-1]), dtype=dtype)
         tidx = 0
         for tslice, fname in zip(timeslices, filenames):
-            with FileBuffer(fname, dimensions) as filebuffer:
+            with FileBuffer(fname, dimensions, packed=packed) as filebuffer:
                 data[tidx:, 0, :, :] = filebuffer.data[:, :, :]
             tidx += tslice.size
         return cls(name, data, lon, lat, depth=depth, time=time,
@@ -218,7 +634,7 @@ class Field(object):
         dVdx = np.zeros(shape=(time.size, lat.size, lon.size), dtype=np.float32)
         dVdy = np.zeros(shape=(time.size, lat.size, lon.size), dtype=np.float32)
         for t in np.nditer(np.int32(time_i)):
-            grad = CentralDifferences(np.transpose(self.data[t, :, :][np.ix_(lat_i, lon_i)]), lat, lon)
+            grad = CentralDifferences(np.transpose(self.decode(self.data[t, :, :])[np.ix_(lat_i, lon_i)]), lat, lon)
             dVdx[t, :, :] = np.array(np.transpose(grad[0]))
             dVdy[t, :, :] = np.array(np.transpose(grad[1]))
 
@@ -227,16 +643,20 @@ class Field(object):
 
     @cachedmethod(operator.attrgetter('interpolator_cache'))
     def interpolator2D(self, t_idx):
-        return RegularGridInterpolator((self.lat, self.lon),
-                                       self.data[t_idx, :])
+        data = self.decode(self.data[t_idx, :])
+        if self.axes.period > 0:
+            # Close the periodic seam with a wrapped copy of the first column
+            lon = np.append(self.lon, self.lon[0] + self.axes.period)
+            return RegularGridInterpolator((self.lat, lon), np.hstack([data, data[:, :1]]))
+        return RegularGridInterpolator((self.lat, self.lon), data)
 
     def interpolator1D(self, idx, time, y, x):
         # Return linearly interpolated field value:
         if x is None and y is None:
             t0 = self.time[idx-1]
             t1 = self.time[idx]
-            f0 = self.data[idx-1, :]
-            f1 = self.data[idx, :]
+            f0 = self.decode(self.data[idx-1, :])
+            f1 = self.decode(self.data[idx, :])
         else:
             f0 = self.interpolator2D(idx-1)((y, x))
             f1 = self.interpolator2D(idx)((y, x))
@@ -244,6 +664,13 @@ class Field(object):
             t1 = self.time[idx]
         return f0 + (f1 - f0) * ((time - t0) / (t1 - t0))
 
+    def decode(self, data):
+        """Return (a slice of) the field data as float32 values"""
+        data = np.asarray(data)
+        if data.dtype == np.float32 and self.scale_factor == 1. and self.add_offset == 0.:
+            return data
+        return data.astype(np.float32) * np.float32(self.scale_factor) + np.float32(self.add_offset)
+
     @cachedmethod(operator.attrgetter('time_index_cache'))
     def time_index(self, time):
         time_index = self.time < time
@@ -254,41 +681,168 @@ class Field(object):
         else:
             return time_index.argmin()
 
+    def interpolator_curvilinear(self, idx, time, x, y):
+        """Interpolate linearly in time and bilinearly in the index space
+        of the curvilinear cell containing (x, y)"""
+        i, j, xsi, eta = self.axes.search(x, y)
+        weights = np.array([[(1-xsi)*(1-eta), xsi*(1-eta)], [(1-xsi)*eta, xsi*eta]])
+
+        def sample(t):
+            return np.sum(weights * self.decode(self.data[t, j:j+2, i:i+2]))
+
+        if idx > 0:
+            t0, t1 = self.time[idx-1], self.time[idx]
+            f0, f1 = sample(idx-1), sample(idx)
+            return f0 + (f1 - f0) * ((time - t0) / (t1 - t0))
+        return sample(idx)
+
     def eval(self, time, x, y):
         idx = self.time_index(time)
-        if idx > 0:
+        x = self.axes.wrap_lon(x)
+        if self.axes.curvilinear:
+            value = self.interpolator_curvilinear(idx, time, x, y)
+        elif idx > 0:
             value = self.interpolator1D(idx, time, y, x)
         else:
             value = self.interpolator2D(idx)((y, x))
         return self.units.to_target(value, x, y)
 
-    def ccode_subscript(self, t, x, y):
-        ccode = "%s * temporal_interpolation_linear(%s, %s, %s, %s, %s, %s)" \
-                % (self.units.ccode_to_target(x, y),
-                   x, y, "particle->xi", "particle->yi", t, self.name)
+    def ccode_subscript(self, t, x, y, hints):
+        xi, yi, ti = hints(self)
+        interpolation = 'curvilinear' if self.axes.curvilinear else 'linear'
+        ccode = "%s * temporal_interpolation_%s(%s, %s, %s, %s, %s, %s, %s)" \
+                % (self.units.ccode_to_target(x, y), interpolation,
+                   x, y, xi, yi, ti, t, self.name)
         return ccode
 
     @property
     def ctypes_struct(self):
         """Returns a ctypes struct object containing all relevnt
-        pointers and sizes for this field."""
-
-        # Ctypes struct corresponding to the type definition in parcels.h
-        class CField(Structure):
-            _fields_ = [('xdim', c_int), ('ydim', c_int),
-                        ('tdim', c_int), ('tidx', c_int),
-                        ('lon', POINTER(c_float)), ('lat', POINTER(c_float)),
-                        ('time', POINTER(c_double)),
-                        ('data', POINTER(POINTER(c_float)))]
-
-        # Create and populate the c-struct object
-        cstruct = CField(self.lon.size, self.lat.size, self.time.size, 0,
+        pointers and sizes for this field. The struct is cached and
+        only rebuilt once the data, axes or coordinate arrays of the
+        field have been replaced."""
+        sources = (self.data, self.axes, self.lon, self.lat, self.time,
+                   self.axes.lookup, self.scale_factor, self.add_offset, self.axes.period)
+        if sources_changed(sources, self._cstruct_sources):
+            # Hold on to the sources, so that their ids remain valid
+            self._cstruct, self._cstruct_sources = self._build_ctypes_struct(), sources
+        return self._cstruct
+
+    def _build_ctypes_struct(self):
+        # Create and populate the c-struct object; strides are passed
+        # in elements so that non-contiguous data is sampled in place
+        if isinstance(self.data, TiledArray):
+            data, index = self.data.tiles, self.data.index
+            tile_y, tile_x = self.data.tile_size
+            tile_index = index.ctypes.data_as(POINTER(c_int))
+            tile_stride = data.strides[0] // data.itemsize
+            fill = float(self.decode(np.array(self.data.fill, dtype=data.dtype)))
+        else:
+            data, index, tile_index = self.data, np.zeros((0, 0)), None
+            tile_y, tile_x, tile_stride, fill = 0, 0, 0, 0.
+        if self.axes.curvilinear:
+            lookup = self.axes.lookup
+            lookup_args = (lookup.ctypes.data_as(POINTER(c_int)), lookup.shape[1], lookup.shape[0],
+                           self.axes.lookup_x0, self.axes.lookup_y0,
+                           self.axes.lookup_dx, self.axes.lookup_dy)
+        else:
+            lookup_args = (None, 0, 0, 0., 0., 0., 0.)
+        tstride, ystride, xstride = [s // data.itemsize for s in data.strides[-3:]]
+        cstruct = CField(self.axes.xdim, self.axes.ydim, self.time.size,
+                         xstride, ystride, tstride,
                          self.lon.ctypes.data_as(POINTER(c_float)),
                          self.lat.ctypes.data_as(POINTER(c_float)),
                          self.time.ctypes.data_as(POINTER(c_double)),
-                         self.data.ctypes.data_as(POINTER(POINTER(c_float))))
+                         data.ctypes.data, data_types[data.dtype],
+                         self.scale_factor, self.add_offset,
+                         tile_index, index.shape[1], tile_y, tile_x, tile_stride, fill,
+                         lookup_args[0], lookup_args[1], lookup_args[2], lookup_args[3],
+                         lookup_args[4], lookup_args[5], lookup_args[6],
+                         self.lon.flat[0], self.axes.dlon, self.lat.flat[0], self.axes.dlat,
+                         self.axes.period)
         return cstruct
 
+    @property
+    def arrays(self):
+        """Dictionary of all coordinate and data arrays held by this field"""
+        arrays = {'data': self.data, 'lon': self.lon, 'lat': self.lat,
+                  'depth': self.depth, 'time': self.time}
+        if isinstance(self.data, TiledArray):
+            arrays['data'], arrays['tile_index'] = self.data.tiles, self.data.index
+        if self.axes.curvilinear:
+            arrays['lookup'] = self.axes.lookup
+            arrays['tree_data'], arrays['tree_indices'] = self.axes.tree.data, self.axes.tree.indices
+        return arrays
+
+    @property
+    def cache_arrays(self):
+        """List of arrays held by cached interpolator objects that are
+        not views onto the field's own data or coordinates"""
+        arrays = []
+        for interp in self.interpolator_cache.values():
+            for a in list(interp.grid) + [interp.values]:
+                if not any(np.may_share_memory(a, b) for b in self.arrays.values()):
+                    arrays.append(a)
+        return arrays
+
+    def memory_usage(self):
+        """Returns a dictionary with the number of bytes held by each
+        array of this field, the interpolator cache and their total"""
+        usage = dict((name, a.nbytes) for name, a in self.arrays.items())
+        usage['interpolator_cache'] = unique_nbytes(self.cache_arrays)
+        usage['total'] = sum(usage.values())
+        return usage
+
+    @classmethod
+    def estimate_memory(cls, dimensions, filenames, transpose=False,
+                        vmin=None, vmax=None, lookup_size=256):
+        """Estimate the memory required by :meth:`from_netcdf` from the
+        file metadata alone, before any field data is read.
+
+        :param dimensions: Variable names for the relevant dimensions
+        :param filenames: Single or multiple netCDF file(s) containing
+        field data, as passed to :meth:`from_netcdf`
+        :param lookup_size: Lookup table size of curvilinear grids, see :class:`Axes`
+        :returns: Dictionary with the bytes held by the final field
+        ('data', 'coordinates') and the predicted 'peak' usage during
+        loading, which includes the largest temporary buffer
+        """
+        if not isinstance(filenames, Iterable) or isinstance(filenames, str):
+            filenames = [filenames]
+        with FileBuffer(filenames[0], dimensions) as filebuffer:
+            curvilinear = filebuffer.curvilinear
+            # Coordinates are read in the data type of the file
+            coords_read = sum(int(np.prod(v.shape)) * v.dtype.itemsize
+                              for v in [filebuffer.dataset[dimensions[d]] for d in ['lon', 'lat']])
+        packings = []
+        for fname in filenames:
+            with FileBuffer(fname, dimensions) as filebuffer:
+                packings.append(filebuffer.packing)
+        packed = packings[0] is not None and packings.count(packings[0]) == len(packings)
+        tsize, file_bytes = 0, []
+        for fname in filenames:
+            with FileBuffer(fname, dimensions, packed=packed) as filebuffer:
+                nt, ny, nx = filebuffer.data_shape
+                tsize += nt
+                # Read buffer, plus the mask of a masked array if unpacked
+                file_bytes.append(nt * ny * nx * (filebuffer.data_itemsize + int(not packed)))
+        itemsize = packings[0][0].itemsize if packed else np.dtype(np.float32).itemsize
+        nbytes = tsize * ny * nx * itemsize
+        # Axes hold float32 lon, lat and depth and float64 time
+        if curvilinear:
+            # 2D lon and lat, the lookup table and the k-d tree points and indices
+            coords = 2 * 4 * ny * nx + 4 * min(nx, lookup_size) * min(ny, lookup_size) \
+                + (2 * 8 + np.dtype(np.intp).itemsize) * ny * nx
+        else:
+            coords = 4 * (nx + ny)
+        coords += 4 + 8 * tsize
+        # Chunked vmin/vmax/NaN sanitisation in __init__ only needs bounded
+        # scratch; transposition uses a view and adds no temporary buffer
+        scratch = sanitise_scratch((tsize, ny, nx), vmin=vmin, vmax=vmax)
+        temporary = max(max(file_bytes), scratch, coords_read)
+        return {'data': nbytes, 'coordinates': coords,
+                'peak': nbytes + coords + temporary}
+
     def show(self, **kwargs):
         if plt is None:
             raise RuntimeError("Visualisation not possible: matplotlib not found!")
@@ -299,7 +853,7 @@ class Field(object):
         if self.time.size > 1:
             data = np.squeeze(self.interpolator1D(idx, t, None, None))
         else:
-            data = np.squeeze(self.data)
+            data = np.squeeze(self.decode(self.data))
         vmin = kwargs.get('vmin', data.min())
         vmax = kwargs.get('vmax', data.max())
         cs = plt.contourf(self.lon, self.lat, data,
@@ -325,7 +879,7 @@ class Field(object):
                                  coords=[('y', self.lat), ('x', self.lon)])
         nav_lat = xray.DataArray(self.lat.reshape(y, 1) + np.zeros(x, dtype=np.float32),
                                  coords=[('y', self.lat), ('x', self.lon)])
-        vardata = xray.DataArray(self.data.reshape((t, d, y, x)),
+        vardata = xray.DataArray(self.decode(self.data).reshape((t, d, y, x)),
                                  coords=[('time_counter', self.time),
                                          (vname_depth, self.depth),
                                          ('y', self.lat), ('x', self.lon)])
@@ -335,12 +889,129 @@ class Field(object):
         dset.to_netcdf(filepath)
 
 
+class NestedField(object):
+    """Field composed of several fields of different resolution, such as
+    high-resolution nests inside a coarser parent domain. Values are
+    sampled from the finest level whose bounding box covers the sample
+    position. A precomputed coverage map holds the finest level that
+    intersects each of its bins, so that only the bounding boxes of that
+    level and coarser ones need to be checked per sample.
+
+    :param name: Name of the field
+    :param fields: List of :class:`Field` objects ordered from the finest
+                   to the coarsest level, which should cover the domain.
+                   The levels are renamed shallow copies sharing the data.
+    :param map_size: Maximum number of coverage map bins along lon and lat
+    """
+
+    def __init__(self, name, fields, map_size=512):
+        self.name = name
+        self.fields = []
+        for level, field in enumerate(fields):
+            field = copy(field)
+            field.name = field.ccode_data = '%s_%d' % (name, level)
+            field.axes = copy(field.axes)
+            field.interpolator_cache = LRUCache(maxsize=2)
+            field.time_index_cache = LRUCache(maxsize=2)
+            self.fields.append(field)
+        self.units = self.fields[0].units
+        self.time = self.fields[-1].time
+        self.time_origin = self.fields[-1].time_origin
+        # Coordinates of the finest level, which owns the default index hints
+        self.lon, self.lat = self.fields[0].lon, self.fields[0].lat
+        self.ccode_struct = 'CNested'
+        self._cstruct, self._cstruct_sources = None, None
+
+        # Bounding boxes (lon_min, lon_max, lat_min, lat_max) of all levels
+        self.bounds = np.array([[f.lon.min(), f.lon.max(), f.lat.min(), f.lat.max()]
+                                for f in self.fields], dtype=np.float32)
+        # Coverage map at the grid spacing of the finest level
+        x0, x1 = self.bounds[:, 0].min(), self.bounds[:, 1].max()
+        y0, y1 = self.bounds[:, 2].min(), self.bounds[:, 3].max()
+        finest = self.fields[0].axes
+        dx = (self.bounds[0, 1] - self.bounds[0, 0]) / max(finest.xdim - 1, 1)
+        dy = (self.bounds[0, 3] - self.bounds[0, 2]) / max(finest.ydim - 1, 1)
+        nx = int(min(map_size, max(1, np.ceil((x1 - x0) / max(dx, 1.e-6)))))
+        ny = int(min(map_size, max(1, np.ceil((y1 - y0) / max(dy, 1.e-6)))))
+        self.map_x0, self.map_y0 = float(x0), float(y0)
+        self.map_dx = max(float(x1 - x0), 1.e-6) / nx
+        self.map_dy = max(float(y1 - y0), 1.e-6) / ny
+        bx = self.map_x0 + np.arange(nx) * self.map_dx
+        by = self.map_y0 + np.arange(ny) * self.map_dy
+        self.map = np.zeros((ny, nx), dtype=np.int32)
+        for level in reversed(range(len(self.fields))):
+            lon_min, lon_max, lat_min, lat_max = self.bounds[level]
+            cover_x = (bx + self.map_dx >= lon_min) & (bx <= lon_max)
+            cover_y = (by + self.map_dy >= lat_min) & (by <= lat_max)
+            self.map[np.ix_(cover_y, cover_x)] = level
+
+    def level(self, x, y):
+        """Index of the finest level covering position (x, y)"""
+        bx = min(max(int(floor((x - self.map_x0) / self.map_dx)), 0), self.map.shape[1] - 1)
+        by = min(max(int(floor((y - self.map_y0) / self.map_dy)), 0), self.map.shape[0] - 1)
+        for level in range(self.map[by, bx], len(self.fields) - 1):
+            lon_min, lon_max, lat_min, lat_max = self.bounds[level]
+            if lon_min <= x <= lon_max and lat_min <= y <= lat_max:
+                return level
+        return len(self.fields) - 1
+
+    def __getitem__(self, key):
+        return self.eval(*key)
+
+    def eval(self, time, x, y):
+        return self.fields[self.level(x, y)].eval(time, x, y)
+
+    def ccode_subscript(self, t, x, y, hints):
+        # Per-level index hints and fields are passed as compound literals
+        hints = ["(int*[]){%s}" % ", ".join([hints(f)[d] for f in self.fields])
+                 for d in range(3)]
+        levels = ", ".join(f.name for f in self.fields)
+        return "%s * nested_interpolation(%s, %s, %s, %s, %s, %s, %s, (CField*[]){%s})" \
+            % (self.units.ccode_to_target(x, y), x, y, hints[0], hints[1], hints[2],
+               t, self.name, levels)
+
+    @property
+    def ctypes_struct(self):
+        """Returns a ctypes struct object with the level bounds and the
+        coverage map of this nested field, rebuilt only once these have
+        been replaced."""
+        sources = (self.bounds, self.map, self.map_x0, self.map_y0, self.map_dx, self.map_dy)
+        if sources_changed(sources, self._cstruct_sources):
+            self._cstruct = CNested(len(self.fields), self.bounds.ctypes.data_as(POINTER(c_float)),
+                                    self.map.ctypes.data_as(POINTER(c_int)),
+                                    self.map.shape[1], self.map.shape[0], self.map_x0, self.map_y0,
+                                    self.map_dx, self.map_dy)
+            self._cstruct_sources = sources
+        return self._cstruct
+
+    @property
+    def arrays(self):
+        """Dictionary of all arrays held by the levels of this field"""
+        arrays = {'bounds': self.bounds, 'map': self.map}
+        for f in self.fields:
+            arrays.update(('%s_%s' % (f.name, n), a) for n, a in f.arrays.items())
+        return arrays
+
+    @property
+    def cache_arrays(self):
+        return [a for f in self.fields for a in f.cache_arrays]
+
+    def memory_usage(self):
+        """Returns a dictionary with the number of bytes held by each
+        array of this field, the interpolator caches and their total"""
+        usage = dict((name, a.nbytes) for name, a in self.arrays.items())
+        usage['interpolator_cache'] = unique_nbytes(self.cache_arrays)
+        usage['total'] = sum(usage.values())
+        return usage
+
+
 class FileBuffer(object):
     """ Class that encapsulates and manages deferred access to file data. """
 
-    def __init__(self, filename, dimensions):
+    def __init__(self, filename, dimensions, packed=False):
         self.filename = filename
         self.dimensions = dimensions  # Dict with dimension keyes for file data
+        self.packed = packed  # Read data in its packed form, see `packing`
         self.dataset = None
 
     def __enter__(self):
@@ -350,22 +1021,81 @@ class FileBuffer(object):
     def __exit__(self, type, value, traceback):
         self.dataset.close()
 
+    def coordinates(self, name):
+        """2D (lat, lon) array of the lon or lat coordinate variable"""
+        var = self.dataset[self.dimensions[name]]
+        return np.asarray(var[:]).reshape(var.shape[-2:])
+
+    @property
+    def curvilinear(self):
+        """Whether 2D coordinates describe a curvilinear grid, rather
+        than a rectilinear one stored in 2D as is common for NEMO"""
+        if len(self.dataset[self.dimensions['lon']].shape) < 2:
+            return False
+        lon, lat = self.coordinates('lon'), self.coordinates('lat')
+        return not (np.all(lon == lon[:1, :]) and np.all(lat == lat[:, :1]))
+
     @property
     def lon(self):
         lon = self.dataset[self.dimensions['lon']]
-        return lon[0, :] if len(lon.shape) > 1 else lon[:]
+        if len(lon.shape) < 2:
+            return lon[:]
+        if self.curvilinear:
+            return self.coordinates('lon')
+        return np.ascontiguousarray(self.coordinates('lon')[0, :])
 
     @property
     def lat(self):
         lat = self.dataset[self.dimensions['lat']]
-        return lat[:, 0] if len(lat.shape) > 1 else lat[:]
+        if len(lat.shape) < 2:
+            return lat[:]
+        if self.curvilinear:
+            return self.coordinates('lat')
+        return np.ascontiguousarray(self.coordinates('lat')[:, 0])
+
+    @property
+    def data_shape(self):
+        """Shape (time, lat, lon) of the field data, read from metadata"""
+        shape = self.dataset[self.dimensions['data']].shape
+        return (shape[0], ) + tuple(shape[-2:])
+
+    @property
+    def data_itemsize(self):
+        """Size in bytes of a single field value as read from file"""
+        var = self.dataset[self.dimensions['data']]
+        if not self.packed and (hasattr(var, 'scale_factor') or hasattr(var, 'add_offset')):
+            return np.dtype(np.float64).itemsize
+        return var.dtype.itemsize
+
+    @property
+    def packing(self):
+        """Tuple of (dtype, scale_factor, add_offset, fill_values) for
+        int16 data that can be kept packed in memory, or None. The fill
+        values are those of the _FillValue and missing_value attributes;
+        data is only kept packed if zero can be represented."""
+        var = self.dataset[self.dimensions['data']]
+        if var.dtype != np.int16:
+            return None
+        scale_factor = float(getattr(var, 'scale_factor', 1.))
+        add_offset = float(getattr(var, 'add_offset', 0.))
+        if packed_zero(var.dtype, scale_factor, add_offset) is None:
+            return None
+        missing = [int(getattr(var, attr)) for attr in ['_FillValue', 'missing_value']
+                   if hasattr(var, attr)]
+        return (var.dtype, scale_factor, add_offset, missing or None)
 
     @property
     def data(self):
-        if len(self.dataset[self.dimensions['data']].shape) == 3:
-            return self.dataset[self.dimensions['data']][:, :, :]
+        var = self.dataset[self.dimensions['data']]
+        var.set_auto_maskandscale(not self.packed)
+        if len(var.shape) == 3:
+            data = var[:, :, :]
         else:
-            return self.dataset[self.dimensions['data']][:, 0, :, :]
+            data = var[:, 0, :, :]
+        if np.ma.isMaskedArray(data) and np.issubdtype(data.dtype, np.floating):
+            # Missing values become NaN, which sanitisation sets to zero
+            data = np.ma.filled(data, np.nan)
+        return data
 
     @property
     def time(self):
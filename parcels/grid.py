@@ -1,4 +1,4 @@
-from parcels.field import Field, UnitConverter, Geographic, GeographicPolar
+from parcels.field import Field, NestedField, Axes, UnitConverter, Geographic, GeographicPolar, unique_nbytes
 from parcels.particle import ParticleSet
 import numpy as np
 from py import path
@@ -6,7 +6,7 @@ from glob import glob
 from collections import defaultdict
 
 
-__all__ = ['Grid']
+__all__ = ['Grid', 'NestedGrid']
 
 
 def unit_converters(mesh):
@@ -36,15 +36,46 @@ class Grid(object):
         self.depth = depth
         self.time = time
         self.fields = fields
+        self.axes = []
+
+        # Let fields with identical coordinates share a single Axes object
+        self.share_axes(U)
+        self.share_axes(V)
+        for name, field in fields.items():
+            self.share_axes(field)
 
         # Add additional fields as attributes
         for name, field in fields.items():
             setattr(self, name, field)
 
+    def share_axes(self, field):
+        """Point the field to an existing :class:`Axes` object with identical
+        coordinates, or register its axes as a new set of grid axes"""
+        if isinstance(field, NestedField):
+            for level in field.fields:
+                self.share_axes(level)
+            return
+        for axes in self.axes:
+            if axes.equals(field.axes):
+                field.axes = axes
+                return
+        self.axes.append(field.axes)
+
+    def index_vars(self, axes):
+        """Names of the per-particle grid and time index hints for a set
+        of axes in JIT mode: xi, yi and ti for the axes of U and suffixed
+        names for every further set of axes of this grid"""
+        n = [i for i, a in enumerate(self.axes) if a is axes]
+        n = n or [i for i, a in enumerate(self.axes) if a.equals(axes)]
+        n = n[0] if n else len(self.axes)
+        if n == 0:
+            return ('xi', 'yi', 'ti')
+        return tuple('%s_%d' % (v, n) for v in ('xi', 'yi', 'ti'))
+
     @classmethod
     def from_data(cls, data_u, lon_u, lat_u, data_v, lon_v, lat_v,
                   depth=None, time=None, field_data={}, transpose=True,
-                  mesh='spherical', **kwargs):
+                  mesh='spherical', periodic=False, **kwargs):
         """Initialise Grid object from raw data
 
         :param data_u: Zonal velocity data
@@ -60,22 +91,26 @@ class Grid(object):
                        * sperical (default): Lat and lon in degree, with a
                          correction for zonal velocity U near the poles.
                        * flat: No conversion, lat/lon are assumed to be in m.
+        :param periodic: Declare the lon axes periodic, see :class:`Axes`
         """
         depth = np.zeros(1, dtype=np.float32) if depth is None else depth
         time = np.zeros(1, dtype=np.float64) if time is None else time
         u_units, v_units = unit_converters(mesh)
+        axes_u = Axes(lon_u, lat_u, depth=depth, time=time, periodic=periodic)
+        axes_v = Axes(lon_v, lat_v, depth=depth, time=time, periodic=periodic)
+        axes_v = axes_u if axes_u.equals(axes_v) else axes_v
+        axes_f = Axes(lon_v, lat_u, depth=depth, time=time, periodic=periodic)
+        axes_f = axes_u if axes_u.equals(axes_f) else axes_f
         # Create velocity fields
-        ufield = Field('U', data_u, lon_u, lat_u, depth=depth,
-                       time=time, transpose=transpose,
+        ufield = Field('U', data_u, axes=axes_u, transpose=transpose,
                        units=u_units, **kwargs)
-        vfield = Field('V', data_v, lon_v, lat_v, depth=depth,
-                       time=time, transpose=transpose,
+        vfield = Field('V', data_v, axes=axes_v, transpose=transpose,
                        units=v_units, **kwargs)
         # Create additional data fields
         fields = {}
         for name, data in field_data.items():
-            fields[name] = Field(name, data, lon_v, lat_u, depth=depth,
-                                 time=time, transpose=transpose, **kwargs)
+            fields[name] = Field(name, data, axes=axes_f,
+                                 transpose=transpose, **kwargs)
         return cls(ufield, vfield, depth, time, fields=fields)
 
     @classmethod
@@ -94,6 +129,10 @@ class Grid(object):
                        * sperical (default): Lat and lon in degree, with a
                          correction for zonal velocity U near the poles.
                        * flat: No conversion, lat/lon are assumed to be in m.
+
+        Files with curvilinear 2D coordinates are supported, but U and V
+        are used as given along the grid directions and are not rotated
+        to eastward and northward velocities.
         """
         # Determine unit converters for all fields
         u_units, v_units = unit_converters(mesh)
@@ -133,12 +172,23 @@ class Grid(object):
                                dimensions=dimensions, **kwargs)
 
     def add_field(self, field):
+        self.share_axes(field)
         self.fields.update({field.name: field})
         setattr(self, field.name, field)
 
     def ParticleSet(self, *args, **kwargs):
         return ParticleSet(*args, grid=self, **kwargs)
 
+    def memory_usage(self):
+        """Returns a dictionary with the per-field memory usage in bytes
+        (see :meth:`Field.memory_usage`) and the overall 'total', in
+        which arrays shared between fields are counted only once"""
+        fields = [self.U, self.V] + list(self.fields.values())
+        usage = dict((f.name, f.memory_usage()) for f in fields)
+        arrays = [a for f in fields for a in list(f.arrays.values()) + f.cache_arrays]
+        usage['total'] = unique_nbytes(arrays)
+        return usage
+
     def eval(self, x, y):
         u = self.U.eval(x, y)
         v = self.V.eval(x, y)
@@ -156,3 +206,30 @@ class Grid(object):
         for f in self.fields:
             field = getattr(self, f)
             field.write(filename)
+
+
+class NestedGrid(Grid):
+    """Grid composed of several grids of different resolution, such as
+    high-resolution nests inside a coarser parent domain. Velocities and
+    all fields defined on every grid are sampled from the finest grid
+    whose bounding box covers the particle position, so that particles
+    outside the nests only pay for coarse interpolation.
+
+    :param grids: List of :class:`Grid` objects; the coarsest grid
+                  should cover the whole domain
+    :param map_size: Maximum number of coverage map bins along lon and lat
+    """
+    def __init__(self, grids, map_size=512):
+        # Order levels from the finest to the coarsest grid spacing
+        def spacing(grid):
+            lon, lat = grid.U.lon, grid.U.lat
+            return (lon.max() - lon.min()) * (lat.max() - lat.min()) \
+                / max(grid.U.axes.xdim * grid.U.axes.ydim, 1)
+        self.grids = sorted(grids, key=spacing)
+        names = set.intersection(*[set(g.fields.keys()) for g in self.grids])
+        fields = dict((name, NestedField(name, [getattr(g, name) for g in self.grids],
+                                         map_size=map_size)) for name in names)
+        U = NestedField('U', [g.U for g in self.grids], map_size=map_size)
+        V = NestedField('V', [g.V for g in self.grids], map_size=map_size)
+        coarsest = self.grids[-1]
+        super(NestedGrid, self).__init__(U, V, coarsest.depth, coarsest.time, fields=fields)
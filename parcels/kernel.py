@@ -1,9 +1,11 @@
 from parcels.codegenerator import KernelGenerator, LoopGenerator
 from parcels.compiler import get_cache_dir
 from os import path
+import numpy as np
 import numpy.ctypeslib as npct
-from ctypes import c_int, c_float, c_double, c_void_p, byref
-from ast import parse, FunctionDef, Module
+from ctypes import c_int, c_long, c_float, c_double, c_void_p, byref, Structure
+from ast import parse, walk, FunctionDef, Module, Subscript, Attribute, Name
+from timeit import default_timer as timer
 import inspect
 from copy import deepcopy
 import re
@@ -33,11 +35,38 @@ def fix_indentation(string):
     return "\n".join(lines)
 
 
+def count_field_samples(py_ast):
+    """Count the field sampling expressions (grid.F[...]) in a kernel AST
+
+    This is a static estimate: branches and loops in the kernel are not
+    taken into account."""
+    return len([node for node in walk(py_ast) if isinstance(node, Subscript)
+                and isinstance(node.value, Attribute)
+                and isinstance(node.value.value, Name)
+                and node.value.value.id == 'grid'])
+
+
+def uses_random(py_ast):
+    """Check whether a kernel AST draws random numbers"""
+    return any(isinstance(node, Name) and node.id == 'random' for node in walk(py_ast))
+
+
+class CStats(Structure):
+    """Ctypes struct corresponding to the CStats counters in parcels.h"""
+    _fields_ = [('index_search_steps', c_long), ('time_index_moves', c_long),
+                ('bilinear_evals', c_long), ('kernel_rejections', c_long)]
+
+
 class Kernel(object):
     """Kernel object that encapsulates auto-generated code.
 
     :arg grid: Grid object providing the field information
     :arg ptype: PType object for the kernel particle
+    :arg instrument: Compile the JIT kernel with hot-path counters
+                     for index searches, time-index moves, bilinear
+                     evaluations and rejected steps (see :attr:`stats`)
+    :arg user_ctx: Namespace to compile a kernel given by py_ast in;
+                   defaults to the globals of the outermost calling frame
 
     Note: A Kernel is either created from a compiled <function ...> object
     or the necessary information (funcname, funccode, funcvars) is provided.
@@ -46,9 +75,11 @@ class Kernel(object):
     """
 
     def __init__(self, grid, ptype, pyfunc=None, funcname=None,
-                 funccode=None, py_ast=None, funcvars=None):
+                 funccode=None, py_ast=None, funcvars=None, instrument=False,
+                 user_ctx=None):
         self.grid = grid
         self.ptype = ptype
+        self.instrument = instrument
 
         # Derive meta information from pyfunc, if not given
         self.funcname = funcname or pyfunc.__name__
@@ -56,18 +87,19 @@ class Kernel(object):
         self.funccode = funccode or inspect.getsource(pyfunc.__code__)
         # Parse AST if it is not provided explicitly
         self.py_ast = py_ast or parse(fix_indentation(self.funccode)).body[0]
-        if pyfunc is None:
+        if pyfunc is None and user_ctx is None:
             # Extract user context by inspecting the call stack
             stack = inspect.stack()
             try:
                 user_ctx = stack[-1][0].f_globals
-                user_ctx['math'] = globals()['math']
-                user_ctx['random'] = globals()['random']
             except:
                 print("Warning: Could not access user context when merging kernels")
                 user_ctx = globals()
             finally:
                 del stack  # Remove cyclic references
+        if pyfunc is None:
+            user_ctx['math'] = globals()['math']
+            user_ctx['random'] = globals()['random']
             # Compile and generate Python function from AST
             py_mod = Module(body=[self.py_ast])
             exec(compile(py_mod, "<ast>", "exec"), user_ctx)
@@ -75,9 +107,13 @@ class Kernel(object):
         else:
             self.pyfunc = pyfunc
         self.name = "%s%s" % (ptype.name, self.funcname)
+        self.field_samples = count_field_samples(self.py_ast)
+        self.uses_random = uses_random(self.py_ast)
+        self.timings = {'codegen': 0., 'compile': 0., 'load': 0.}
 
         # Generate the kernel function and add the outer loop
         if self.ptype.uses_jit:
+            tic = timer()
             kernelgen = KernelGenerator(grid, ptype)
             self.field_args = kernelgen.field_args
             kernel_ccode = kernelgen.generate(deepcopy(self.py_ast),
@@ -86,71 +122,152 @@ class Kernel(object):
             loopgen = LoopGenerator(grid, ptype)
             adaptive = 'AdvectionRK45' in self.funcname
             self.ccode = loopgen.generate(self.funcname, self.field_args,
-                                          kernel_ccode, adaptive=adaptive)
+                                          kernel_ccode, adaptive=adaptive,
+                                          instrument=instrument)
 
             basename = path.join(get_cache_dir(), self._cache_key)
             self.src_file = "%s.c" % basename
             self.lib_file = "%s.so" % basename
             self.log_file = "%s.log" % basename
+            self.timings['codegen'] = timer() - tic
         self._lib = None
+        self._stats = None
+        self._fstructs, self._fargs = None, None
 
     @property
     def _cache_key(self):
         field_keys = "-".join(["%s:%s" % (name, field.units.__class__.__name__)
                                for name, field in self.field_args.items()])
         key = self.name + self.ptype._cache_key + field_keys
+        if self.instrument:
+            key += "-stats"
+        # The generated code depends on the grid layout (curvilinear or
+        # nested fields), so include it to avoid loading a stale library
+        key += self.ccode
         return md5(key.encode('utf-8')).hexdigest()
 
     def compile(self, compiler):
         """ Writes kernel code to file and compiles it."""
+        tic = timer()
         with open(self.src_file, 'w') as f:
             f.write(self.ccode)
         compiler.compile(self.src_file, self.lib_file, self.log_file)
+        self.timings['compile'] = timer() - tic
         print("Compiled %s ==> %s" % (self.name, self.lib_file))
 
     def load_lib(self):
+        tic = timer()
         self._lib = npct.load_library(self.lib_file, '.')
         self._function = self._lib.particle_loop
+        self._ncalls = c_long.in_dll(self._lib, 'pcls_kernel_calls')
+        self._nsteps = c_long.in_dll(self._lib, 'pcls_kernel_steps')
+        if self.instrument:
+            self._stats = CStats.in_dll(self._lib, 'parcels_stats')
+        self.timings['load'] = timer() - tic
+
+    @property
+    def stats(self):
+        """Dictionary of the hot-path counters accumulated since the
+        library was loaded, or None if the kernel is not instrumented"""
+        if self._stats is None:
+            return None
+        return dict((name, getattr(self._stats, name))
+                    for name, _ in CStats._fields_)
+
+    def bind_field_args(self):
+        """Return the by-reference field arguments of the compiled loop,
+        binding them again only if a field has rebuilt its ctypes struct"""
+        fstructs = [f.ctypes_struct for f in self.field_args.values()]
+        if self._fstructs is None or any(a is not b for a, b in zip(fstructs, self._fstructs)):
+            self._fstructs = fstructs
+            self._fargs = [byref(s) for s in fstructs]
+        return self._fargs
 
-    def execute(self, pset, endtime, dt):
+    def execute(self, pset, endtime, dt, output_times=None, output=None):
+        """Execute the kernel over all particles in `pset` until `endtime`
+
+        For JIT kernels an output schedule may be given, in which case
+        every particle is advanced through `output_times` in turn and a
+        copy of its data is stored in `output`, a preallocated array of
+        the particle dtype with shape (len(output_times), len(pset)),
+        without returning to Python in between. Note that particles are
+        then processed in a different order than with one call per
+        output time, which changes the sequence of random draws and the
+        results of kernels that depend on the order of particles.
+
+        :returns: Tuple with the number of kernel invocations and the
+                  number of successful particle steps taken"""
         if self.ptype.uses_jit:
-            fargs = [byref(f.ctypes_struct) for f in self.field_args.values()]
+            fargs = self.bind_field_args()
             particle_data = pset._particle_data.ctypes.data_as(c_void_p)
+            if output_times is None:
+                num_outputs, times_ptr, output_ptr = 0, None, None
+            else:
+                output_times = np.ascontiguousarray(output_times, dtype=np.float64)
+                assert(output.shape == (output_times.size, len(pset)) and output.flags.c_contiguous)
+                assert(output.dtype == pset._particle_data.dtype)
+                num_outputs = output_times.size
+                times_ptr = output_times.ctypes.data_as(c_void_p)
+                output_ptr = output.ctypes.data_as(c_void_p)
             self._function(c_int(len(pset)), particle_data,
-                           c_double(endtime), c_float(dt), *fargs)
+                           c_double(endtime), c_float(dt), c_int(num_outputs),
+                           times_ptr, output_ptr, *fargs)
+            return self._ncalls.value, self._nsteps.value
         else:
+            ncalls, nsteps = 0, 0
+            # Wrap particle longitudes after each kernel call on periodic grids
+            axes = getattr(pset.grid.U, 'axes', None)
+            wrap = axes is not None and axes.period > 0
             # We now special-case forward and backward modes to
             # predict the final time-step size before an interval.
             if dt > 0:
-                for p in pset.particles:
+                for p in pset:
                     while min(p.dt, endtime - p.time) > 0:
                         dt = min(p.dt, endtime - p.time)
                         res = self.pyfunc(p, pset.grid, p.time, dt)
+                        ncalls += 1
+                        if wrap:
+                            p.lon = axes.wrap_lon(p.lon)
                         if res is None or res == KernelOp.SUCCESS:
                             p.time += dt
+                            nsteps += 1
             else:
-                for p in pset.particles:
+                for p in pset:
                     while max(p.dt, endtime - p.time) < 0:
                         dt = max(p.dt, endtime - p.time)
                         res = self.pyfunc(p, pset.grid, p.time, dt)
+                        ncalls += 1
+                        if wrap:
+                            p.lon = axes.wrap_lon(p.lon)
                         if res is None or res == KernelOp.SUCCESS:
                             p.time += dt
+                            nsteps += 1
+            return ncalls, nsteps
 
     def merge(self, kernel):
         funcname = self.funcname + kernel.funcname
         func_ast = FunctionDef(name=funcname, args=self.py_ast.args,
                                body=self.py_ast.body + kernel.py_ast.body,
                                decorator_list=[], lineno=1, col_offset=0)
+        # Compile the merged kernel in the namespaces of both kernels, so
+        # that it resolves the same names as its parts, wherever the
+        # merge happens (e.g. in a worker process)
+        user_ctx = dict(kernel.pyfunc.__globals__)
+        user_ctx.update(self.pyfunc.__globals__)
         return Kernel(self.grid, self.ptype, pyfunc=None,
                       funcname=funcname, funccode=self.funccode + kernel.funccode,
-                      py_ast=func_ast, funcvars=self.funcvars + kernel.funcvars)
+                      py_ast=func_ast, funcvars=self.funcvars + kernel.funcvars,
+                      instrument=self.instrument or kernel.instrument,
+                      user_ctx=user_ctx)
 
     def __add__(self, kernel):
         if not isinstance(kernel, Kernel):
-            kernel = Kernel(self.grid, self.ptype, pyfunc=kernel)
+            kernel = Kernel(self.grid, self.ptype, pyfunc=kernel,
+                            instrument=self.instrument)
         return self.merge(kernel)
 
     def __radd__(self, kernel):
         if not isinstance(kernel, Kernel):
-            kernel = Kernel(self.grid, self.ptype, pyfunc=kernel)
+            kernel = Kernel(self.grid, self.ptype, pyfunc=kernel,
+                            instrument=self.instrument)
         return kernel.merge(self)
@@ -3,10 +3,21 @@ from parcels.field import Field
 from parcels.compiler import GNUCompiler
 import numpy as np
 import netCDF4
-from collections import OrderedDict, Iterable
+from collections import OrderedDict, Iterable, defaultdict
 from datetime import timedelta as delta
 from datetime import datetime
+from timeit import default_timer as timer
+from threading import Thread
+import os
+import random
+import struct
+import warnings
+import json
 import math
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 try:
     import matplotlib.pyplot as plt
 except:
@@ -91,8 +102,9 @@ def AdvectionRK45(particle, grid, time, dt):
 def positions_from_density_field(pnum, field, mode='monte_carlo'):
     """Initialise particles from a given density field"""
     print("Initialising particles from " + field.name + " field")
-    total = np.sum(field.data[0, :, :])
-    field.data[0, :, :] = field.data[0, :, :] / total
+    # Normalise a decoded copy, leaving (packed) field data unchanged
+    density = np.array(field.decode(field.data[0, :, :]), dtype=np.float64)
+    density /= np.sum(density)
     lonwidth = (field.lon[1] - field.lon[0]) / 2
     latwidth = (field.lat[1] - field.lat[0]) / 2
 
@@ -107,8 +119,8 @@ def positions_from_density_field(pnum, field, mode='monte_carlo'):
         lon = []
         lat = []
         for p in probs:
-            cell = np.unravel_index(np.where([p < i for i in np.cumsum(field.data[0, :, :])])[0][0],
-                                    np.shape(field.data[0, :, :]))
+            cell = np.unravel_index(np.where([p < i for i in np.cumsum(density)])[0][0],
+                                    np.shape(density))
             lon.append(add_jitter(field.lon[cell[1]], lonwidth,
                                   field.lon.min(), field.lon.max()))
             lat.append(add_jitter(field.lat[cell[0]], latwidth,
@@ -119,29 +131,115 @@ def positions_from_density_field(pnum, field, mode='monte_carlo'):
     return lon, lat
 
 
+def index_hints(grid, lon, lat):
+    """Initial grid index hints for positions on the U axes, clamped
+    to the grid; lon and lat may be scalars or arrays"""
+    lon_u = grid.U.lon if grid.U.lon.ndim == 1 else grid.U.lon[0, :]
+    lat_u = grid.U.lat if grid.U.lat.ndim == 1 else grid.U.lat[:, 0]
+    xi = np.clip(np.searchsorted(lon_u, lon, side='right') - 1, 0, lon_u.size - 1)
+    yi = np.clip(np.searchsorted(lat_u, lat, side='right') - 1, 0, lat_u.size - 1)
+    return xi, yi
+
+
+def spread_bits(n):
+    """Spread the lower 32 bits of n to the even bits of a 64-bit integer"""
+    n = np.asarray(n, dtype=np.uint64) & np.uint64(0xffffffff)
+    for shift, mask in [(16, 0x0000ffff0000ffff), (8, 0x00ff00ff00ff00ff),
+                        (4, 0x0f0f0f0f0f0f0f0f), (2, 0x3333333333333333),
+                        (1, 0x5555555555555555)]:
+        n = (n | (n << np.uint64(shift))) & np.uint64(mask)
+    return n
+
+
+def morton_code(xi, yi):
+    """Morton (Z-order) code of the grid cells (xi, yi), which keeps
+    cells that are close in space close in the ordering"""
+    return spread_bits(xi) | (spread_bits(yi) << np.uint64(1))
+
+
 class Particle(object):
     """Class encapsualting the basic attributes of a particle
 
     :param lon: Initial longitude of particle
     :param lat: Initial latitude of particle
     :param grid: :Class Grid: object to track this particle on
+    :param cptr: Optional particle data record to hold the variables;
+                 a record is allocated for stand-alone particles
     :param user_vars: Dictionary of any user variables that might be defined in subclasses
+
+    All particle variables are stored in a record of the particle
+    dtype, so that particles in a :class:`ParticleSet` are merely
+    views onto a row of its particle data. Python particles keep
+    floating point variables in double precision.
+
+    Every particle is given a unique integer `id` on creation, which
+    identifies its trajectory in output files.
+
+    Since particle objects are views, attributes that are not declared
+    particle variables are kept per particle `id` outside the particle
+    data, so that they persist between kernel calls in SciPy mode. They
+    are not written to output files, checkpoints or JIT particles.
+    Subclasses can set :attr:`strict_vars` to True to raise an
+    AttributeError on assigning undeclared attributes instead.
     """
+    base_vars = OrderedDict([('id', np.int32), ('lon', np.float64), ('lat', np.float64),
+                             ('time', np.float64), ('dt', np.float64),
+                             ('xi', np.int32), ('yi', np.int32), ('ti', np.int32),
+                             ('active', np.int32)])
     user_vars = OrderedDict()
+    strict_vars = False
+    lastID = 0
+    # Undeclared attributes of all particles, by particle id
+    _adhoc_vars = defaultdict(dict)
 
     def __init__(self, lon, lat, grid, dt=3600., time=0., cptr=None):
+        if cptr is None:
+            # Allocate data for a single particle
+            cptr = np.zeros(1, dtype=self.getPType().dtype)[0]
+        self._cptr = cptr
+        self.id = Particle.lastID
+        Particle.lastID += 1
         self.lon = lon
         self.lat = lat
         self.time = time
         self.dt = dt
 
-        self.xi = np.where(self.lon >= grid.U.lon)[0][-1]
-        self.yi = np.where(self.lat >= grid.U.lat)[0][-1]
+        # Initial grid index hints, clamped to the U axes
+        self.xi, self.yi = index_hints(grid, lon, lat)
+        self.ti = 0
         self.active = 1
 
         for var in self.user_vars:
             setattr(self, var, 0)
 
+    @classmethod
+    def view(cls, cptr):
+        """Create a particle object for an existing particle data record"""
+        particle = cls.__new__(cls)
+        particle._cptr = cptr
+        return particle
+
+    def __getattr__(self, attr):
+        if attr == "_cptr":
+            raise AttributeError(attr)
+        try:
+            return self._cptr[attr]
+        except (ValueError, KeyError, IndexError):
+            adhoc = Particle._adhoc_vars.get(int(self._cptr['id']), {})
+            if attr in adhoc:
+                return adhoc[attr]
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, attr))
+
+    def __setattr__(self, key, value):
+        if key == "_cptr":
+            super(Particle, self).__setattr__(key, value)
+        elif key in self._cptr.dtype.names:
+            self._cptr[key] = value
+        elif not self.strict_vars:
+            Particle._adhoc_vars[int(self._cptr['id'])][key] = value
+        else:
+            raise AttributeError("Particle variable '%s' has to be declared in user_vars" % key)
+
     def __repr__(self):
         return "P(%f, %f, %f)[%d, %d]" % (self.lon, self.lat, self.time,
                                           self.xi, self.yi)
@@ -164,40 +262,22 @@ class JITParticle(Particle):
     :param user_vars: Class variable that defines additional particle variables
     """
 
-    base_vars = OrderedDict([('lon', np.float32), ('lat', np.float32),
+    base_vars = OrderedDict([('id', np.int32), ('lon', np.float32), ('lat', np.float32),
                              ('time', np.float32), ('dt', np.float32),
-                             ('xi', np.int32), ('yi', np.int32),
+                             ('xi', np.int32), ('yi', np.int32), ('ti', np.int32),
                              ('active', np.int32)])
     user_vars = OrderedDict()
 
-    def __init__(self, *args, **kwargs):
-        self._cptr = kwargs.pop('cptr', None)
-        if self._cptr is None:
-            # Allocate data for a single particle
-            ptype = super(JITParticle, self).getPType()
-            self._cptr = np.empty(1, dtype=ptype.dtype)[0]
-        super(JITParticle, self).__init__(*args, **kwargs)
-
-    def __getattr__(self, attr):
-        if attr == "_cptr":
-            return super(JITParticle, self).__getattr__(attr)
-        else:
-            return self._cptr.__getitem__(attr)
-
-    def __setattr__(self, key, value):
-        if key == "_cptr":
-            super(JITParticle, self).__setattr__(key, value)
-        else:
-            self._cptr.__setitem__(key, value)
-
 
 class ParticleType(object):
     """Class encapsulating the type information for custom particles
 
     :param user_vars: Optional list of (name, dtype) tuples for custom variables
+    :param grid: Optional grid, for which JIT particles carry additional grid
+                 and time index hints for each set of axes not shared with U
     """
 
-    def __init__(self, pclass):
+    def __init__(self, pclass, grid=None):
         if not isinstance(pclass, type):
             raise TypeError("Class object required to derive ParticleType")
         if not issubclass(pclass, Particle):
@@ -205,10 +285,16 @@ class ParticleType(object):
 
         self.name = pclass.__name__
         self.uses_jit = issubclass(pclass, JITParticle)
-        self.var_types = None
+        self.var_types = pclass.base_vars.copy()
         if self.uses_jit:
-            self.var_types = pclass.base_vars.copy()
+            if grid is not None:
+                for axes in grid.axes[1:]:
+                    self.var_types.update([(v, np.int32) for v in grid.index_vars(axes)])
             self.var_types.update(pclass.user_vars)
+        else:
+            # Python particles keep floating point variables in double precision
+            self.var_types.update([(v, np.float64 if np.issubdtype(t, np.floating) else t)
+                                   for v, t in pclass.user_vars.items()])
 
         self.user_vars = pclass.user_vars
 
@@ -221,7 +307,8 @@ class ParticleType(object):
 
     @property
     def dtype(self):
-        """Numpy.dtype object that defines the C struct"""
+        """Numpy.dtype object that defines the particle data record,
+        which is also the C struct for JIT particles"""
         return np.dtype(list(self.var_types.items()))
 
 
@@ -231,6 +318,21 @@ class ParticleSet(object):
     Please note that this currently only supports fixed size particle
     sets.
 
+    With JIT particles, output is recorded by the compiled particle loop
+    into a buffer of at most :attr:`output_buffer_bytes` bytes, which is
+    handed to the output file once per call. Each particle is then
+    advanced through all output times of the buffer before the next
+    one, so kernels whose results depend on the order in which
+    particles are processed may give different results than with one
+    call per output time. Kernels that draw random numbers are run one
+    output time at a time, which keeps their results for a given seed.
+
+    All particle variables are held in a single array of particle
+    records, and particle objects are only created on access as views
+    onto a row of it. Particle variables can be accessed for the whole
+    set as attributes, e.g. ``pset.lon``, which are NumPy views onto
+    the particle data, and assigned in bulk, e.g. ``pset.time = 0.``.
+
     :param size: Initial size of particle set
     :param grid: Grid object from which to sample velocity
     :param pclass: Optional class object that defines custom particle
@@ -244,23 +346,22 @@ class ParticleSet(object):
                  according to the presented density field. Use instead of lat/lon.
     """
 
+    output_buffer_bytes = 64 * 2**20
+    checkpoint_magic = b'PARCELS-CHECKPOINT'
+
     def __init__(self, size, grid, pclass=JITParticle,
                  lon=None, lat=None, start=None, finish=None, start_field=None):
         self.grid = grid
-        self.particles = np.empty(size, dtype=pclass)
-        self.ptype = ParticleType(pclass)
+        self.pclass = pclass
+        self.ptype = ParticleType(pclass, grid=grid)
         self.kernel = None
         self.time_origin = grid.U.time_origin
+        self.profile = None
+        self.restart = None
 
-        if self.ptype.uses_jit:
-            # Allocate underlying data for C-allocated particles
-            self._particle_data = np.empty(size, dtype=self.ptype.dtype)
-
-            def cptr(i):
-                return self._particle_data[i]
-        else:
-            def cptr(i):
-                return None
+        # Allocate underlying particle data; zero initialisation
+        # provides valid grid index hints for all axes
+        self._particle_data = np.zeros(size, dtype=self.ptype.dtype)
 
         if start is not None and finish is not None:
             # Initialise from start/finish coordinates with equidistant spacing
@@ -275,14 +376,55 @@ class ParticleSet(object):
             # Initialise from lists of lon/lat coordinates
             assert(size == len(lon) and size == len(lat))
 
-            for i in range(size):
-                self.particles[i] = pclass(lon[i], lat[i], grid=grid, cptr=cptr(i))
+            if pclass.__init__ == Particle.__init__:
+                # Vectorised equivalent of Particle.__init__
+                data = self._particle_data
+                data['id'] = np.arange(Particle.lastID, Particle.lastID + size)
+                Particle.lastID += size
+                data['lon'], data['lat'] = lon, lat
+                data['dt'] = 3600.
+                data['xi'], data['yi'] = index_hints(grid, lon, lat)
+                data['active'] = 1
+            else:
+                # Custom initialisation writes into the particle data
+                for i in range(size):
+                    pclass(lon[i], lat[i], grid=grid, cptr=self._particle_data[i])
         else:
             raise ValueError("Latitude and longitude required for generating ParticleSet")
 
+    @property
+    def variables(self):
+        """Names of the variables held by each particle of the set"""
+        return list(self.ptype.dtype.names)
+
+    @property
+    def particles(self):
+        """Read-only object array of particle views onto the particle data.
+        Deprecated: iterate over or index the particle set itself, or use
+        the particle variable attributes of the set instead."""
+        warnings.warn("ParticleSet.particles is deprecated; iterate over or index "
+                      "the ParticleSet instead", DeprecationWarning, stacklevel=2)
+        particles = np.empty(self.size, dtype=object)
+        particles[:] = [self.pclass.view(self._particle_data[i]) for i in range(self.size)]
+        particles.flags.writeable = False
+        return particles
+
+    def __getattr__(self, attr):
+        # Only called for attributes that are not found otherwise
+        if attr != 'ptype' and 'ptype' in self.__dict__ and attr in self.variables:
+            return self._particle_data[attr]
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, attr))
+
+    def __setattr__(self, key, value):
+        if 'ptype' in self.__dict__ and key not in self.__dict__ \
+           and not hasattr(type(self), key) and key in self.variables:
+            self._particle_data[key] = value
+        else:
+            super(ParticleSet, self).__setattr__(key, value)
+
     @property
     def size(self):
-        return self.particles.size
+        return self._particle_data.size
 
     def __repr__(self):
         return "\n".join([str(p) for p in self])
@@ -290,11 +432,18 @@ class ParticleSet(object):
     def __len__(self):
         return self.size
 
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.pclass.view(self._particle_data[i])
+
     def __getitem__(self, key):
-        return self.particles[key]
+        if isinstance(key, (int, np.integer)):
+            return self.pclass.view(self._particle_data[key])
+        return [self.pclass.view(self._particle_data[i])
+                for i in np.arange(self.size)[key]]
 
     def __setitem__(self, key, value):
-        self.particles[key] = value
+        self._particle_data[key] = value._cptr
 
     def __iadd__(self, particles):
         self.add(particles)
@@ -302,27 +451,136 @@ class ParticleSet(object):
 
     def add(self, particles):
         if isinstance(particles, ParticleSet):
-            particles = particles.particles
-        if not isinstance(particles, Iterable):
-            particles = [particles]
-        self.particles = np.append(self.particles, particles)
+            particles_data = particles._particle_data
+        else:
+            if not isinstance(particles, Iterable):
+                particles = [particles]
+            particles_data = np.array([p._cptr for p in particles])
+        if len(particles_data) > 0 and particles_data.dtype != self.ptype.dtype:
+            # Convert stand-alone particles to the set's particle type
+            converted = np.zeros(len(particles_data), dtype=self.ptype.dtype)
+            for var in particles_data.dtype.names:
+                converted[var] = particles_data[var]
+            particles_data = converted
+        self._particle_data = np.append(self._particle_data, particles_data)
+
+    def sort(self):
+        """Reorder the particle data by the Morton code of the grid
+        cell of each particle, so that the compiled loop visits
+        particles in neighbouring cells one after another. Particles
+        keep their `id`, which identifies them in output files."""
         if self.ptype.uses_jit:
-            particles_data = [p._cptr for p in particles]
-            self._particle_data = np.append(self._particle_data, particles_data)
+            # Grid index hints are kept up to date by the compiled loop
+            xi, yi = self._particle_data['xi'], self._particle_data['yi']
+        else:
+            xi, yi = index_hints(self.grid, self.lon, self.lat)
+        order = np.argsort(morton_code(xi, yi), kind='mergesort')
+        self._particle_data = self._particle_data[order]
+
+    def checkpoint(self, name, output_file=None, time=None):
+        """Write the state of the particle set to the binary file `name`,
+        from which the run can be resumed with :meth:`from_checkpoint`.
+
+        The file holds a JSON header with the particle record type, the
+        execution time, the particle id counter, the state of the NumPy
+        and Python random number generators and the position of the
+        output file, followed by the raw particle data. It is written
+        to a temporary file first, so that an interrupted checkpoint
+        leaves the previous one intact. The random stream used by JIT
+        kernels is the C library one, whose state cannot be recorded;
+        call :func:`parcels.random.seed` after restoring if needed.
+
+        :param name: Name of the checkpoint file
+        :param output_file: Optional ParticleFile whose position to
+                            record; pending output is flushed to disk
+        :param time: Execution time to resume from; defaults to the
+                     time of the particles
+        """
+        if time is None:
+            if self.size == 0:
+                time = 0.
+            elif np.all(self.dt >= 0):
+                time = self.time.max()
+            else:
+                time = self.time.min()
+        np_state = np.random.get_state()
+        py_state = random.getstate()
+        header = {'version': 1, 'pclass': self.pclass.__name__,
+                  'dtype': self._particle_data.dtype.descr,
+                  'size': self.size, 'time': float(time),
+                  'last_id': Particle.lastID,
+                  'numpy_random': [np_state[0], np_state[1].tolist(), int(np_state[2]),
+                                   int(np_state[3]), float(np_state[4])],
+                  'python_random': [py_state[0], list(py_state[1]), py_state[2]],
+                  'output': None if output_file is None else output_file.position()}
+        header = json.dumps(header).encode('utf-8')
+        tmpname = "%s.tmp" % name
+        with open(tmpname, 'wb') as f:
+            f.write(self.checkpoint_magic)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            self._particle_data.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # Atomically replace a previous checkpoint; os.rename only
+        # overwrites existing files on POSIX systems
+        getattr(os, 'replace', os.rename)(tmpname, name)
+
+    @classmethod
+    def from_checkpoint(cls, name, grid, pclass=JITParticle):
+        """Restore a particle set written by :meth:`checkpoint`
+
+        The particle data is read in bulk, without constructing the
+        particles individually. The execution time and output file
+        position are stored in :attr:`restart`, e.g.::
+
+            pset = ParticleSet.from_checkpoint('run.chk', grid)
+            pfile = pset.ParticleFile(name='run', restart=pset.restart['output'])
+            pset.execute(kernel, starttime=pset.restart['time'], ...)
+
+        Note that loading a checkpoint has global side effects: it sets
+        the global NumPy and Python random number generator states
+        (``np.random.set_state`` and ``random.setstate``) and raises
+        :attr:`Particle.lastID` to the id counter of the checkpoint.
+
+        :param name: Name of the checkpoint file
+        :param grid: Grid object from which to sample velocity
+        :param pclass: Particle class the checkpoint was written with
+        """
+        with open(name, 'rb') as f:
+            if f.read(len(cls.checkpoint_magic)) != cls.checkpoint_magic:
+                raise ValueError("%s is not a particle set checkpoint" % name)
+            length = struct.unpack('<Q', f.read(8))[0]
+            header = json.loads(f.read(length).decode('utf-8'))
+            dtype = np.dtype([tuple(field) for field in header['dtype']])
+            data = np.fromfile(f, dtype=dtype, count=header['size'])
+        if data.size != header['size']:
+            raise ValueError("Checkpoint %s is truncated" % name)
+        pset = cls(0, grid, pclass=pclass, lon=[], lat=[])
+        if pset.ptype.dtype != dtype:
+            raise ValueError("Checkpoint %s was written for particle class %s, "
+                             "which does not match %s" % (name, header['pclass'], pclass.__name__))
+        pset._particle_data = data
+        Particle.lastID = max(Particle.lastID, header['last_id'])
+        np_state = header['numpy_random']
+        np.random.set_state((np_state[0], np.array(np_state[1], dtype=np.uint32)) + tuple(np_state[2:]))
+        py_state = header['python_random']
+        random.setstate((py_state[0], tuple(py_state[1]), py_state[2]))
+        pset.restart = {'time': header['time'], 'output': header['output']}
+        return pset
 
     def remove(self, indices):
+        """Remove particles from the set and return them as stand-alone
+        particles that hold a copy of their data"""
+        removed = self._particle_data[indices].copy()
+        self._particle_data = np.delete(self._particle_data, indices)
         if isinstance(indices, Iterable):
-            particles = [self.particles[i] for i in indices]
-        else:
-            particles = self.particles[indices]
-        if self.ptype.uses_jit:
-            self._particle_data = np.delete(self._particle_data, indices)
-        self.particles = np.delete(self.particles, indices)
-        return particles
+            return [self.pclass.view(r) for r in removed]
+        return self.pclass.view(removed)
 
     def execute(self, pyfunc=AdvectionRK4, starttime=None, endtime=None, dt=1.,
                 runtime=None, interval=None, output_file=None, tol=None,
-                show_movie=False):
+                show_movie=False, profile=False, sort_interval=None):
         """Execute a given kernel function over the particle set for
         multiple timesteps. Optionally also provide sub-timestepping
         for particle output.
@@ -337,7 +595,20 @@ class ParticleSet(object):
                          the update frequency of file output and animation.
         :param output_file: ParticleFile object for particle output
         :param show_movie: True shows particles; name of field plots that field as background
+        :param profile: Record timings and throughput counters for this run
+                        and store them as a dictionary in :attr:`profile`.
+                        The `execute` and `write` timings hold one entry per
+                        leap; when output is recorded inside the JIT loop the
+                        time of each block of leaps (counted in `blocks`) is
+                        split evenly over its leaps. `field_evals_estimate`
+                        assumes every sampling expression in the kernel is
+                        evaluated once per call; instrumented kernels also
+                        report the measured `field_evals`
+        :param sort_interval: Spatially sort the particles (see :meth:`sort`)
+                              before the first and then every `sort_interval` leaps
         """
+        tic_run = timer()
+        timings = {'codegen': 0., 'compile': 0., 'load': 0.}
         if self.kernel is None:
             # Generate and store Kernel
             if isinstance(pyfunc, Kernel):
@@ -348,6 +619,7 @@ class ParticleSet(object):
             if self.ptype.uses_jit:
                 self.kernel.compile(compiler=GNUCompiler())
                 self.kernel.load_lib()
+            timings.update(self.kernel.timings)
 
         # Convert all time variables to seconds
         if isinstance(starttime, delta):
@@ -395,24 +667,95 @@ class ParticleSet(object):
                 print("negating interval because running in time-backward mode")
 
         # Initialise particle timestepping
-        for p in self:
-            p.time = starttime
-            p.dt = dt
+        self.time = starttime
+        self.dt = dt
         # Execute time loop in sub-steps (timeleaps)
         timeleaps = int((endtime - starttime) / interval)
         assert(timeleaps >= 0)
         leaptime = starttime
+        leaptimes = []
         for _ in range(timeleaps):
             leaptime += interval
-            self.kernel.execute(self, endtime=leaptime, dt=dt)
+            leaptimes.append(leaptime)
+        npart = self.size
+        # JIT kernels record output inside the compiled loop, so that a
+        # whole block of output times is covered by a single call. This
+        # advances each particle through the block before the next one,
+        # so stochastic kernels run leap by leap to keep their random draws
+        record = output_file and self.ptype.uses_jit and not show_movie \
+            and not self.kernel.uses_random
+        if record:
+            itemsize = max(npart * self.ptype.dtype.itemsize, 1)
+            block = max(1, min(timeleaps, self.output_buffer_bytes // itemsize))
+            if sort_interval:
+                block = min(block, sort_interval)
+            output = np.empty((block, npart), dtype=self.ptype.dtype)
+        else:
+            block = 1
+        t_execute, t_write = [], []
+        ncalls, nsteps, nblocks = 0, 0, 0
+        timings['sort'], last_sort = 0., None
+        for first in range(0, timeleaps, block):
+            times = leaptimes[first:first + block]
+            if sort_interval and (last_sort is None or first - last_sort >= sort_interval):
+                tic = timer()
+                self.sort()
+                last_sort = first
+                timings['sort'] += timer() - tic
+            tic = timer()
+            if record:
+                leap_calls, leap_steps = self.kernel.execute(self, endtime=times[-1], dt=dt,
+                                                             output_times=times,
+                                                             output=output[:len(times)])
+            else:
+                leap_calls, leap_steps = self.kernel.execute(self, endtime=times[-1], dt=dt)
+            # Spread the time of a recorded block evenly over its leaps
+            t_execute += [(timer() - tic) / len(times)] * len(times)
+            nblocks += 1
+            ncalls += leap_calls
+            nsteps += leap_steps
             if output_file:
-                output_file.write(self, leaptime)
+                tic = timer()
+                if record:
+                    for time, data in zip(times, output):
+                        output_file.write(data, time)
+                else:
+                    output_file.write(self, times[-1])
+                t_write += [(timer() - tic) / len(times)] * len(times)
             if show_movie:
-                self.show(field=show_movie, t=leaptime)
+                self.show(field=show_movie, t=times[-1])
+        if output_file:
+            # Write any buffered output steps to disk
+            tic = timer()
+            output_file.flush()
+            if len(t_write) > 0:
+                t_write[-1] += timer() - tic
         # Remove deactivated particles
-        to_remove = [i for i, p in enumerate(self.particles) if p.active == 0]
+        tic = timer()
+        to_remove = np.where(self.active == 0)[0]
         if len(to_remove) > 0:
             self.remove(to_remove)
+        timings['remove'] = timer() - tic
+
+        if profile:
+            timings['execute'] = t_execute
+            timings['write'] = t_write
+            timings['total'] = timer() - tic_run
+            t_kernel = sum(t_execute)
+            self.profile = {'kernel': self.kernel.name,
+                            'mode': 'jit' if self.ptype.uses_jit else 'scipy',
+                            'particles': npart,
+                            'leaps': timeleaps,
+                            'blocks': nblocks,
+                            'timings': timings,
+                            'kernel_calls': ncalls,
+                            'particle_steps': nsteps,
+                            'field_evals_estimate': ncalls * self.kernel.field_samples,
+                            'steps_per_second': nsteps / t_kernel if t_kernel > 0 else 0.}
+            if self.kernel.stats is not None:
+                # Instrumented kernels count the actual interpolations
+                self.profile['stats'] = self.kernel.stats
+                self.profile['field_evals'] = self.kernel.stats['bilinear_evals']
 
     def show(self, **kwargs):
         if plt is None:
@@ -420,8 +763,8 @@ class ParticleSet(object):
 
         field = kwargs.get('field', True)
         t = kwargs.get('t', 0)
-        lon = [p.lon for p in self]
-        lat = [p.lat for p in self]
+        lon = self.lon
+        lat = self.lat
         plt.ion()
         plt.clf()
         plt.plot(np.transpose(lon), np.transpose(lat), 'ko')
@@ -447,8 +790,21 @@ class ParticleSet(object):
         plt.show()
         plt.pause(0.0001)
 
-    def Kernel(self, pyfunc):
-        return Kernel(self.grid, self.ptype, pyfunc=pyfunc)
+    def memory_usage(self):
+        """Returns a dictionary with the number of bytes held by the
+        particle data buffer ('particle_data'), the array of particle
+        objects ('particles'), the Python particle objects themselves
+        ('objects') and the total. Particle objects are only created on
+        access as views onto the particle data, so that the latter two
+        are always 0."""
+        usage = {'particle_data': self._particle_data.nbytes,
+                 'particles': 0, 'objects': 0}
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def Kernel(self, pyfunc, instrument=False):
+        return Kernel(self.grid, self.ptype, pyfunc=pyfunc,
+                      instrument=instrument)
 
     def ParticleFile(self, *args, **kwargs):
         return ParticleFile(*args, particleset=self, **kwargs)
@@ -456,7 +812,9 @@ class ParticleSet(object):
 
 class ParticleFile(object):
 
-    def __init__(self, name, particleset, initial_dump=True):
+    def __init__(self, name, particleset, initial_dump=True, buffer_size=16,
+                 chunksizes=None, zlib=False, complevel=4, asynchronous=False,
+                 queue_size=4, ragged=False, restart=None):
         """Initialise netCDF4.Dataset for trajectory output.
 
         The output follows the format outlined in the Discrete
@@ -470,26 +828,100 @@ class ParticleFile(object):
         not yet allow incremental writes to disk:
         https://github.com/xray/xray/issues/199
 
+        Output steps are gathered column-wise in memory and written to
+        disk as a single block once `buffer_size` steps are pending, or
+        when :meth:`flush` or :meth:`close` is called. In asynchronous
+        mode these blocks are handed to a background thread that writes
+        them to disk, while the queue of pending blocks is bounded by
+        `queue_size` to limit memory use.
+
+        By default the output is stored as dense (trajectory, obs) arrays
+        for a fixed number of particles. With `ragged=True` the indexed
+        ragged array representation is used instead: only active
+        particles are written at each output time, each observation
+        carries the index of its trajectory in `trajectory_index`, and
+        trajectories are appended as new particle ids appear, so that
+        the file size follows the number of active particles.
+
+        With `restart`, an existing output file is reopened and written
+        from the position recorded by :meth:`ParticleSet.checkpoint`,
+        so that output steps written after the checkpoint are replaced.
+
         :param name: Basename of the output file
         :param particlset: ParticleSet to output
         :param initial_dump: Perform initial output at time 0.
-        :param user_vars: A list of additional user defined particle variables to write
+        :param buffer_size: Number of output steps to hold in memory before writing
+        :param chunksizes: Optional (trajectory, obs) chunk shape of the netCDF
+                           variables, or (obs,) for ragged output; defaults to
+                           all particles by `buffer_size` steps
+        :param zlib: Compress the netCDF variables with zlib
+        :param complevel: Compression level (1-9) used if `zlib` is True
+        :param asynchronous: Write output blocks from a background thread
+        :param queue_size: Maximum number of output blocks waiting for the
+                           writer thread before :meth:`write` blocks
+        :param ragged: Use the indexed ragged array representation
+        :param restart: Output position stored in a checkpoint, see
+                        :meth:`ParticleSet.from_checkpoint`; the file
+                        layout is then taken from the existing file
         """
+        self.buffer_size = max(int(buffer_size), 1)
+        if restart is None:
+            self._create(name, particleset, chunksizes, zlib, complevel, ragged)
+            self.idx = 0
+        else:
+            self._reopen(name, restart)
+            self.idx = restart['idx']
+        self.buffer = []
+        self.error = None
+        self.queue = None
+        if asynchronous:
+            self.queue = Queue(maxsize=max(int(queue_size), 1))
+            self.writer = Thread(target=self._drain, name="ParticleFile-writer")
+            self.writer.daemon = True
+            self.writer.start()
+
+        if initial_dump and restart is None:
+            self.write(particleset, 0.)
+
+    def _create(self, name, particleset, chunksizes, zlib, complevel, ragged):
+        """Create a new output file and its variables"""
         self.dataset = netCDF4.Dataset("%s.nc" % name, "w", format="NETCDF4")
+        self.ragged = ragged
         self.dataset.createDimension("obs", None)
-        self.dataset.createDimension("trajectory", particleset.size)
+        self.dataset.createDimension("trajectory", None if ragged else particleset.size)
         self.dataset.feature_type = "trajectory"
         self.dataset.Conventions = "CF-1.6"
         self.dataset.ncei_template_version = "NCEI_NetCDF_Trajectory_Template_v2.0"
 
+        if ragged:
+            dims = ("obs",)
+            if chunksizes is None:
+                chunksizes = (max(particleset.size, 1) * self.buffer_size,)
+        else:
+            dims = ("trajectory", "obs")
+            if chunksizes is None:
+                chunksizes = (max(particleset.size, 1), self.buffer_size)
+        storage = {'chunksizes': chunksizes, 'zlib': zlib, 'complevel': complevel}
+
         # Create ID variable according to CF conventions
         self.trajectory = self.dataset.createVariable("trajectory", "i4", ("trajectory",))
         self.trajectory.long_name = "Unique identifier for each particle"
         self.trajectory.cf_role = "trajectory_id"
-        self.trajectory[:] = np.arange(particleset.size, dtype=np.int32)
+        if ragged:
+            self.trajectory_index = self.dataset.createVariable("trajectory_index", "i4", dims, **storage)
+            self.trajectory_index.long_name = "Index of the trajectory this observation belongs to"
+            self.trajectory_index.instance_dimension = "trajectory"
+            self.ntraj, self.nobs = 0, 0
+            self.known_ids = np.empty(0, dtype=np.int32)
+            self.known_index = np.empty(0, dtype=np.int32)
+        else:
+            self.traj_ids = self.column(particleset, 'id')
+            self.traj_order = np.argsort(self.traj_ids)
+            self.trajectory[:] = self.traj_ids
 
         # Create time, lat, lon and z variables according to CF conventions:
-        self.time = self.dataset.createVariable("time", "f8", ("trajectory", "obs"), fill_value=np.nan)
+        self.time = self.dataset.createVariable("time", "f8", dims,
+                                                fill_value=np.nan, **storage)
         self.time.long_name = ""
         self.time.standard_name = "time"
         if particleset.time_origin == 0:
@@ -499,53 +931,217 @@ class ParticleFile(object):
             self.time.calendar = "julian"
         self.time.axis = "T"
 
-        self.lat = self.dataset.createVariable("lat", "f4", ("trajectory", "obs"), fill_value=np.nan)
+        self.lat = self.dataset.createVariable("lat", "f4", dims,
+                                               fill_value=np.nan, **storage)
         self.lat.long_name = ""
         self.lat.standard_name = "latitude"
         self.lat.units = "degrees_north"
         self.lat.axis = "Y"
 
-        self.lon = self.dataset.createVariable("lon", "f4", ("trajectory", "obs"), fill_value=np.nan)
+        self.lon = self.dataset.createVariable("lon", "f4", dims,
+                                               fill_value=np.nan, **storage)
         self.lon.long_name = ""
         self.lon.standard_name = "longitude"
         self.lon.units = "degrees_east"
         self.lon.axis = "X"
 
-        self.z = self.dataset.createVariable("z", "f4", ("trajectory", "obs"), fill_value=np.nan)
+        self.z = self.dataset.createVariable("z", "f4", dims,
+                                             fill_value=np.nan, **storage)
         self.z.long_name = ""
         self.z.standard_name = "depth"
         self.z.units = "m"
         self.z.positive = "down"
 
         if particleset.ptype.user_vars is not None:
-            self.user_vars = particleset.ptype.user_vars.keys()
+            self.user_vars = list(particleset.ptype.user_vars.keys())
             for var in self.user_vars:
-                setattr(self, var, self.dataset.createVariable(var, "f4", ("trajectory", "obs"), fill_value=0.))
+                setattr(self, var, self.dataset.createVariable(var, "f4", dims,
+                                                               fill_value=0., **storage))
                 getattr(self, var).long_name = ""
                 getattr(self, var).standard_name = var
                 getattr(self, var).units = "unknown"
         else:
-            self.user_vars = {}
-
-        self.idx = 0
-
-        if initial_dump:
-            self.write(particleset, 0.)
+            self.user_vars = []
+
+    def _reopen(self, name, restart):
+        """Reopen an existing output file at a checkpointed position"""
+        self.dataset = netCDF4.Dataset("%s.nc" % name, "a")
+        variables = self.dataset.variables
+        self.ragged = 'trajectory_index' in variables
+        for var in ['trajectory', 'time', 'lat', 'lon', 'z']:
+            setattr(self, var, variables[var])
+        if self.ragged:
+            self.trajectory_index = variables['trajectory_index']
+            self.ntraj, self.nobs = restart['ntraj'], restart['nobs']
+            traj_ids = np.array(self.trajectory[:self.ntraj], dtype=np.int32)
+            order = np.argsort(traj_ids, kind='mergesort')
+            self.known_ids = traj_ids[order]
+            self.known_index = np.arange(self.ntraj, dtype=np.int32)[order]
+        else:
+            self.traj_ids = np.array(self.trajectory[:], dtype=np.int32)
+            self.traj_order = np.argsort(self.traj_ids)
+        base_vars = ['trajectory', 'trajectory_index', 'time', 'lat', 'lon', 'z']
+        self.user_vars = [var for var in variables if var not in base_vars]
+        for var in self.user_vars:
+            setattr(self, var, variables[var])
 
     def __del__(self):
-        self.dataset.close()
+        self.close()
+
+    @staticmethod
+    def column(pset, var):
+        """Return the values of a particle variable across the set,
+        read directly from the particle data buffer for JIT particles.
+        `pset` may also be an array of particle data recorded by a
+        compiled particle loop."""
+        if isinstance(pset, np.ndarray):
+            return pset[var].copy()
+        return np.array(getattr(pset, var))
 
     def write(self, data, time):
-        if isinstance(data, ParticleSet):
-            # Write multiple particles at once
+        if isinstance(data, (ParticleSet, np.ndarray)):
+            # Buffer one output step for all particles at once
             pset = data
-            self.time[:, self.idx] = time
-            self.lat[:, self.idx] = np.array([p.lat for p in pset])
-            self.lon[:, self.idx] = np.array([p.lon for p in pset])
-            self.z[:, self.idx] = np.zeros(pset.size, dtype=np.float32)
-            for var in self.user_vars:
-                getattr(self, var)[:, self.idx] = np.array([getattr(p, var) for p in pset])
+            variables = ['lat', 'lon'] + self.user_vars
+            if self.ragged:
+                active = self.column(pset, 'active') != 0
+                step = dict((var, self.column(pset, var)[active])
+                            for var in ['id'] + variables)
+            else:
+                ids = self.column(pset, 'id')
+                if np.array_equal(ids, self.traj_ids):
+                    step = dict((var, self.column(pset, var)) for var in variables)
+                else:
+                    step = self.by_trajectory(pset, ids, variables)
+            step['time'] = time
+            step['size'] = step['lat'].size
+            self.buffer.append(step)
         else:
             raise TypeError("NetCDF output is only enabled for ParticleSet obects")
 
         self.idx += 1
+        if len(self.buffer) >= self.buffer_size:
+            self._submit()
+
+    def by_trajectory(self, pset, ids, variables):
+        """Map the columns of a reordered or reduced particle set back
+        onto the rows of the trajectories they belong to by id"""
+        ntraj = self.traj_ids.size
+        pos = np.minimum(np.searchsorted(self.traj_ids, ids, sorter=self.traj_order), max(ntraj - 1, 0))
+        rows = self.traj_order[pos] if ntraj > 0 else pos
+        known = self.traj_ids[rows] == ids if ntraj > 0 else np.zeros(ids.size, dtype=bool)
+        step = {}
+        for var in variables:
+            column = np.full(ntraj, 0. if var in self.user_vars else np.nan)
+            column[rows[known]] = self.column(pset, var)[known]
+            step[var] = column
+        return step
+
+    def _submit(self):
+        """Pass the buffered output steps on to be written, either
+        directly or via the queue of the background writer thread"""
+        if len(self.buffer) == 0:
+            return
+        block = (self.idx - len(self.buffer), self.buffer)
+        self.buffer = []
+        if self.queue is None:
+            self._write_block(*block)
+        else:
+            self._check_error()
+            self.queue.put(block)
+
+    def _drain(self):
+        """Writer thread loop; a block of None signals shutdown"""
+        while True:
+            block = self.queue.get()
+            try:
+                if block is None:
+                    return
+                if self.error is None:
+                    self._write_block(*block)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("ParticleFile writer thread failed: %s" % error)
+
+    def _write_block(self, first, steps):
+        """Write a block of output steps to disk as one slab per variable"""
+        if self.ragged:
+            self._write_ragged(steps)
+            return
+        nsteps = len(steps)
+        size = min(step['size'] for step in steps)
+        obs = slice(first, first + nsteps)
+        for var in ['lat', 'lon'] + self.user_vars:
+            block = np.stack([step[var][:size] for step in steps], axis=1)
+            getattr(self, var)[:size, obs] = block
+        times = np.array([step['time'] for step in steps], dtype=np.float64)
+        self.time[:size, obs] = np.broadcast_to(times, (size, nsteps))
+        self.z[:size, obs] = np.zeros((size, nsteps), dtype=np.float32)
+        self.dataset.sync()
+
+    def _write_ragged(self, steps):
+        """Append a block of output steps as observations of the indexed
+        ragged representation, registering trajectories for new ids"""
+        ids = np.concatenate([step['id'] for step in steps])
+        nobs = ids.size
+        if nobs == 0:
+            return
+        # Register unseen ids as new trajectories in order of appearance
+        unique, first = np.unique(ids, return_index=True)
+        if self.known_ids.size > 0:
+            pos = np.minimum(np.searchsorted(self.known_ids, unique), self.known_ids.size - 1)
+            new = self.known_ids[pos] != unique
+        else:
+            new = np.ones(unique.size, dtype=bool)
+        if new.any():
+            new_ids = unique[new][np.argsort(first[new])]
+            new_index = np.arange(self.ntraj, self.ntraj + new_ids.size, dtype=np.int32)
+            self.trajectory[self.ntraj:self.ntraj + new_ids.size] = new_ids
+            self.ntraj += new_ids.size
+            ids_all = np.append(self.known_ids, new_ids)
+            order = np.argsort(ids_all, kind='mergesort')
+            self.known_ids = ids_all[order]
+            self.known_index = np.append(self.known_index, new_index)[order]
+        obs = slice(self.nobs, self.nobs + nobs)
+        self.trajectory_index[obs] = self.known_index[np.searchsorted(self.known_ids, ids)]
+        for var in ['lat', 'lon'] + self.user_vars:
+            getattr(self, var)[obs] = np.concatenate([step[var] for step in steps])
+        self.time[obs] = np.concatenate([np.full(step['size'], step['time'], dtype=np.float64)
+                                         for step in steps])
+        self.z[obs] = np.zeros(nobs, dtype=np.float32)
+        self.nobs += nobs
+        self.dataset.sync()
+
+    def flush(self):
+        """Write all buffered output steps to disk, waiting for the
+        writer thread to empty its queue in asynchronous mode"""
+        self._submit()
+        if self.queue is not None:
+            self.queue.join()
+            self._check_error()
+
+    def position(self):
+        """Flush pending output and return the position up to which
+        the file is complete, as used to restart it from a checkpoint"""
+        self.flush()
+        position = {'idx': self.idx}
+        if self.ragged:
+            position.update(ntraj=self.ntraj, nobs=self.nobs)
+        return position
+
+    def close(self):
+        """Flush pending output and close the underlying dataset"""
+        if self.dataset.isopen():
+            try:
+                self.flush()
+            finally:
+                if self.queue is not None and self.writer.is_alive():
+                    self.queue.put(None)
+                    self.writer.join()
+                self.dataset.close()
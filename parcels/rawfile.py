@@ -0,0 +1,183 @@
+from parcels.particle import ParticleSet, ParticleFile
+from argparse import ArgumentParser
+from os import path, makedirs
+import numpy as np
+import netCDF4
+import json
+
+
+__all__ = ['RawParticleFile', 'read_raw', 'convert_raw']
+
+
+class RawParticleFile(object):
+    """Streaming trajectory output in a raw binary format
+
+    Every output variable is appended as a raw column block to its
+    own binary file ``<name>/<var>.bin``, while the time and number
+    of particles of each output step are recorded in ``steps.bin``.
+    A small JSON header (``header.json``) describes the data types,
+    so that the files can be memory-mapped with :func:`read_raw` or
+    converted into the CF-compliant netCDF format written by
+    :class:`ParticleFile` with :func:`convert_raw`.
+
+    Only active particles are written, along with their `id`.
+
+    :param name: Name of the output directory
+    :param particleset: ParticleSet to output
+    :param initial_dump: Perform initial output at time 0.
+    """
+
+    step_dtype = np.dtype([('time', np.float64), ('count', np.int64)])
+
+    def __init__(self, name, particleset, initial_dump=True):
+        self.name = name
+        if not path.exists(name):
+            makedirs(name)
+        self.user_vars = list(particleset.ptype.user_vars.keys())
+        variables = ['id', 'lat', 'lon'] + self.user_vars
+        dtypes = dict((var, particleset._particle_data.dtype[var]) for var in variables)
+        self.dtypes = dtypes
+        self.variables = variables
+
+        header = {'format': 'parcels-raw', 'version': 1,
+                  'time_origin': 0 if particleset.time_origin == 0 else str(particleset.time_origin),
+                  'variables': [[var, dtypes[var].str] for var in variables],
+                  'user_vars': self.user_vars}
+        with open(path.join(name, 'header.json'), 'w') as f:
+            json.dump(header, f, indent=2)
+
+        self.files = dict((var, open(path.join(name, '%s.bin' % var), 'wb'))
+                          for var in variables)
+        self.steps = open(path.join(name, 'steps.bin'), 'wb')
+
+        if initial_dump:
+            self.write(particleset, 0.)
+
+    def __del__(self):
+        self.close()
+
+    def write(self, data, time):
+        if not isinstance(data, (ParticleSet, np.ndarray)):
+            raise TypeError("Raw output is only enabled for ParticleSet obects")
+        active = ParticleFile.column(data, 'active') != 0
+        for var in self.variables:
+            column = ParticleFile.column(data, var)[active]
+            np.ascontiguousarray(column, dtype=self.dtypes[var]).tofile(self.files[var])
+        np.array([(time, np.count_nonzero(active))], dtype=self.step_dtype).tofile(self.steps)
+
+    def flush(self):
+        for f in list(self.files.values()) + [self.steps]:
+            f.flush()
+
+    def close(self):
+        if not self.steps.closed:
+            for f in list(self.files.values()) + [self.steps]:
+                f.close()
+
+
+def read_raw(name):
+    """Memory-map the output of a :class:`RawParticleFile`
+
+    Returns a dictionary holding the JSON `header`, the `time` and
+    particle `count` of each output step, the `offset` of each step
+    into the variable columns and one read-only memory-mapped array
+    per output variable. Observations of step `i` are found in
+    ``[offset[i]:offset[i] + count[i]]``.
+
+    :param name: Name of the output directory
+    """
+    with open(path.join(name, 'header.json'), 'r') as f:
+        header = json.load(f)
+    steps = np.fromfile(path.join(name, 'steps.bin'), dtype=RawParticleFile.step_dtype)
+    nobs = int(steps['count'].sum())
+    raw = {'header': header, 'time': steps['time'], 'count': steps['count'],
+           'offset': np.concatenate(([0], np.cumsum(steps['count'])[:-1])).astype(np.int64)}
+    for var, dtype in header['variables']:
+        if nobs == 0:
+            raw[var] = np.empty(0, dtype=dtype)
+        else:
+            raw[var] = np.memmap(path.join(name, '%s.bin' % var), dtype=dtype,
+                                 mode='r', shape=(nobs,))
+    return raw
+
+
+def convert_raw(name, output=None, ragged=False):
+    """Convert the output of a :class:`RawParticleFile` into the
+    CF-compliant netCDF trajectory format written by :class:`ParticleFile`
+
+    :param name: Name of the raw output directory
+    :param output: Basename of the netCDF file; defaults to `name`
+    :param ragged: Write the indexed ragged array representation
+                   instead of dense (trajectory, obs) arrays
+    """
+    raw = read_raw(name)
+    header = raw['header']
+    output = name.rstrip('/\\') if output is None else output
+    ids = np.asarray(raw['id'])
+    nsteps = raw['time'].size
+    # Trajectories are numbered by first appearance of each id
+    unique, first = np.unique(ids, return_index=True)
+    traj_ids = unique[np.argsort(first)]
+    order = np.argsort(traj_ids)
+    traj_index = order[np.searchsorted(traj_ids[order], ids)].astype(np.int32)
+    obs_time = np.repeat(raw['time'], raw['count'])
+
+    dataset = netCDF4.Dataset("%s.nc" % output, "w", format="NETCDF4")
+    dataset.createDimension("obs", None if ragged else nsteps)
+    dataset.createDimension("trajectory", traj_ids.size)
+    dataset.feature_type = "trajectory"
+    dataset.Conventions = "CF-1.6"
+    dataset.ncei_template_version = "NCEI_NetCDF_Trajectory_Template_v2.0"
+
+    trajectory = dataset.createVariable("trajectory", "i4", ("trajectory",))
+    trajectory.long_name = "Unique identifier for each particle"
+    trajectory.cf_role = "trajectory_id"
+    trajectory[:] = traj_ids
+
+    dims = ("obs",) if ragged else ("trajectory", "obs")
+    if ragged:
+        index = dataset.createVariable("trajectory_index", "i4", dims)
+        index.long_name = "Index of the trajectory this observation belongs to"
+        index.instance_dimension = "trajectory"
+        index[:] = traj_index
+    step = np.repeat(np.arange(nsteps), raw['count'])
+
+    def store(var, dtype, values, fill_value, **attrs):
+        variable = dataset.createVariable(var, dtype, dims, fill_value=fill_value)
+        for key, value in attrs.items():
+            setattr(variable, key, value)
+        if ragged:
+            variable[:] = values
+        else:
+            dense = np.full((traj_ids.size, nsteps), fill_value, dtype=dtype)
+            dense[traj_index, step] = values
+            variable[:] = dense
+
+    time_attrs = {'long_name': "", 'standard_name': "time", 'axis': "T"}
+    if header['time_origin'] == 0:
+        time_attrs['units'] = "seconds"
+    else:
+        time_attrs['units'] = "seconds since " + header['time_origin']
+        time_attrs['calendar'] = "julian"
+    store("time", "f8", obs_time, np.nan, **time_attrs)
+    store("lat", "f4", raw['lat'], np.nan, long_name="", standard_name="latitude",
+          units="degrees_north", axis="Y")
+    store("lon", "f4", raw['lon'], np.nan, long_name="", standard_name="longitude",
+          units="degrees_east", axis="X")
+    store("z", "f4", np.zeros(ids.size, dtype=np.float32), np.nan, long_name="",
+          standard_name="depth", units="m", positive="down")
+    for var in header['user_vars']:
+        store(var, "f4", raw[var], 0., long_name="", standard_name=var, units="unknown")
+    dataset.close()
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description="""
+Convert raw binary Parcels trajectory output into netCDF""")
+    p.add_argument('name', help='Raw output directory')
+    p.add_argument('-o', '--output', default=None,
+                   help='Basename of the netCDF file to write')
+    p.add_argument('--ragged', action='store_true', default=False,
+                   help='Write the indexed ragged array representation')
+    args = p.parse_args()
+    convert_raw(args.name, output=args.output, ragged=args.ragged)
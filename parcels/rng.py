@@ -1,5 +1,6 @@
 from parcels.compiler import get_cache_dir, GNUCompiler
 from os import path
+import numpy as np
 import numpy.ctypeslib as npct
 from ctypes import c_int, c_float
 
@@ -18,19 +19,44 @@ extern void pcls_seed(int seed){
 extern float pcls_random(){
   return parcels_random();
 }
+
+extern void pcls_random_array(float *out, int size){
+  int i;
+  for (i = 0; i < size; ++i) out[i] = parcels_random();
+}
 """
     fnct_uniform = """
 extern float pcls_uniform(float low, float high){
   return parcels_uniform(low, high);
 }
+
+extern void pcls_uniform_array(float *out, int size, float low, float high){
+  int i;
+  for (i = 0; i < size; ++i) out[i] = parcels_uniform(low, high);
+}
 """
     fnct_randint = """
 extern int pcls_randint(int low, int high){
   return parcels_randint(low, high);
 }
+
+extern void pcls_randint_array(int *out, int size, int low, int high){
+  int i;
+  for (i = 0; i < size; ++i) out[i] = parcels_randint(low, high);
+}
+"""
+    fnct_normalvariate = """
+extern float pcls_normalvariate(float loc, float scale){
+  return parcels_normalvariate(loc, scale);
+}
+
+extern void pcls_normalvariate_array(float *out, int size, float loc, float scale){
+  int i;
+  for (i = 0; i < size; ++i) out[i] = parcels_normalvariate(loc, scale);
+}
 """
     ccode = stmt_import + fnct_seed
-    ccode += fnct_random + fnct_uniform + fnct_randint
+    ccode += fnct_random + fnct_uniform + fnct_randint + fnct_normalvariate
     src_file = path.join(get_cache_dir(), "random.c")
     lib_file = path.join(get_cache_dir(), "random.so")
     log_file = path.join(get_cache_dir(), "random.log")
@@ -46,36 +72,87 @@ extern int pcls_randint(int low, int high){
             compiler.compile(self.src_file, self.lib_file, self.log_file)
             print("Compiled %s ==> %s" % ("random", self.lib_file))
             self._lib = npct.load_library(self.lib_file, '.')
+            self._set_prototypes(self._lib)
         return self._lib
 
+    @staticmethod
+    def _set_prototypes(lib):
+        """Declare argument and return types once after loading,
+        rather than on every call into the library."""
+        float_array = npct.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS')
+        int_array = npct.ndpointer(dtype=np.int32, flags='C_CONTIGUOUS')
+        lib.pcls_seed.argtypes = [c_int]
+        lib.pcls_seed.restype = None
+        lib.pcls_random.argtypes = []
+        lib.pcls_random.restype = c_float
+        lib.pcls_random_array.argtypes = [float_array, c_int]
+        lib.pcls_random_array.restype = None
+        lib.pcls_uniform.argtypes = [c_float, c_float]
+        lib.pcls_uniform.restype = c_float
+        lib.pcls_uniform_array.argtypes = [float_array, c_int, c_float, c_float]
+        lib.pcls_uniform_array.restype = None
+        lib.pcls_randint.argtypes = [c_int, c_int]
+        lib.pcls_randint.restype = c_int
+        lib.pcls_randint_array.argtypes = [int_array, c_int, c_int, c_int]
+        lib.pcls_randint_array.restype = None
+        lib.pcls_normalvariate.argtypes = [c_float, c_float]
+        lib.pcls_normalvariate.restype = c_float
+        lib.pcls_normalvariate_array.argtypes = [float_array, c_int, c_float, c_float]
+        lib.pcls_normalvariate_array.restype = None
+
 
 parcels_random = Random()
 
 
 def seed(seed):
     """Sets the seed for parcels internal RNG"""
-    parcels_random.lib.pcls_seed(c_int(seed))
+    parcels_random.lib.pcls_seed(seed)
+
+
+def random(size=None):
+    """Returns a random float between 0. and 1.
+
+    :param size: Optional shape of an array of random values to
+                 draw in a single call to the compiled library"""
+    if size is None:
+        return parcels_random.lib.pcls_random()
+    out = np.empty(size, dtype=np.float32)
+    parcels_random.lib.pcls_random_array(out, out.size)
+    return out
+
+
+def uniform(low, high, size=None):
+    """Returns a random float between `low` and `high`
+
+    :param size: Optional shape of an array of random values to
+                 draw in a single call to the compiled library"""
+    if size is None:
+        return parcels_random.lib.pcls_uniform(low, high)
+    out = np.empty(size, dtype=np.float32)
+    parcels_random.lib.pcls_uniform_array(out, out.size, low, high)
+    return out
 
 
-def random():
-    """Returns a random float between 0. and 1."""
-    rnd = parcels_random.lib.pcls_random
-    rnd.argtype = []
-    rnd.restype = c_float
-    return rnd()
+def randint(low, high, size=None):
+    """Returns a random int between `low` and `high`
 
+    :param size: Optional shape of an array of random values to
+                 draw in a single call to the compiled library"""
+    if size is None:
+        return parcels_random.lib.pcls_randint(low, high)
+    out = np.empty(size, dtype=np.int32)
+    parcels_random.lib.pcls_randint_array(out, out.size, low, high)
+    return out
 
-def uniform(low, high):
-    """Returns a random float between `low` and `high`"""
-    rnd = parcels_random.lib.pcls_uniform
-    rnd.argtype = [c_float, c_float]
-    rnd.restype = c_float
-    return rnd(c_float(low), c_float(high))
 
+def normalvariate(loc, scale, size=None):
+    """Returns a random float on a normal distribution with mean
+    `loc` and standard deviation `scale`
 
-def randint(low, high):
-    """Returns a random int between `low` and `high`"""
-    rnd = parcels_random.lib.pcls_randint
-    rnd.argtype = [c_int, c_int]
-    rnd.restype = c_int
-    return rnd(c_int(low), c_int(high))
+    :param size: Optional shape of an array of random values to
+                 draw in a single call to the compiled library"""
+    if size is None:
+        return parcels_random.lib.pcls_normalvariate(loc, scale)
+    out = np.empty(size, dtype=np.float32)
+    parcels_random.lib.pcls_normalvariate_array(out, out.size, loc, scale)
+    return out
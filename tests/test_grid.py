@@ -1,4 +1,5 @@
-from parcels import Grid
+from parcels import Grid, Field
+from parcels.field import sanitise, memory_order
 import numpy as np
 import pytest
 
@@ -43,3 +44,110 @@ def test_grid_from_nemo(xdim, ydim, tmpdir, filename='test_nemo'):
     assert len(grid.V.data.shape) == 3
     assert np.allclose(grid.U.data[0, :], u_t, rtol=1e-12)
     assert np.allclose(grid.V.data[0, :], v_t, rtol=1e-12)
+
+
+def test_grid_memory_usage(xdim=100, ydim=200):
+    """ Test memory accounting of grid fields and their caches """
+    u, v, lon, lat, depth, time = generate_grid(xdim, ydim)
+    grid = Grid.from_data(u, lon, lat, v, lon, lat, depth, time)
+    usage = grid.memory_usage()
+    assert usage['U']['data'] == xdim * ydim * 4
+    assert usage['U']['lon'] == xdim * 4 and usage['U']['lat'] == ydim * 4
+    assert usage['U']['interpolator_cache'] == 0
+    # U and V share the same coordinate arrays, which are counted once
+    assert usage['total'] == usage['U']['total'] + usage['V']['data']
+    grid.U.eval(0., 0.5, 0.5)
+    assert grid.memory_usage()['U']['total'] >= usage['U']['total']
+
+
+def test_grid_estimate_memory(tmpdir, xdim=100, ydim=200, filename='test_estimate'):
+    """ Test pre-flight memory estimate against the loaded field """
+    filepath = tmpdir.join(filename)
+    u, v, lon, lat, depth, time = generate_grid(xdim, ydim)
+    Grid.from_data(u, lon, lat, v, lon, lat, depth, time).write(filepath)
+    dimensions = {'lon': 'nav_lon', 'lat': 'nav_lat', 'time': 'time_counter',
+                  'data': 'vozocrtx'}
+    estimate = Field.estimate_memory(dimensions, "%sU.nc" % filepath)
+    grid = Grid.from_nemo(filepath)
+    assert estimate['data'] == grid.U.data.nbytes
+    assert estimate['peak'] >= estimate['data'] + estimate['coordinates']
+
+
+@pytest.mark.parametrize('curvilinear', [False, True])
+def test_field_estimate_memory_2d_coords(tmpdir, curvilinear, xdim=40, ydim=30):
+    """ Test the memory estimate for 2D float64 coordinate files """
+    from netCDF4 import Dataset
+    lon, lat = np.meshgrid(np.linspace(0., 4., xdim), np.linspace(0., 3., ydim))
+    if curvilinear:
+        lon, lat = lon - 0.2 * lat, lat + 0.2 * lon
+    filename = str(tmpdir.join('coords2d.nc'))
+    dataset = Dataset(filename, 'w')
+    dataset.createDimension('y', ydim)
+    dataset.createDimension('x', xdim)
+    dataset.createDimension('time_counter', 1)
+    dataset.createVariable('nav_lon', 'f8', ('y', 'x'))[:] = lon
+    dataset.createVariable('nav_lat', 'f8', ('y', 'x'))[:] = lat
+    dataset.createVariable('time_counter', 'f8', ('time_counter',))[:] = 0.
+    dataset.createVariable('P', 'f4', ('time_counter', 'y', 'x'))[:] = lon[None, :, :]
+    dataset.close()
+    dimensions = {'lon': 'nav_lon', 'lat': 'nav_lat', 'time': 'time_counter', 'data': 'P'}
+    estimate = Field.estimate_memory(dimensions, filename)
+    field = Field.from_netcdf('P', dimensions, [filename])
+    assert(field.axes.curvilinear == curvilinear)
+    usage = field.memory_usage()
+    assert estimate['data'] == usage['data']
+    assert estimate['coordinates'] == sum(n for name, n in usage.items()
+                                          if name not in ['data', 'interpolator_cache', 'total'])
+    assert estimate['peak'] >= estimate['data'] + estimate['coordinates'] + lon.nbytes + lat.nbytes
+
+
+def test_grid_shared_axes(xdim=100, ydim=200):
+    """ Test that fields on identical coordinates share their axes """
+    u, v, lon, lat, depth, time = generate_grid(xdim, ydim)
+    grid = Grid.from_data(u, lon, lat, v, lon.copy(), lat.copy(), depth, time,
+                          field_data={'P': u})
+    assert len(grid.axes) == 1
+    assert grid.U.axes is grid.V.axes and grid.P.axes is grid.U.axes
+    grid.add_field(Field('Q', u, lon=lon.copy(), lat=lat.copy(), transpose=True))
+    assert grid.Q.axes is grid.U.axes
+
+
+@pytest.mark.parametrize('chunksize', [7, 2**22])
+def test_field_sanitise(chunksize, xdim=20, ydim=30, tdim=3):
+    """ Test chunked NaN and vmin/vmax sanitisation against the full pass """
+    data = np.random.randn(xdim, ydim, tdim).astype(np.float32)
+    data[data > 1.5] = np.nan
+    expected = data.copy()
+    expected[expected < -1.] = 0.
+    expected[expected > 1.] = 0.
+    expected[np.isnan(expected)] = 0.
+    # Sanitise the transposed (time, lat, lon) view in place
+    sanitise(np.transpose(data), vmin=-1., vmax=1., chunksize=chunksize)
+    assert np.array_equal(data, expected)
+
+
+def test_field_sanitise_memory_order(xdim=20, ydim=30, tdim=3):
+    """ Test that sanitisation walks transposed data in memory order """
+    data = np.zeros((xdim, ydim, tdim), dtype=np.float32)
+    view = memory_order(np.transpose(data))
+    assert(view.flags['C_CONTIGUOUS'] and view.strides == data.strides)
+    assert np.shares_memory(view, data)
+    field = Field('P', data, lon=np.arange(xdim, dtype=np.float32),
+                  lat=np.arange(ydim, dtype=np.float32),
+                  time=np.arange(tdim, dtype=np.float64), transpose=True)
+    assert(memory_order(field.data).flags['C_CONTIGUOUS'])
+
+
+def test_field_transpose_aliasing(xdim=20, ydim=30):
+    """ Test that transposed fields share clean data but copy dirty data """
+    lon = np.arange(xdim, dtype=np.float32)
+    lat = np.arange(ydim, dtype=np.float32)
+    data = np.ones((xdim, ydim), dtype=np.float32)
+    field = Field('P', data, lon=lon, lat=lat, transpose=True)
+    assert np.shares_memory(field.data, data)
+    data[3, 4] = np.nan
+    field = Field('P', data, lon=lon, lat=lat, transpose=True, vmax=0.5)
+    assert(not np.shares_memory(field.data, data))
+    assert(np.isnan(data[3, 4]) and (data[~np.isnan(data)] == 1.).all())
+    assert((field.data == 0.).all())
+    assert(memory_order(field.data).flags['C_CONTIGUOUS'])
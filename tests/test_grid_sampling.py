@@ -1,4 +1,4 @@
-from parcels import Grid, Particle, JITParticle, Geographic, AdvectionRK4
+from parcels import Grid, NestedGrid, Field, Particle, JITParticle, Geographic, AdvectionRK4
 import numpy as np
 import pytest
 from math import cos, pi
@@ -255,3 +255,430 @@ def test_random_field(mode, xdim=20, ydim=20, npart=100):
     pset.execute(SampleK, endtime=1., dt=1.0)
     sampled = np.array([p.k for p in pset])
     assert((sampled >= 0.).all())
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_staggered(mode, samplefunc, xdim=100, ydim=80, npart=50):
+    """ Sample U and V defined on staggered axes with separate index hints. """
+    lon = np.linspace(-180, 180, xdim, dtype=np.float32)
+    lat = np.linspace(-90, 90, ydim, dtype=np.float32)
+    lon_v = lon[:-1] + 0.5 * (lon[1] - lon[0])
+    lat_v = lat[:-1] + 0.5 * (lat[1] - lat[0])
+    U, _ = np.meshgrid(lat, lon)
+    _, V = np.meshgrid(lat_v, lon_v)
+    grid = Grid.from_data(np.array(U, dtype=np.float32), lon, lat,
+                          np.array(V, dtype=np.float32), lon_v, lat_v,
+                          mesh='flat')
+    assert(len(grid.axes) == 2)
+    assert(grid.index_vars(grid.V.axes) == ('xi_1', 'yi_1', 'ti_1'))
+
+    plon = np.linspace(-170, 170, npart, dtype=np.float32)
+    plat = np.linspace(-80, 80, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=pclass(mode), lon=plon, lat=plat)
+    pset.execute(pset.Kernel(samplefunc), endtime=1., dt=1.)
+    assert np.allclose(np.array([p.u for p in pset]), plat, rtol=1e-5)
+    assert np.allclose(np.array([p.v for p in pset]), plon, rtol=1e-5)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_late_field(grid, mode, xdim=50, ydim=40, npart=20):
+    """ Sample a field on new axes added after creating the particles. """
+    class SampleParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def SampleP(particle, grid, time, dt):
+        particle.p = grid.P[time, particle.lon, particle.lat]
+
+    plon = np.linspace(-170, 170, npart, dtype=np.float32)
+    plat = np.linspace(-80, 80, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=SampleParticle, lon=plon, lat=plat)
+    lon = np.linspace(-180, 180, xdim, dtype=np.float32)
+    lat = np.linspace(-90, 90, ydim, dtype=np.float32)
+    P, _ = np.meshgrid(lon, lat, indexing='ij')
+    field = Field('P', np.array(P, dtype=np.float32), lon=lon, lat=lat, transpose=True)
+    grid.add_field(field)
+    assert(len(grid.axes) == 2)
+    pset.execute(pset.Kernel(SampleP), starttime=0., endtime=2., dt=1.)
+    assert np.allclose(np.array([p.p for p in pset]), plon, rtol=1e-5)
+
+    # Hint names belong to each grid, not to the shared axes
+    other = Grid.from_data(np.array(P, dtype=np.float32), lon, lat,
+                           np.array(P, dtype=np.float32), lon, lat, mesh='flat')
+    other.add_field(field)
+    assert(other.index_vars(field.axes) == ('xi', 'yi', 'ti'))
+    assert(grid.index_vars(field.axes) == ('xi_1', 'yi_1', 'ti_1'))
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_time_hints(mode, xdim=10, ydim=10, npart=20):
+    """ Sample a time-varying field at alternating times per particle. """
+    lon = np.linspace(0., 1., xdim, dtype=np.float32)
+    lat = np.linspace(0., 1., ydim, dtype=np.float32)
+    time = np.linspace(0., 1., 5, dtype=np.float64)
+    P = np.zeros((xdim, ydim, time.size), dtype=np.float32) + time.astype(np.float32)
+    grid = Grid.from_data(np.zeros_like(P), lon, lat, np.zeros_like(P), lon, lat,
+                          time=time, field_data={'P': P}, mesh='flat')
+
+    class TimeParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def SampleAtLat(particle, grid, time, dt):
+        particle.p = grid.P[particle.lat, particle.lon, particle.lat]
+
+    plat = np.tile(np.array([0.1, 0.9], dtype=np.float32), npart // 2)
+    pset = grid.ParticleSet(npart, pclass=TimeParticle, lat=plat,
+                            lon=np.linspace(0., 1., npart, dtype=np.float32))
+    pset.execute(pset.Kernel(SampleAtLat), starttime=0., endtime=1., dt=1.)
+    assert np.allclose(np.array([p.p for p in pset]), plat, rtol=1e-6)
+    if mode == 'jit':
+        assert np.allclose([p.ti for p in pset], np.tile([0, 3], npart // 2))
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+@pytest.mark.parametrize('uniform', [True, False])
+def test_grid_sample_jump(mode, uniform, xdim=200, ydim=100, npart=40):
+    """ Sample after particles jump across large parts of the grid. """
+    lon = np.linspace(0., 1., xdim, dtype=np.float32)
+    lat = np.linspace(0., 1., ydim, dtype=np.float32)
+    if not uniform:
+        lon, lat = lon ** 2, lat ** 3
+    U, V = np.meshgrid(lat, lon)
+    grid = Grid.from_data(np.array(V, dtype=np.float32), lon, lat,
+                          np.array(U, dtype=np.float32), lon, lat, mesh='flat')
+    assert((grid.U.axes.dlon > 0) == uniform)
+
+    def JumpSample(particle, grid, time, dt):
+        particle.lon = 1. - particle.lon
+        particle.lat = 1. - particle.lat
+        particle.u = grid.U[time, particle.lon, particle.lat]
+        particle.v = grid.V[time, particle.lon, particle.lat]
+
+    plon = np.linspace(0.05, 0.95, npart, dtype=np.float32)
+    plat = np.linspace(0.95, 0.05, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=pclass(mode), lon=plon, lat=plat)
+    pset.execute(pset.Kernel(JumpSample), starttime=0., endtime=1., dt=1.)
+    assert np.allclose(np.array([p.u for p in pset]), 1. - plon, rtol=1e-5)
+    assert np.allclose(np.array([p.v for p in pset]), 1. - plat, rtol=1e-5)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_transposed(mode, xdim=30, ydim=20, npart=25):
+    """ Sample time-varying (lon, lat, time) data in place through its
+        transposed view and compare against a C-contiguous copy. """
+    lon = np.linspace(0., 1., xdim, dtype=np.float32)
+    lat = np.linspace(0., 1., ydim, dtype=np.float32)
+    time = np.linspace(0., 1., 3, dtype=np.float64)
+    P = np.random.rand(xdim, ydim, time.size).astype(np.float32)
+    zeros = np.zeros((ydim, xdim, time.size), dtype=np.float32)
+    grid = Grid.from_data(np.zeros_like(P), lon, lat, np.zeros_like(P), lon, lat,
+                          time=time, field_data={'P': P}, mesh='flat')
+    assert(np.may_share_memory(grid.P.data, P))
+    grid_c = Grid.from_data(zeros, lon, lat, zeros, lon, lat, time=time,
+                            field_data={'P': np.transpose(P).copy()},
+                            transpose=False, mesh='flat')
+    assert(grid_c.P.data.flags.c_contiguous)
+
+    class LayoutParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def SampleP(particle, grid, time, dt):
+        particle.p = grid.P[0.7, particle.lon, particle.lat]
+
+    plon = np.linspace(0.05, 0.95, npart, dtype=np.float32)
+    plat = np.linspace(0.9, 0.1, npart, dtype=np.float32)
+    samples = []
+    for g in [grid, grid_c]:
+        pset = g.ParticleSet(npart, pclass=LayoutParticle, lon=plon, lat=plat)
+        pset.execute(pset.Kernel(SampleP), starttime=0., endtime=1., dt=1.)
+        samples.append(np.array([p.p for p in pset]))
+    assert np.allclose(samples[0], samples[1], rtol=1e-6)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+@pytest.mark.parametrize('dtype', [np.int16, np.float16])
+def test_grid_sample_packed(mode, dtype, xdim=30, ydim=20, npart=25):
+    """ Sample packed int16/float16 data, decoded with scale and offset,
+        and compare against the equivalent float32 field. """
+    lon = np.linspace(0., 1., xdim, dtype=np.float32)
+    lat = np.linspace(0., 1., ydim, dtype=np.float32)
+    time = np.linspace(0., 1., 2, dtype=np.float64)
+    packed = (np.random.rand(xdim, ydim, time.size) * 1000).astype(dtype)
+    scale, offset = 0.01, -2.
+    zeros = np.zeros(packed.shape, dtype=np.float32)
+    grid = Grid.from_data(zeros, lon, lat, zeros, lon, lat, time=time, mesh='flat')
+    grid.add_field(Field('P', packed, lon=lon, lat=lat, time=time, transpose=True,
+                         scale_factor=scale, add_offset=offset))
+    assert(grid.P.data.dtype == dtype)
+    assert(grid.P.data.nbytes == packed.nbytes)
+    decoded = packed.astype(np.float32) * np.float32(scale) + np.float32(offset)
+    grid_f = Grid.from_data(zeros, lon, lat, zeros, lon, lat, time=time,
+                            field_data={'P': decoded}, mesh='flat')
+
+    class PackedParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def SampleP(particle, grid, time, dt):
+        particle.p = grid.P[0.3, particle.lon, particle.lat]
+
+    plon = np.linspace(0.05, 0.95, npart, dtype=np.float32)
+    plat = np.linspace(0.9, 0.1, npart, dtype=np.float32)
+    samples = []
+    for g in [grid, grid_f]:
+        pset = g.ParticleSet(npart, pclass=PackedParticle, lon=plon, lat=plat)
+        pset.execute(pset.Kernel(SampleP), starttime=0., endtime=1., dt=1.)
+        samples.append(np.array([p.p for p in pset]))
+    assert np.allclose(samples[0], samples[1], rtol=1e-5)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_tiled(mode, xdim=50, ydim=40, npart=40):
+    """ Sample a land-masked field stored in sparse tiles and compare
+        against the dense field. """
+    lon = np.linspace(0., 1., xdim, dtype=np.float32)
+    lat = np.linspace(0., 1., ydim, dtype=np.float32)
+    time = np.linspace(0., 1., 2, dtype=np.float64)
+    P = np.random.rand(xdim, ydim, time.size).astype(np.float32)
+    P[:xdim // 2, :ydim // 2, :] = np.nan  # Land in one corner
+    zeros = np.zeros(P.shape, dtype=np.float32)
+    grid = Grid.from_data(zeros, lon, lat, zeros, lon, lat, time=time, mesh='flat')
+    grid.add_field(Field('P', P.copy(), lon=lon, lat=lat, time=time,
+                         transpose=True, tile_size=8))
+    grid.add_field(Field('Q', P.copy(), lon=lon, lat=lat, time=time, transpose=True))
+    assert(grid.P.memory_usage()['data'] < grid.Q.memory_usage()['data'])
+    assert np.array_equal(grid.P.data[1, :], grid.Q.data[1, :])
+
+    class TiledParticle(ptype[mode]):
+        user_vars = {'p': np.float32, 'q': np.float32}
+
+    def SamplePQ(particle, grid, time, dt):
+        particle.p = grid.P[0.4, particle.lon, particle.lat]
+        particle.q = grid.Q[0.4, particle.lon, particle.lat]
+
+    plon = np.linspace(0.01, 0.99, npart, dtype=np.float32)
+    plat = np.linspace(0.02, 0.98, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=TiledParticle, lon=plon, lat=plat)
+    pset.execute(pset.Kernel(SamplePQ), starttime=0., endtime=1., dt=1.)
+    assert np.allclose([p.p for p in pset], [p.q for p in pset], rtol=1e-6)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_curvilinear(mode, xdim=40, ydim=30, npart=30):
+    """ Sample a linear function on a rotated and sheared curvilinear
+        grid, which bilinear interpolation reproduces exactly. """
+    x, y = np.meshgrid(np.linspace(0., 4., xdim), np.linspace(0., 3., ydim))
+    lon = (x * np.cos(0.5) - y * np.sin(0.5) + 0.1 * y ** 2).astype(np.float32)
+    lat = (x * np.sin(0.5) + y * np.cos(0.5)).astype(np.float32)
+    P = (lon + 2. * lat).astype(np.float32)
+    grid = Grid.from_data(np.zeros_like(P), lon, lat, np.zeros_like(P), lon, lat,
+                          field_data={'P': P}, transpose=False, mesh='flat')
+    assert(grid.P.axes.curvilinear)
+
+    class CurviParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def SampleJump(particle, grid, time, dt):
+        lon = particle.lat
+        particle.lat = particle.lon
+        particle.lon = lon
+        particle.p = grid.P[time, particle.lon, particle.lat]
+
+    # Points inside the grid that remain inside after swapping lon and lat
+    s, t = np.meshgrid(np.linspace(0.5, 2.5, 6), np.linspace(0.5, 2.5, 5))
+    plon = (s * np.cos(0.5) - t * np.sin(0.5) + 0.1 * t ** 2).ravel()
+    plat = (s * np.sin(0.5) + t * np.cos(0.5)).ravel()
+    inside = [grid.P.axes.search(b, a)[2:] for a, b in zip(plon, plat)]
+    inside = np.array([0 <= xsi <= 1 and 0 <= eta <= 1 for xsi, eta in inside])
+    plon, plat = plon[inside].astype(np.float32), plat[inside].astype(np.float32)
+    pset = grid.ParticleSet(plon.size, pclass=CurviParticle, lon=plon, lat=plat)
+    pset.execute(pset.Kernel(SampleJump), starttime=0., endtime=1., dt=1.)
+    assert np.allclose([p.p for p in pset], plat + 2. * plon, rtol=1e-4)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_nested(mode, npart=41):
+    """ Sample a nested grid, which picks the finest level covering each
+        particle, with a distinct constant field value on each level. """
+    def level_grid(x0, x1, n, value):
+        lon = np.linspace(x0, x1, n, dtype=np.float32)
+        P = np.ones((n, n), dtype=np.float32) * value
+        return Grid.from_data(np.zeros_like(P), lon, lon, np.zeros_like(P), lon, lon,
+                              field_data={'P': P}, mesh='flat')
+    grid = NestedGrid([level_grid(0.2, 0.8, 61, 2.), level_grid(0., 1., 11, 1.),
+                       level_grid(0.4, 0.5, 41, 3.)])
+    assert(len(grid.axes) == 3)
+
+    class NestedParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def SampleP(particle, grid, time, dt):
+        particle.p = grid.P[time, particle.lon, particle.lat]
+
+    plon = np.linspace(0.01, 0.99, npart, dtype=np.float32)
+    plat = np.linspace(0.99, 0.01, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=NestedParticle, lon=plon, lat=plat)
+    pset.execute(pset.Kernel(SampleP), starttime=0., endtime=1., dt=1.)
+
+    def inside(x0, x1):
+        return (plon >= x0) & (plon <= x1) & (plat >= x0) & (plat <= x1)
+    expected = np.where(inside(0.4, 0.5), 3., np.where(inside(0.2, 0.8), 2., 1.))
+    assert np.allclose([p.p for p in pset], expected)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_periodic(mode, xdim=20, ydim=10, npart=30):
+    """ Sample across the seam of a periodic lon axis and check that
+        particle longitudes are wrapped after each kernel call. """
+    lon = np.linspace(0., 1., xdim, endpoint=False, dtype=np.float32)
+    lat = np.linspace(0., 1., ydim, dtype=np.float32)
+    P = np.cos(2. * np.pi * lon).astype(np.float32)[:, None] + np.zeros(ydim, dtype=np.float32)
+    grid = Grid.from_data(np.zeros_like(P), lon, lat, np.zeros_like(P), lon, lat,
+                          field_data={'P': P}, mesh='flat', periodic=True)
+    assert(grid.P.axes.period == pytest.approx(1.))
+
+    class PeriodicParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def MoveSample(particle, grid, time, dt):
+        particle.lon += 0.7
+        particle.p = grid.P[time, particle.lon, particle.lat]
+
+    plon = np.linspace(0.2, 0.99, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=PeriodicParticle, lon=plon,
+                            lat=np.linspace(0.1, 0.9, npart, dtype=np.float32))
+    pset.execute(pset.Kernel(MoveSample), starttime=0., endtime=1., dt=1.)
+    final = np.array([p.lon for p in pset])
+    assert((final >= 0.).all() and (final < 1.).all())
+    assert np.allclose(final, (plon + 0.7) % 1., atol=1e-5)
+    expected = np.interp(final, np.append(lon, 1.), np.append(P[:, 0], P[0, 0]))
+    assert np.allclose([p.p for p in pset], expected, atol=1e-5)
+
+
+def test_grid_sample_struct_cache(grid, samplefunc, npart=50):
+    """ Reuse ctypes field structs and kernel arguments between calls
+        and rebind them once the field data is replaced. """
+    lon = np.linspace(-170, 170, npart, dtype=np.float32)
+    lat = np.linspace(-80, 80, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=pclass('jit'), lon=lon, lat=lat)
+    kernel = pset.Kernel(samplefunc)
+    pset.execute(kernel, starttime=0., endtime=1., dt=1.)
+    assert np.allclose([p.v for p in pset], lon, rtol=1e-6)
+    struct, fargs = grid.V.ctypes_struct, kernel.bind_field_args()
+    assert(grid.V.ctypes_struct is struct and kernel.bind_field_args() is fargs)
+
+    grid.V.data = grid.V.data * 2.
+    assert(grid.V.ctypes_struct is not struct and kernel.bind_field_args() is not fargs)
+    pset.execute(kernel, starttime=1., endtime=2., dt=1.)
+    assert np.allclose([p.v for p in pset], 2. * lon, rtol=1e-6)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_nemo_2d_coords(mode, tmpdir, xdim=30, ydim=20, npart=20):
+    """ Sample a field read from NEMO-style files that store rectilinear
+        coordinates as 2D nav_lon/nav_lat arrays. """
+    from netCDF4 import Dataset
+    lon = np.linspace(0., 3., xdim, dtype=np.float32)
+    lat = np.linspace(-1., 1., ydim, dtype=np.float32)
+    nav_lon, nav_lat = np.meshgrid(lon, lat)
+    P = (nav_lon + 2. * nav_lat).astype(np.float32)
+    basename = str(tmpdir.join('nemo2d'))
+    for var, data in [('U', np.zeros_like(P)), ('V', np.zeros_like(P)), ('P', P)]:
+        dataset = Dataset("%s%s.nc" % (basename, var), 'w')
+        dataset.createDimension('y', ydim)
+        dataset.createDimension('x', xdim)
+        dataset.createDimension('time_counter', 1)
+        dataset.createVariable('nav_lon', 'f4', ('y', 'x'))[:] = nav_lon
+        dataset.createVariable('nav_lat', 'f4', ('y', 'x'))[:] = nav_lat
+        dataset.createVariable('time_counter', 'f8', ('time_counter',))[:] = 0.
+        dataset.createVariable(var, 'f4', ('time_counter', 'y', 'x'))[:] = data[None, :, :]
+        dataset.close()
+    grid = Grid.from_nemo(basename, uvar='U', vvar='V', extra_vars={'P': 'P'}, mesh='flat')
+    assert(not grid.P.axes.curvilinear)
+    assert(grid.P.lat.flags['C_CONTIGUOUS'] and grid.P.lon.flags['C_CONTIGUOUS'])
+
+    class SampleParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def SampleP(particle, grid, time, dt):
+        particle.p = grid.P[time, particle.lon, particle.lat]
+
+    plon = np.linspace(0.1, 2.9, npart, dtype=np.float32)
+    plat = np.linspace(0.9, -0.9, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=SampleParticle, lon=plon, lat=plat)
+    pset.execute(pset.Kernel(SampleP), starttime=0., endtime=1., dt=1.)
+    assert np.allclose(pset.p, plon + 2. * plat, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_grid_sample_packed_missing(mode, tmpdir, xdim=30, ydim=20):
+    """ Sample packed data with missing cells marked by _FillValue and
+        missing_value, including an offset for which zero can not be
+        represented in int16, so that the data is decoded on load. """
+    from netCDF4 import Dataset
+    lon = np.linspace(0., 1., xdim, dtype=np.float32)
+    lat = np.linspace(0., 1., ydim, dtype=np.float32)
+    nav_lon, nav_lat = np.meshgrid(lon, lat)
+    raw = np.full((1, ydim, xdim), 500, dtype=np.int16)
+    raw[0, 2:7, 2:7] = -32767
+    raw[0, 12:17, 20:25] = -32766
+    packings = {'T': (0.001, 273.15), 'S': (0.01, 0.)}
+    basename = str(tmpdir.join('packed'))
+    for var in ['U', 'V', 'T', 'S']:
+        dataset = Dataset("%s%s.nc" % (basename, var), 'w')
+        dataset.createDimension('y', ydim)
+        dataset.createDimension('x', xdim)
+        dataset.createDimension('time_counter', 1)
+        dataset.createVariable('nav_lon', 'f4', ('y', 'x'))[:] = nav_lon
+        dataset.createVariable('nav_lat', 'f4', ('y', 'x'))[:] = nav_lat
+        dataset.createVariable('time_counter', 'f8', ('time_counter',))[:] = 0.
+        data = dataset.createVariable(var, 'i2', ('time_counter', 'y', 'x'), fill_value=-32767)
+        data.set_auto_maskandscale(False)
+        data.missing_value = np.int16(-32766)
+        if var in packings:
+            data.scale_factor, data.add_offset = packings[var]
+        data[:] = raw if var in packings else np.zeros_like(raw)
+        dataset.close()
+    grid = Grid.from_nemo(basename, uvar='U', vvar='V', mesh='flat',
+                          extra_vars={'T': 'T', 'S': 'S'})
+    assert(grid.T.data.dtype == np.float32 and grid.S.data.dtype == np.int16)
+    grid.add_field(Field('Q', np.transpose(raw), lon=lon, lat=lat, transpose=True,
+                         scale_factor=0.001, add_offset=273.15, fill_value=[-32767, -32766]))
+    assert(grid.Q.data.dtype == np.float32)
+
+    class PackedParticle(ptype[mode]):
+        user_vars = {'t': np.float32, 's': np.float32, 'q': np.float32}
+
+    def SampleTSQ(particle, grid, time, dt):
+        particle.t = grid.T[time, particle.lon, particle.lat]
+        particle.s = grid.S[time, particle.lon, particle.lat]
+        particle.q = grid.Q[time, particle.lon, particle.lat]
+
+    plon = np.array([lon[4], lon[22], lon[15]], dtype=np.float32)
+    plat = np.array([lat[4], lat[14], lat[9]], dtype=np.float32)
+    pset = grid.ParticleSet(3, pclass=PackedParticle, lon=plon, lat=plat)
+    pset.execute(pset.Kernel(SampleTSQ), starttime=0., endtime=1., dt=1.)
+    assert np.allclose(pset.t, [0., 0., 273.65], atol=1e-3)
+    assert np.allclose(pset.q, [0., 0., 273.65], atol=1e-3)
+    assert np.allclose(pset.s, [0., 0., 5.], atol=1e-4)
+
+
+def test_grid_sample_last_point(xdim=11, ydim=21, npart=3):
+    """ Sample at the last point of uniformly spaced axes, which lies in
+        the last cell rather than in a cell beyond the grid. """
+    lon = np.linspace(0., 1., xdim, dtype=np.float32)
+    lat = np.linspace(0., 2., ydim, dtype=np.float32)
+    P = (lon[:, None] + lat[None, :]).astype(np.float32)
+    grid = Grid.from_data(np.zeros_like(P), lon, lat, np.zeros_like(P), lon, lat,
+                          field_data={'P': P}, mesh='flat')
+    assert(grid.P.axes.dlon > 0 and grid.P.axes.dlat > 0)
+
+    class SampleParticle(JITParticle):
+        user_vars = {'p': np.float32}
+
+    def SampleP(particle, grid, time, dt):
+        particle.p = grid.P[time, particle.lon, particle.lat]
+
+    pset = grid.ParticleSet(npart, pclass=SampleParticle, lon=np.ones(npart, dtype=np.float32),
+                            lat=np.array([2., 1., 2.], dtype=np.float32))
+    pset.execute(pset.Kernel(SampleP), starttime=0., endtime=1., dt=1.)
+    assert(np.all(pset.xi == xdim - 2) and pset.yi[0] == ydim - 2)
+    assert np.allclose(pset.p, pset.lon + pset.lat, rtol=1e-6)
@@ -1,4 +1,4 @@
-from parcels import Grid, Particle, JITParticle, Kernel
+from parcels import Grid, Particle, JITParticle, Kernel, KernelOp
 from parcels import random as parcels_random
 import numpy as np
 import pytest
@@ -116,3 +116,36 @@ def test_random_float(grid, mode, rngfunc, rngargs, npart=10):
                          'random.%s(%s)' % (rngfunc, ', '.join([str(a) for a in rngargs])))
     pset.execute(kernel, endtime=1., dt=1.)
     assert np.allclose(np.array([p.p for p in pset]), series, rtol=1e-12)
+
+
+@pytest.mark.parametrize('rngfunc, rngargs', [
+    ('random', []),
+    ('uniform', [0., 20.]),
+    ('randint', [0, 20]),
+    ('normalvariate', [0., 1.]),
+])
+def test_random_array(rngfunc, rngargs, npart=10):
+    """ Test that bulk random draws follow the scalar JIT sequence """
+    func = getattr(parcels_random, rngfunc)
+    parcels_random.seed(1234)
+    series = [func(*rngargs) for _ in range(npart)]
+    parcels_random.seed(1234)
+    values = func(*rngargs, size=npart)
+    assert values.shape == (npart, )
+    assert np.allclose(values, series, rtol=1e-12)
+
+
+def test_kernel_merge_namespace(grid, npart=10):
+    """ Test that merged kernels resolve names from the modules of the
+        kernels they were merged from, rather than the calling process """
+    def MoveEast(particle, grid, time, dt):
+        particle.lon += 0.1
+
+    def Succeed(particle, grid, time, dt):
+        return KernelOp.SUCCESS
+
+    pset = grid.ParticleSet(npart, pclass=Particle,
+                            lon=np.linspace(0., 0.5, npart, dtype=np.float32),
+                            lat=np.zeros(npart, dtype=np.float32))
+    pset.execute(pset.Kernel(MoveEast) + Succeed, starttime=0., endtime=1., dt=1.)
+    assert np.allclose(pset.lon, np.linspace(0.1, 0.6, npart), rtol=1e-5)
@@ -1,6 +1,10 @@
-from parcels import Grid, Field, Particle, JITParticle
+from parcels import Grid, Field, Particle, JITParticle, ParticleFile
+from parcels import RawParticleFile, read_raw, convert_raw
+from parcels import random
 import numpy as np
 import pytest
+import json
+from netCDF4 import Dataset
 
 
 ptype = {'scipy': Particle, 'jit': JITParticle}
@@ -46,6 +50,30 @@ def test_pset_create_field(grid, mode, npart=100):
     assert (np.array([p.lon for p in pset]) >= 0.).all()
     assert (np.array([p.lat for p in pset]) <= 1.).all()
     assert (np.array([p.lat for p in pset]) >= 0.).all()
+    assert (K.data == 1.).all()
+
+
+def test_pset_create_field_packed(grid, npart=20):
+    np.random.seed(123456)
+    lon, lat = grid.U.lon, grid.U.lat
+    data = np.zeros((lon.size, lat.size), dtype=np.int16)
+    data[:lon.size // 2, :] = 100
+    K = Field('K', lon=lon, lat=lat, data=data, transpose=True, scale_factor=0.01)
+    pset = grid.ParticleSet(npart, pclass=Particle, start_field=K)
+    # Particles start in the non-zero half and the packed data is unchanged
+    assert (np.array([p.lon for p in pset]) <= lon[lon.size // 2]).all()
+    assert (K.data[0, :, :lon.size // 2] == 100).all()
+
+
+def test_pset_create_field_tiled(grid, npart=20):
+    np.random.seed(123456)
+    lon, lat = grid.U.lon, grid.U.lat
+    data = np.zeros((lon.size, lat.size), dtype=np.float32)
+    data[:lon.size // 2, :] = 1.
+    K = Field('K', lon=lon, lat=lat, data=data, transpose=True, tile_size=8)
+    pset = grid.ParticleSet(npart, pclass=Particle, start_field=K)
+    assert (np.array([p.lon for p in pset]) <= lon[lon.size // 2]).all()
+    assert (K.data[0, :, :lon.size // 2] == 1.).all()
 
 
 @pytest.mark.parametrize('mode', ['scipy', 'jit'])
@@ -197,3 +225,449 @@ def test_pset_multi_execute_delete(grid, mode, npart=10, n=5):
         pset.execute(k_add, starttime=0., endtime=1., dt=1.0)
         pset.remove(-1)
     assert np.allclose([p.lat - n*0.1 for p in pset], np.zeros(npart - n), rtol=1e-12)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_pset_execute_profile(grid, mode, npart=10):
+    def SampleLat(particle, grid, time, dt):
+        particle.lat += grid.V[time, particle.lon, particle.lat] + 0.1
+
+    pset = grid.ParticleSet(npart, pclass=ptype[mode],
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.zeros(npart, dtype=np.float32))
+    assert(pset.profile is None)
+    pset.execute(pset.Kernel(SampleLat), starttime=0., endtime=4., dt=1.,
+                 interval=2., profile=True)
+    report = pset.profile
+    assert(report['mode'] == mode)
+    assert(report['leaps'] == 2 and len(report['timings']['execute']) == 2)
+    assert(report['blocks'] == 2)
+    assert(report['kernel_calls'] == 4 * npart)
+    assert(report['particle_steps'] == 4 * npart)
+    assert(report['field_evals_estimate'] == 4 * npart)
+    assert('field_evals' not in report)
+    assert(json.loads(json.dumps(report)) == report)
+
+
+def test_pset_execute_instrumented(grid, npart=10):
+    def SampleLat(particle, grid, time, dt):
+        particle.lat += grid.V[time, particle.lon, particle.lat] + 0.1
+
+    pset = grid.ParticleSet(npart, pclass=JITParticle,
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.zeros(npart, dtype=np.float32))
+    kernel = pset.Kernel(SampleLat, instrument=True)
+    pset.execute(kernel, starttime=0., endtime=4., dt=1., profile=True)
+    stats = pset.profile['stats']
+    assert(stats == kernel.stats)
+    assert(stats['bilinear_evals'] == 4 * npart)
+    assert(pset.profile['field_evals'] == pset.profile['field_evals_estimate'])
+    assert(stats['index_search_steps'] > 0)
+    assert(stats['kernel_rejections'] == 0)
+    assert(pset.Kernel(SampleLat).stats is None)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_pset_memory_usage(grid, mode, npart=100):
+    pset = grid.ParticleSet(npart, pclass=ptype[mode],
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.linspace(1, 0, npart, dtype=np.float32))
+    usage = pset.memory_usage()
+    assert(usage['particle_data'] == npart * pset.ptype.dtype.itemsize)
+    assert(usage['particles'] == 0 and usage['objects'] == 0)
+    assert(usage['total'] == usage['particle_data'] + usage['particles'] + usage['objects'])
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+@pytest.mark.parametrize('buffer_size', [1, 3, 16])
+def test_pset_output_buffered(grid, mode, buffer_size, tmpdir, npart=10):
+    class SampleParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def Shift(particle, grid, time, dt):
+        particle.lat += 0.1
+        particle.p = particle.lat * 2.
+
+    filepath = tmpdir.join('pfile_buffered')
+    pset = grid.ParticleSet(npart, pclass=SampleParticle,
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.zeros(npart, dtype=np.float32))
+    pfile = pset.ParticleFile(name=str(filepath), buffer_size=buffer_size,
+                              chunksizes=(npart, 4), zlib=True)
+    pset.execute(pset.Kernel(Shift), starttime=0., endtime=5., dt=1.,
+                 interval=1., output_file=pfile)
+    pfile.close()
+    ncfile = Dataset("%s.nc" % filepath, 'r')
+    assert(ncfile.variables['lat'].shape == (npart, 6))
+    assert(ncfile.variables['lat'].chunking() == [npart, 4])
+    assert(ncfile.variables['lat'].filters()['zlib'])
+    lats = np.arange(6) * 0.1
+    assert np.allclose(ncfile.variables['lat'][:], lats[None, :], rtol=1e-5)
+    assert np.allclose(ncfile.variables['p'][:, 1:], 2. * lats[None, 1:], rtol=1e-5)
+    assert np.allclose(ncfile.variables['lon'][:, -1], np.linspace(0, 1, npart), rtol=1e-5)
+    assert np.allclose(ncfile.variables['time'][0, :], np.arange(6.))
+    ncfile.close()
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_pset_output_async(grid, mode, tmpdir, npart=10, nsteps=20):
+    def Shift(particle, grid, time, dt):
+        particle.lat += 0.01
+
+    filepath = tmpdir.join('pfile_async')
+    pset = grid.ParticleSet(npart, pclass=ptype[mode],
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.zeros(npart, dtype=np.float32))
+    pfile = pset.ParticleFile(name=str(filepath), buffer_size=2,
+                              asynchronous=True, queue_size=1)
+    pset.execute(pset.Kernel(Shift), starttime=0., endtime=nsteps, dt=1.,
+                 interval=1., output_file=pfile)
+    assert(pfile.queue.empty() and len(pfile.buffer) == 0)
+    pfile.close()
+    assert(not pfile.writer.is_alive())
+    ncfile = Dataset("%s.nc" % filepath, 'r')
+    lats = np.arange(nsteps + 1) * 0.01
+    assert np.allclose(ncfile.variables['lat'][:], lats[None, :], rtol=1e-4)
+    assert np.allclose(ncfile.variables['time'][0, :], np.arange(nsteps + 1.))
+    ncfile.close()
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_pset_output_ragged_delete(grid, mode, tmpdir, npart=10):
+    def DeleteEast(particle, grid, time, dt):
+        particle.lat += 0.1
+        if particle.lon > 0.5 and time >= 1.:
+            particle.delete()
+
+    filepath = tmpdir.join('pfile_ragged')
+    pset = grid.ParticleSet(npart, pclass=ptype[mode],
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.zeros(npart, dtype=np.float32))
+    ids = np.array([p.id for p in pset])
+    assert(np.unique(ids).size == npart)
+    pfile = pset.ParticleFile(name=str(filepath), buffer_size=2, ragged=True)
+    pset.execute(pset.Kernel(DeleteEast), starttime=0., endtime=4., dt=1.,
+                 interval=1., output_file=pfile)
+    pfile.close()
+    ncfile = Dataset("%s.nc" % filepath, 'r')
+    traj = ncfile.variables['trajectory'][:]
+    index = ncfile.variables['trajectory_index'][:]
+    assert(np.all(traj == ids))
+    # West particles are written at all 5 output times, east ones twice
+    nwest = np.sum(np.linspace(0, 1, npart) <= 0.5)
+    assert(index.size == 5 * nwest + 2 * (npart - nwest))
+    lat = ncfile.variables['lat'][:]
+    time = ncfile.variables['time'][:]
+    assert np.allclose(lat, 0.1 * time, rtol=1e-5)
+    counts = np.bincount(index, minlength=npart)
+    assert(np.all(counts[:nwest] == 5) and np.all(counts[nwest:] == 2))
+    ncfile.close()
+
+
+def test_pset_output_ragged_add(grid, tmpdir, npart=10):
+    def Shift(particle, grid, time, dt):
+        particle.lat += 0.1
+
+    filepath = tmpdir.join('pfile_ragged_add')
+    pset = grid.ParticleSet(npart, pclass=Particle,
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.zeros(npart, dtype=np.float32))
+    pfile = pset.ParticleFile(name=str(filepath), ragged=True)
+    pset.execute(pset.Kernel(Shift), starttime=0., endtime=2., dt=1.,
+                 interval=1., output_file=pfile)
+    new = grid.ParticleSet(npart, pclass=Particle,
+                           lon=np.linspace(0, 1, npart, dtype=np.float32),
+                           lat=np.zeros(npart, dtype=np.float32))
+    for p in new:
+        p.time = 2.
+    pset.add(new)
+    pset.execute(pset.Kernel(Shift), starttime=2., endtime=4., dt=1.,
+                 interval=1., output_file=pfile)
+    pfile.close()
+    ncfile = Dataset("%s.nc" % filepath, 'r')
+    assert(ncfile.dimensions['trajectory'].size == 2 * npart)
+    counts = np.bincount(ncfile.variables['trajectory_index'][:])
+    assert(np.all(counts[:npart] == 5) and np.all(counts[npart:] == 2))
+    ncfile.close()
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+@pytest.mark.parametrize('ragged', [False, True])
+def test_pset_output_raw(grid, mode, ragged, tmpdir, npart=10):
+    class SampleParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def Shift(particle, grid, time, dt):
+        particle.lat += 0.1
+        particle.p = particle.lat * 2.
+
+    def run(name, filetype):
+        pset = grid.ParticleSet(npart, pclass=SampleParticle,
+                                lon=np.linspace(0, 1, npart, dtype=np.float32),
+                                lat=np.zeros(npart, dtype=np.float32))
+        pfile = filetype(str(tmpdir.join(name)), pset)
+        pset.execute(pset.Kernel(Shift), starttime=0., endtime=4., dt=1.,
+                     interval=1., output_file=pfile)
+        pfile.close()
+        return pset
+
+    pset = run('pfile_raw', RawParticleFile)
+    run('pfile_nc', ParticleFile)
+    raw = read_raw(str(tmpdir.join('pfile_raw')))
+    assert(isinstance(raw['lat'], np.memmap) and raw['lat'].size == 5 * npart)
+    assert np.allclose(raw['time'], np.arange(5.))
+    assert np.allclose(raw['lat'][raw['offset'][-1]:], 0.4, rtol=1e-5)
+    assert(np.all(raw['id'][:npart] == [p.id for p in pset]))
+
+    convert_raw(str(tmpdir.join('pfile_raw')), ragged=ragged)
+    converted = Dataset("%s.nc" % tmpdir.join('pfile_raw'), 'r')
+    reference = Dataset("%s.nc" % tmpdir.join('pfile_nc'), 'r')
+    for var in ['time', 'lat', 'lon', 'z', 'p']:
+        values = converted.variables[var][:]
+        if ragged:
+            values = values.reshape(5, npart).T
+        assert np.allclose(values, reference.variables[var][:])
+    converted.close()
+    reference.close()
+
+
+def test_pset_output_schedule_random(grid, tmpdir, npart=10, nsteps=4):
+    from parcels.compiler import GNUCompiler
+
+    def Jitter(particle, grid, time, dt):
+        particle.lat += random.uniform(0., 0.01)
+
+    def jitter_pset(seed=1234):
+        random.seed(seed)
+        return grid.ParticleSet(npart, pclass=JITParticle,
+                                lon=np.linspace(0, 1, npart, dtype=np.float32),
+                                lat=np.zeros(npart, dtype=np.float32))
+
+    reference = jitter_pset()
+    reference.execute(reference.Kernel(Jitter), starttime=0., endtime=nsteps, dt=1., interval=1.)
+    # Stochastic kernels run one output time per call, which keeps the
+    # order of random draws and thus the seeded trajectories
+    pset = jitter_pset()
+    pfile = RawParticleFile(str(tmpdir.join('pfile_random')), pset)
+    pset.execute(pset.Kernel(Jitter), starttime=0., endtime=nsteps, dt=1., interval=1.,
+                 output_file=pfile, profile=True)
+    pfile.close()
+    assert(pset.profile['blocks'] == nsteps)
+    assert np.allclose(pset.lat, reference.lat, rtol=1e-12)
+    # Recording all output times in one call advances each particle
+    # through the schedule in turn, which reorders the random draws
+    pset = jitter_pset()
+    kernel = pset.Kernel(Jitter)
+    kernel.compile(compiler=GNUCompiler())
+    kernel.load_lib()
+    pset.time, pset.dt = 0., 1.
+    output = np.empty((nsteps - 1, npart), dtype=pset.ptype.dtype)
+    kernel.execute(pset, endtime=nsteps, dt=1., output_times=np.arange(1., nsteps), output=output)
+    assert not np.allclose(pset.lat, reference.lat, rtol=1e-12)
+    assert np.isclose(pset.lat.sum(), reference.lat.sum(), rtol=1e-5)
+
+
+def test_pset_output_schedule(grid, tmpdir, npart=10, nsteps=8):
+    class SampleParticle(JITParticle):
+        user_vars = {'p': np.float32}
+
+    def Shift(particle, grid, time, dt):
+        particle.lat += 0.05
+        particle.p = time
+
+    filepath = str(tmpdir.join('pfile_schedule'))
+    pset = grid.ParticleSet(npart, pclass=SampleParticle,
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.zeros(npart, dtype=np.float32))
+    # All output steps of a run are recorded in a single compiled loop call
+    pfile = RawParticleFile(filepath, pset)
+    pset.execute(pset.Kernel(Shift), starttime=0., endtime=nsteps, dt=0.5,
+                 interval=1., output_file=pfile, profile=True)
+    assert(pset.profile['blocks'] == 1)
+    assert(len(pset.profile['timings']['execute']) == nsteps)
+    assert(pset.profile['kernel_calls'] == 2 * nsteps * npart)
+    # Small output buffers split the schedule into several calls
+    pset.output_buffer_bytes = 3 * npart * pset.ptype.dtype.itemsize
+    pset.execute(pset.kernel, starttime=nsteps, endtime=2 * nsteps, dt=0.5,
+                 interval=1., output_file=pfile, profile=True)
+    assert(pset.profile['blocks'] == 3)
+    assert(len(pset.profile['timings']['execute']) == nsteps)
+    assert(len(pset.profile['timings']['write']) == nsteps)
+    pfile.close()
+
+    raw = read_raw(filepath)
+    assert np.allclose(raw['time'], np.arange(2 * nsteps + 1.))
+    lat = np.asarray(raw['lat']).reshape(2 * nsteps + 1, npart)
+    assert np.allclose(lat, 0.1 * np.arange(2 * nsteps + 1.)[:, None], rtol=1e-5)
+    p = np.asarray(raw['p'][npart:]).reshape(2 * nsteps, npart)
+    assert np.allclose(p, np.arange(2 * nsteps)[:, None] + 0.5)
+
+    output = np.empty((2, npart), dtype=pset.ptype.dtype)
+    pset.kernel.execute(pset, endtime=2 * nsteps + 3, dt=1.,
+                        output_times=[2 * nsteps + 1, 2 * nsteps + 2], output=output)
+    assert np.allclose(output['time'], np.arange(2 * nsteps + 1, 2 * nsteps + 3)[:, None])
+    assert np.allclose(pset._particle_data['time'], 2 * nsteps + 3)
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_pset_attribute_views(grid, mode, npart=100):
+    class SampleParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    lon = np.linspace(0, 1, npart, dtype=np.float32)
+    lat = np.linspace(1, 0, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=SampleParticle, lon=lon, lat=lat)
+    assert np.allclose(pset.lon, lon, rtol=1e-12)
+    assert np.allclose(pset.lat, lat, rtol=1e-12)
+    assert('p' in pset.variables and 'lon' in pset.variables)
+    pset.p = 2.
+    pset.lat = lat + 1.
+    assert np.allclose([p.p for p in pset], 2.)
+    assert np.allclose([p.lat for p in pset], lat + 1., rtol=1e-12)
+    if mode == 'jit':
+        # Views share memory with the particle data
+        lons = pset.lon
+        lons[0] = 5.
+        assert(pset[0].lon == 5.)
+    with pytest.raises(AttributeError):
+        pset.unknown
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_pset_particle_views(grid, mode, npart=100):
+    lon = np.linspace(0, 1, npart, dtype=np.float32)
+    lat = np.linspace(1, 0, npart, dtype=np.float32)
+    pset = grid.ParticleSet(npart, pclass=ptype[mode], lon=lon, lat=lat)
+    # Particles are views onto the particle data of the set
+    assert(isinstance(pset[3], ptype[mode]))
+    pset[3].lon = 0.5
+    assert(pset.lon[3] == 0.5)
+    assert(len(pset[10:20]) == 10 and pset[10:20][0].id == pset[10].id)
+    with pytest.warns(DeprecationWarning):
+        particles = pset.particles
+    assert(particles.size == npart and particles[3].lon == 0.5)
+    with pytest.raises(ValueError):
+        particles[0] = particles[1]
+    # Removed particles hold a copy of their data
+    ids = pset.id.copy()
+    removed = pset.remove([0, 1])
+    assert(pset.size == npart - 2 and [p.id for p in removed] == list(ids[:2]))
+    removed[0].lon = 2.
+    assert((pset.lon <= 1.).all())
+
+
+def test_pset_particle_adhoc_vars(grid, npart=10):
+    def Count(particle, grid, time, dt):
+        particle.visits = getattr(particle, 'visits', 0) + 1
+
+    pset = grid.ParticleSet(npart, pclass=Particle,
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.linspace(1, 0, npart, dtype=np.float32))
+    # Undeclared attributes survive the particle views of each kernel call
+    pset.execute(pset.Kernel(Count), starttime=0., endtime=2., dt=1.)
+    pset.execute(pset.kernel, starttime=2., endtime=4., dt=1.)
+    assert([p.visits for p in pset] == [4] * npart)
+    assert('visits' not in pset.variables)
+
+    class StrictParticle(Particle):
+        strict_vars = True
+
+    pset = grid.ParticleSet(npart, pclass=StrictParticle,
+                            lon=np.linspace(0, 1, npart, dtype=np.float32),
+                            lat=np.linspace(1, 0, npart, dtype=np.float32))
+    with pytest.raises(AttributeError):
+        pset[0].undeclared = 1.
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+def test_pset_sort(grid, mode, tmpdir, npart=50):
+    from parcels.particle import morton_code, index_hints
+
+    def Drift(particle, grid, time, dt):
+        particle.lat += 0.01 * particle.lon
+        particle.lon += 0.01
+
+    np.random.seed(1234)
+    lon = np.random.uniform(0., 0.8, npart).astype(np.float32)
+    lat = np.random.uniform(0., 0.8, npart).astype(np.float32)
+    results = []
+    for sort_interval in [None, 2]:
+        pset = grid.ParticleSet(npart, pclass=ptype[mode], lon=lon, lat=lat)
+        filepath = str(tmpdir.join('pfile_sort_%s' % sort_interval))
+        pset.execute(pset.Kernel(Drift), starttime=0., endtime=6., dt=1., interval=1.,
+                     output_file=pset.ParticleFile(name=filepath), sort_interval=sort_interval)
+        results.append((pset, Dataset("%s.nc" % filepath, 'r')))
+    (unsorted, ncfile), (ordered, ncsorted) = results
+    assert(not np.array_equal(ordered.id - ordered.id.min(), np.arange(npart)))
+    ordered.sort()
+    codes = morton_code(*index_hints(grid, ordered.lon, ordered.lat))
+    assert(np.all(codes[1:] >= codes[:-1]))
+    # Results and output are attributed to the same particles by id
+    order = np.argsort(ordered.id)
+    assert np.allclose(ordered.lat[order], unsorted.lat, rtol=1e-6)
+    for var in ['lon', 'lat']:
+        assert np.allclose(ncsorted.variables[var][:], ncfile.variables[var][:], rtol=1e-6)
+    ncfile.close()
+    ncsorted.close()
+
+
+@pytest.mark.parametrize('mode', ['scipy', 'jit'])
+@pytest.mark.parametrize('ragged', [False, True])
+def test_pset_checkpoint(grid, mode, ragged, tmpdir, npart=10):
+    class SampleParticle(ptype[mode]):
+        user_vars = {'p': np.float32}
+
+    def Shift(particle, grid, time, dt):
+        particle.lat += 0.1
+        particle.p = particle.lat * 2.
+
+    def create():
+        return grid.ParticleSet(npart, pclass=SampleParticle,
+                                lon=np.linspace(0, 1, npart, dtype=np.float32),
+                                lat=np.zeros(npart, dtype=np.float32))
+
+    reference = create()
+    pfile = reference.ParticleFile(name=str(tmpdir.join('pfile_ref')), ragged=ragged)
+    reference.execute(reference.Kernel(Shift), starttime=0., endtime=4., dt=1.,
+                      interval=1., output_file=pfile)
+    pfile.close()
+
+    # Interrupted run that continues for one step after its checkpoint
+    pset = create()
+    filepath = str(tmpdir.join('pfile_chk'))
+    checkpoint = str(tmpdir.join('pset.chk'))
+    pfile = pset.ParticleFile(name=filepath, ragged=ragged)
+    pset.execute(pset.Kernel(Shift), starttime=0., endtime=2., dt=1.,
+                 interval=1., output_file=pfile)
+    np.random.seed(1234)
+    pset.checkpoint(checkpoint, output_file=pfile)
+    draw = np.random.uniform(size=4)
+    pset.execute(pset.Kernel(Shift), starttime=2., endtime=3., dt=1.,
+                 interval=1., output_file=pfile)
+    pfile.close()
+
+    restored = pset.from_checkpoint(checkpoint, grid, pclass=SampleParticle)
+    assert(restored.restart['time'] == 2.)
+    assert np.allclose(np.random.uniform(size=4), draw)
+    assert(np.all(restored.id == pset.id) and restored.size == npart)
+    assert np.allclose(restored.lat, 0.2, rtol=1e-5)
+    pfile = restored.ParticleFile(name=filepath, restart=restored.restart['output'])
+    restored.execute(restored.Kernel(Shift), starttime=restored.restart['time'], endtime=4.,
+                     dt=1., interval=1., output_file=pfile)
+    pfile.close()
+    assert np.allclose(restored.lat, reference.lat, rtol=1e-5)
+
+    resumed = Dataset("%s.nc" % filepath, 'r')
+    expected = Dataset("%s.nc" % tmpdir.join('pfile_ref'), 'r')
+    for var in ['time', 'lat', 'lon', 'p']:
+        assert np.allclose(resumed.variables[var][:], expected.variables[var][:], rtol=1e-5)
+    resumed.close()
+    expected.close()
+
+    # A new checkpoint replaces the previous one in place
+    restored.checkpoint(checkpoint)
+    assert(not tmpdir.join('pset.chk.tmp').check())
+    assert(pset.from_checkpoint(checkpoint, grid, pclass=SampleParticle).restart['time'] == 4.)
+
+    with pytest.raises(ValueError):
+        pset.from_checkpoint(checkpoint, grid, pclass=ptype[mode])